@@ -0,0 +1,40 @@
+# Fixed integer action space. Card plays are by position in the player's hand, and ids
+# are ordered so a mask lists actions in the order the UI shows them.
+(PLAY_CARD_0, PLAY_CARD_1, PLAY_CARD_2,
+ ENVIDO_QUIERO, ENVIDO_NO_QUIERO, CALL_ENVIDO, CALL_REAL_ENVIDO, CALL_FALTA_ENVIDO,
+ TRUCO_QUIERO, TRUCO_NO_QUIERO, CALL_TRUCO, CALL_RETRUCO, CALL_VALE_4) = range(13)
+NUM_ACTIONS = 13
+
+# String names used by the web API, the console and the logs
+ACTION_NAMES = (
+    'play_card_0', 'play_card_1', 'play_card_2',
+    'envido_quiero', 'envido_no_quiero', 'call_envido', 'call_real_envido', 'call_falta_envido',
+    'truco_quiero', 'truco_no_quiero', 'call_truco', 'call_retruco', 'call_vale_4',
+)
+ACTION_IDS = {name: i for i, name in enumerate(ACTION_NAMES)}
+
+# Call actions by the envido/truco state they call
+CALL_ACTIONS = {
+    'envido': CALL_ENVIDO, 'real_envido': CALL_REAL_ENVIDO, 'falta_envido': CALL_FALTA_ENVIDO,
+    'truco': CALL_TRUCO, 'retruco': CALL_RETRUCO, 'vale_4': CALL_VALE_4,
+}
+CALL_TYPES = {action: call for call, action in CALL_ACTIONS.items()}
+
+PLAY_MASK = (1 << PLAY_CARD_0) | (1 << PLAY_CARD_1) | (1 << PLAY_CARD_2)
+# Mask of playing any of the first n cards of the hand
+HAND_MASKS = (0, 1, 3, 7)
+ENVIDO_CALL_MASK = (1 << CALL_ENVIDO) | (1 << CALL_REAL_ENVIDO) | (1 << CALL_FALTA_ENVIDO)
+ENVIDO_ANSWER_MASK = (1 << ENVIDO_QUIERO) | (1 << ENVIDO_NO_QUIERO)
+TRUCO_ANSWER_MASK = (1 << TRUCO_QUIERO) | (1 << TRUCO_NO_QUIERO)
+
+# Action ids set in each mask, in increasing order
+MASK_ACTIONS = tuple(tuple(a for a in range(NUM_ACTIONS) if mask >> a & 1) for mask in range(1 << NUM_ACTIONS))
+
+def mask_to_names(mask):
+    return [ACTION_NAMES[a] for a in MASK_ACTIONS[mask]]
+
+def names_to_mask(names):
+    mask = 0
+    for name in names:
+        mask |= 1 << ACTION_IDS[name]
+    return mask
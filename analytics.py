@@ -0,0 +1,310 @@
+import argparse
+import json
+import os
+import time
+from collections import deque
+from multiprocessing import Pool
+
+import numpy as np
+
+from actions import ENVIDO_QUIERO, CALL_ENVIDO, CALL_FALTA_ENVIDO, TRUCO_QUIERO, CALL_TRUCO, ENVIDO_CALL_MASK
+from batch_env import BatchTrucoEnv
+from equity import get_table, hand_equity_batch
+from records import decode, read_bodies
+
+# Aggregate statistics over game record files (records.py). Records are read in chunks
+# of CHUNK_GAMES and each chunk is replayed on a BatchTrucoEnv, all its games in
+# lockstep, so every statistic is a vectorized count over one step of thousands of games.
+# Chunks go to a pool of workers with a bounded number in flight, and every result is a
+# fixed-size count array, so memory stays constant however many games are processed.
+#
+# The counts are written as one .npy file per column into an output directory, with a
+# summary.json; `report` reads them memory-mapped without touching the records again,
+# and `build --append` adds more record files to existing counts.
+#
+#   envido_*   [mano/pie, envido points]: chances to open the envido, calls by type
+#              (envido, real envido, falta envido), answers, accepts and raises
+#   truco_*    [equity decile of the dealt hand, truco/retruco/vale 4]: answers to a
+#              truco call, accepts and raises
+#   by target score: games, games won by the first hand's mano (p1), hands, points
+#              scored by the mano and the pie, hands where either scored more
+
+CHUNK_GAMES = 4096
+ENVIDO_POINTS = 34
+EQUITY_BUCKETS = 10
+TRUCO_LEVELS = 3
+MAX_TARGET = 100
+VERSION = 1
+
+COLUMNS = {
+    'envido_chances': (2, ENVIDO_POINTS),
+    'envido_calls': (2, ENVIDO_POINTS, 3),
+    'envido_answers': (2, ENVIDO_POINTS),
+    'envido_accepts': (2, ENVIDO_POINTS),
+    'envido_raises': (2, ENVIDO_POINTS),
+    'truco_answers': (EQUITY_BUCKETS, TRUCO_LEVELS),
+    'truco_accepts': (EQUITY_BUCKETS, TRUCO_LEVELS),
+    'truco_raises': (EQUITY_BUCKETS, TRUCO_LEVELS),
+    'games': (MAX_TARGET,),
+    'first_mano_wins': (MAX_TARGET,),
+    'hands': (MAX_TARGET,),
+    'mano_points': (MAX_TARGET,),
+    'pie_points': (MAX_TARGET,),
+    'mano_ahead': (MAX_TARGET,),
+    'pie_ahead': (MAX_TARGET,),
+}
+
+def empty_counts():
+    return {name: np.zeros(shape, dtype=np.int64) for name, shape in COLUMNS.items()}
+
+def _count(counts, name, index, where):
+    # Adds one to counts[name] at each flat index where `where` holds
+    column = counts[name]
+    column += np.bincount(index[where], minlength=column.size).reshape(column.shape)
+
+def _replay_group(records, target, counts):
+    # Adds the counts of games of one target score. Returns the number of games that did
+    # not replay to their recorded score, which are left out of every count: a group
+    # with such games is replayed again without them.
+    group = empty_counts()
+    failed = _replay(records, target, group)
+    if failed.any():
+        group = empty_counts()
+        good = [record for record, bad in zip(records, failed) if not bad]
+        if good:
+            _replay(good, target, group)
+    for name, column in group.items():
+        counts[name] += column
+    return int(failed.sum())
+
+def _replay(records, target, counts):
+    # Replays games of one target score in lockstep and adds their counts. Returns which
+    # games did not replay to their recorded score.
+    n = len(records)
+    i = np.arange(n)
+    env = BatchTrucoEnv(n, target_score=target, auto_reset=False)
+    env.reset()
+    lengths = np.array([len(r.actions) for r in records])
+    actions = np.zeros((n, lengths.max() + 1), dtype=np.int64)
+    for row, record in enumerate(records):
+        actions[row, :len(record.actions)] = np.frombuffer(record.actions, dtype=np.uint8)
+    hand_counts = np.array([len(r.hands) for r in records])
+    hand_start = np.concatenate(([0], hand_counts.cumsum()[:-1]))
+    dealt = np.array([hand for r in records for hand in r.hands], dtype=np.int64).reshape(-1, 6)
+    next_hand = np.ones(n, dtype=np.int64)
+    equity = np.zeros((n, 2))
+    hand_points = np.zeros((n, 2), dtype=np.int64)
+    failed = np.zeros(n, dtype=bool)
+    t_index = min(target, MAX_TARGET - 1)
+
+    def deal(games):
+        cards = dealt[hand_start[games] + next_hand[games] - 1]
+        env.deal(games, cards)
+        mano = env.hand_number[games] % 2
+        equity[games, 0] = hand_equity_batch(cards[:, :3], mano == 0)
+        equity[games, 1] = hand_equity_batch(cards[:, 3:], mano == 1)
+
+    deal(i)
+    for step in range(actions.shape[1]):
+        # Games out of actions before the end, or with an action the rules reject, stop here
+        bits = env.legal_bits()
+        action = actions[:, step]
+        broken = ~env.done & ((step >= lengths) | (bits >> action & 1 == 0))
+        failed |= broken
+        env.done |= broken
+        live = ~env.done
+        if not live.any():
+            break
+
+        cur = env.current
+        role = (cur != env.hand_number % 2).astype(np.int64) # 0 mano, 1 pie
+        points = np.minimum(env.envido_points[i, cur], ENVIDO_POINTS - 1)
+        calls = (action >= CALL_ENVIDO) & (action <= CALL_FALTA_ENVIDO)
+        by_points = role * ENVIDO_POINTS + points
+        chance = live & (env.waiting == 0) & (bits & ENVIDO_CALL_MASK != 0)
+        _count(counts, 'envido_chances', by_points, chance)
+        _count(counts, 'envido_calls', by_points * 3 + action - CALL_ENVIDO, chance & calls)
+        answer = live & (env.waiting == 1)
+        _count(counts, 'envido_answers', by_points, answer)
+        _count(counts, 'envido_accepts', by_points, answer & (action == ENVIDO_QUIERO))
+        _count(counts, 'envido_raises', by_points, answer & calls)
+        answer = live & (env.waiting == 2)
+        decile = np.minimum((equity[i, cur] * EQUITY_BUCKETS).astype(np.int64), EQUITY_BUCKETS - 1)
+        by_strength = decile * TRUCO_LEVELS + np.maximum(env.truco_state - 1, 0)
+        _count(counts, 'truco_answers', by_strength, answer)
+        _count(counts, 'truco_accepts', by_strength, answer & (action == TRUCO_QUIERO))
+        _count(counts, 'truco_raises', by_strength, answer & (action >= CALL_TRUCO))
+
+        hand_number = env.hand_number.copy()
+        _, _, rewards, dones = env.step(action)
+        hand_points += rewards
+        ended = np.nonzero(live & ((env.hand_number != hand_number) | dones))[0]
+        if len(ended):
+            mano = hand_number[ended] % 2
+            mano_points = hand_points[ended, mano]
+            pie_points = hand_points[ended, 1 - mano]
+            counts['hands'][t_index] += len(ended)
+            counts['mano_points'][t_index] += mano_points.sum()
+            counts['pie_points'][t_index] += pie_points.sum()
+            counts['mano_ahead'][t_index] += (mano_points > pie_points).sum()
+            counts['pie_ahead'][t_index] += (pie_points > mano_points).sum()
+            hand_points[ended] = 0
+            more = ended[~env.done[ended]]
+            out_of_hands = next_hand[more] >= hand_counts[more]
+            failed[more[out_of_hands]] = True
+            env.done[more[out_of_hands]] = True
+            more = more[~out_of_hands]
+            next_hand[more] += 1
+            deal(more)
+
+    recorded = np.array([r.scores for r in records])
+    failed |= ~env.done | (env.scores != recorded).any(axis=1)
+    good = ~failed
+    counts['games'][t_index] += good.sum()
+    counts['first_mano_wins'][t_index] += (good & (env.scores[:, 0] >= target)).sum()
+    return failed
+
+def aggregate_chunk(bodies):
+    # Counts of a list of encoded records: (counts, games, errors)
+    counts = empty_counts()
+    records = [decode(body) for body in bodies]
+    errors = 0
+    for target in sorted({r.target_score for r in records}):
+        errors += _replay_group([r for r in records if r.target_score == target], target, counts)
+    return counts, len(records), errors
+
+def chunks(paths, size=CHUNK_GAMES):
+    chunk = []
+    for path in paths:
+        for body in read_bodies(path):
+            chunk.append(body)
+            if len(chunk) == size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+def aggregate(paths, processes=None, chunk_size=CHUNK_GAMES):
+    # Counts over every game of the record files: (counts, games, errors)
+    counts, games, errors = empty_counts(), 0, 0
+
+    def merge(result):
+        nonlocal games, errors
+        chunk_counts, chunk_games, chunk_errors = result
+        for name, column in chunk_counts.items():
+            counts[name] += column
+        games += chunk_games
+        errors += chunk_errors
+
+    if processes == 1:
+        for chunk in chunks(paths, chunk_size):
+            merge(aggregate_chunk(chunk))
+        return counts, games, errors
+
+    # Forked workers share the equity table
+    get_table()
+    processes = processes or os.cpu_count()
+    with Pool(processes) as pool:
+        # A few chunks per worker in flight: reading never runs ahead of the workers
+        pending = deque()
+        for chunk in chunks(paths, chunk_size):
+            pending.append(pool.apply_async(aggregate_chunk, (chunk,)))
+            if len(pending) >= 2 * processes:
+                merge(pending.popleft().get())
+        while pending:
+            merge(pending.popleft().get())
+    return counts, games, errors
+
+def save(directory, counts, summary):
+    os.makedirs(directory, exist_ok=True)
+    for name, column in counts.items():
+        np.save(os.path.join(directory, name + '.npy'), column)
+    with open(os.path.join(directory, 'summary.json'), 'w') as f:
+        json.dump(summary, f, indent=2)
+
+def load(directory, mmap_mode='r'):
+    # (counts, summary) of an output directory, the counts memory-mapped by default
+    with open(os.path.join(directory, 'summary.json')) as f:
+        summary = json.load(f)
+    if summary.get('version') != VERSION:
+        raise ValueError(f"{directory} has analytics version {summary.get('version')}, expected {VERSION}")
+    counts = {name: np.load(os.path.join(directory, name + '.npy'), mmap_mode=mmap_mode) for name in COLUMNS}
+    return counts, summary
+
+def build(paths, directory, processes=None, append=False):
+    counts, games, errors = aggregate(paths, processes)
+    summary = {'version': VERSION, 'games': games, 'errors': errors, 'sources': list(paths)}
+    if append and os.path.exists(os.path.join(directory, 'summary.json')):
+        previous, old = load(directory, mmap_mode=None)
+        for name in COLUMNS:
+            counts[name] += previous[name]
+        summary = {'version': VERSION, 'games': old['games'] + games, 'errors': old['errors'] + errors,
+                   'sources': old['sources'] + list(paths)}
+    save(directory, counts, summary)
+    return summary
+
+def _rate(part, whole):
+    return f"{part / whole:6.1%}" if whole else "     -"
+
+def report(directory, sections=('envido', 'truco', 'mano')):
+    counts, summary = load(directory)
+    lines = [f"{summary['games']} games from {len(summary['sources'])} record files, {summary['errors']} not replayable"]
+    if 'envido' in sections:
+        lines.append("")
+        lines.append("Envido by points     opened  (chances)  real  falta | accepted  raised  (answers)")
+        for role, name in enumerate(('mano', 'pie')):
+            for points in range(ENVIDO_POINTS):
+                chances = counts['envido_chances'][role, points]
+                answers = counts['envido_answers'][role, points]
+                if not chances and not answers:
+                    continue
+                calls = counts['envido_calls'][role, points]
+                lines.append(f"  {name:4} {points:2}          {_rate(calls.sum(), chances)} {chances:10} "
+                             f"{_rate(calls[1], chances)} {_rate(calls[2], chances)} | "
+                             f"{_rate(counts['envido_accepts'][role, points], answers)}  "
+                             f"{_rate(counts['envido_raises'][role, points], answers)} {answers:10}")
+    if 'truco' in sections:
+        lines.append("")
+        lines.append("Truco answers by hand equity   truco accepted/raised       retruco              vale 4")
+        for decile in range(EQUITY_BUCKETS):
+            row = f"  {decile * 10:3}-{decile * 10 + 10:3}%              "
+            for level in range(TRUCO_LEVELS):
+                answers = counts['truco_answers'][decile, level]
+                row += (f"  {_rate(counts['truco_accepts'][decile, level], answers)}"
+                        f"/{_rate(counts['truco_raises'][decile, level], answers)} ({answers})")
+            lines.append(row)
+    if 'mano' in sections:
+        lines.append("")
+        lines.append("Mano advantage    games  first mano wins    hands  mano pts/hand  pie pts/hand  mano ahead  pie ahead")
+        for target in np.nonzero(counts['hands'])[0]:
+            games, hands = counts['games'][target], counts['hands'][target]
+            lines.append(f"  to {target:3}     {games:9}           {_rate(counts['first_mano_wins'][target], games)} "
+                         f"{hands:9}         {counts['mano_points'][target] / hands:6.3f}        "
+                         f"{counts['pie_points'][target] / hands:6.3f}      {_rate(counts['mano_ahead'][target], hands)}"
+                         f"     {_rate(counts['pie_ahead'][target], hands)}")
+    return "\n".join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Aggregate statistics over game record files")
+    sub = parser.add_subparsers(dest='command', required=True)
+    build_parser = sub.add_parser('build', help="replay record files into count columns")
+    build_parser.add_argument('paths', nargs='+')
+    build_parser.add_argument('-o', '--output', required=True, help="directory for the .npy columns")
+    build_parser.add_argument('--processes', type=int, default=None, help="worker processes (default: all cores)")
+    build_parser.add_argument('--append', action='store_true', help="add to the counts already in --output")
+    report_parser = sub.add_parser('report', help="print the statistics of an output directory")
+    report_parser.add_argument('directory')
+    report_parser.add_argument('--section', action='append', choices=['envido', 'truco', 'mano'])
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        start = time.perf_counter()
+        summary = build(args.paths, args.output, args.processes, args.append)
+        elapsed = time.perf_counter() - start
+        print(f"Wrote {args.output}: {summary['games']} games in total, {summary['errors']} not replayable "
+              f"({elapsed:.1f}s)")
+        return
+    print(report(args.directory, args.section or ('envido', 'truco', 'mano')))
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,91 @@
-from flask import Flask, jsonify, request, send_from_directory
+from flask import Flask, Response, abort, jsonify, make_response, request, send_from_directory
+import json
 import os
+import metrics
 from game import TrucoGame, GamePhase
-from player import APIPlayer, HeuristicBot
+from player import APIPlayer, ISMCTSBot, NeuralBot
+from scheduler import BotScheduler
+from sessions import GameMoved, GameRegistry, GameSession
+from shard import HashRing
+from store import GameStore, new_seed
 
 app = Flask(__name__, static_folder='static')
 
-# Global game instance
-game = None
+# Bot turns run in the background, after a human-like pause
+scheduler = BotScheduler(
+    workers=int(os.environ.get('TRUCO_BOT_WORKERS', 4)),
+    delay=float(os.environ.get('TRUCO_BOT_DELAY', 0.6)),
+)
+
+# Opponent policy: 'ismcts' (search) or 'neural' (policy net). The neural bots of all
+# games share one inference batcher, so concurrent bot moves cost one matrix multiply;
+# batches can only be as large as TRUCO_BOT_WORKERS.
+BOT = os.environ.get('TRUCO_BOT', 'ismcts')
+inference = None
+if BOT == 'neural':
+    from neural import BatchedInference, get_net # numpy is only needed for this bot
+    inference = BatchedInference(get_net(), window=float(os.environ.get('TRUCO_INFERENCE_WINDOW', 0.002)))
+
+def make_bot():
+    if BOT == 'neural':
+        return NeuralBot("Bot", inference=inference)
+    return ISMCTSBot("Bot", time_budget_ms=150)
+
+def make_players():
+    return APIPlayer("Player"), make_bot()
+
+def resume_bot(session):
+    # A game rehydrated from the store may have been waiting for the bot
+    with session.lock:
+        if METRICS:
+            metrics.instrument_game(session.game, bots=(session.game.p2,))
+        scheduler.schedule(session)
+
+# Every accepted action is written to this SQLite file, so games survive a restart and
+# are loaded again the first time they are asked for. TRUCO_DB='' keeps games in memory only.
+DB_PATH = os.environ.get('TRUCO_DB', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'games.db'))
+store = GameStore(DB_PATH, make_players) if DB_PATH else None
+
+# Live games, one per browser session
+registry = GameRegistry(
+    max_games=int(os.environ.get('TRUCO_MAX_GAMES', 10000)),
+    ttl=float(os.environ.get('TRUCO_GAME_TTL', 3600)),
+    store=store,
+    on_load=resume_bot,
+)
+
+# Sharded deployment (shard.py): this process is worker TRUCO_SHARD of the comma-separated
+# TRUCO_SHARDS and only serves the games the hash ring gives it. Workers share the store,
+# which is how a game reaches its new owner when the ring changes.
+SHARD = os.environ.get('TRUCO_SHARD')
+if SHARD:
+    if store is None:
+        raise RuntimeError("Shard workers need a game store, TRUCO_DB can't be empty")
+    ring = HashRing(os.environ['TRUCO_SHARDS'].split(','))
+    registry.reassign(lambda game_id: ring.owner(game_id) == SHARD)
+
+# TRUCO_METRICS=1 times the game engine, the bot and every route and serves the numbers
+# at /metrics in the Prometheus text format; TRUCO_PROFILE=1 also serves the sampling
+# profiler at /debug/profile. Both are off by default and cost nothing then. Behind the
+# shard router, scrape and profile each worker on its own port.
+METRICS = os.environ.get('TRUCO_METRICS') == '1'
+PROFILE = os.environ.get('TRUCO_PROFILE') == '1'
+if METRICS:
+    metrics.install(app, registry, GameSession)
+
+# Seconds between keep-alive comments on an idle stream
+STREAM_KEEPALIVE = 15
+
+def find_session(game_id):
+    # Games are addressed by /api/games/<game_id>/... or, for the plain routes, by cookie
+    try:
+        return registry.get(game_id or request.cookies.get('game_id', ''))
+    except GameMoved:
+        misdirected()
+
+def misdirected():
+    # 421: the game is another shard's, the router sends the request again to the owner
+    abort(make_response(jsonify({"error": "Game is served by another shard"}), 421))
 
 @app.route('/')
 def index():
@@ -18,58 +97,142 @@ def serve_static(path):
 
 @app.route('/api/start', methods=['POST'])
 def start_game():
-    global game
     data = request.json or {}
     target = data.get('target_score', 30)
     
-    p1 = APIPlayer("Player")
-    p2 = HeuristicBot("Bot")
-    game = TrucoGame(p1, p2, target_score=target)
-    return jsonify({"status": "started", "target": target})
+    p1, p2 = make_players()
+    # Behind the shard router, the router picks the id so it knows where the game lives
+    game_id = request.headers.get('X-Truco-Game-Id') if SHARD else None
+    game = TrucoGame(p1, p2, target_score=target, seed=new_seed())
+    if METRICS:
+        metrics.instrument_game(game, bots=(p2,))
+    try:
+        session = registry.create(game, game_id)
+    except GameMoved:
+        misdirected()
+    with session.lock:
+        # The bot may be mano
+        scheduler.schedule(session)
+    response = jsonify({"status": "started", "target": target, "game_id": session.id})
+    response.set_cookie('game_id', session.id, httponly=True, samesite='Lax')
+    return response
 
 @app.route('/api/state', methods=['GET'])
-def get_state():
-    global game
-    if not game:
+@app.route('/api/games/<game_id>/state', methods=['GET'])
+@app.route('/api/games/<game_id>/spectate', methods=['GET'], defaults={'spectator': True})
+def get_state(game_id=None, spectator=False):
+    # The player's state, or with /spectate what anyone watching the table may see.
+    # ?text=1 adds the narration of the events.
+    session = find_session(game_id)
+    if not session:
         return jsonify({"error": "No game active"}), 400
-        
-    state = game.get_state_for_player(game.p1)
-    
-    # Check if we need bot to play
-    # Bot only plays if it is its turn AND we are NOT waiting for a human response
-    turn_ok = game.phase == GamePhase.PLAYING and game.current_turn == game.p2
-    
-    if turn_ok:
-        bot_state = game.get_state_for_player(game.p2)
-        action = game.p2.get_action(bot_state)
-        
-        if action:
-            success, msg = game.handle_action(game.p2, action)
-            if success:
-                # Refresh state after bot plays
-                state = game.get_state_for_player(game.p1)
-                state['last_bot_action'] = action
-    
-    return jsonify(state)
+
+    since = request.args.get('since', type=int)
+    text = bool(request.args.get('text', type=int))
+    with session.lock:
+        if session.released:
+            misdirected()
+        version = session.game.version
+        etag = f"{session.id}-{version}{'-spectator' if spectator else ''}{'-text' if text else ''}"
+        # Nothing new for a client that already has this version
+        if since == version or request.if_none_match.contains(etag):
+            response = app.response_class(status=304)
+        else:
+            response = app.response_class(session.encoded(since, spectator, text), mimetype='application/json')
+    response.set_etag(etag)
+    return response
+
+@app.route('/api/stream', methods=['GET'])
+@app.route('/api/games/<game_id>/stream', methods=['GET'])
+@app.route('/api/games/<game_id>/spectate/stream', methods=['GET'], defaults={'spectator': True})
+def stream_state(game_id=None, spectator=False):
+    # Server-Sent Events: the player's (or spectators') state is pushed every time the
+    # game changes, starting with the current one, until the game is over. Streams
+    # watching the same game share one encoded message per change.
+    session = find_session(game_id)
+    if not session:
+        return jsonify({"error": "No game active"}), 400
+    text = bool(request.args.get('text', type=int))
+
+    def events():
+        sent = None
+        while True:
+            with session.lock:
+                if session.game.version == sent and not session.released:
+                    session.changed.wait(STREAM_KEEPALIVE)
+                if session.released:
+                    # The game moved shards: the client reconnects through the router
+                    return
+                body = None
+                if session.game.version != sent:
+                    # The first message is the whole state, then only what changed
+                    body = session.encoded(sent, spectator, text)
+                    sent = session.game.version
+                    over = session.game.phase == GamePhase.GAME_OVER
+            if body is None:
+                yield b": keep-alive\n\n"
+                continue
+            yield b"data: " + body + b"\n\n"
+            if over:
+                return
+
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/api/action', methods=['POST'])
-def handle_action():
-    global game
-    if not game:
+@app.route('/api/games/<game_id>/action', methods=['POST'])
+def handle_action(game_id=None):
+    session = find_session(game_id)
+    if not session:
         return jsonify({"error": "No game active"}), 400
         
     data = request.json
     action = data.get('action')
     
-    if not action:
+    # Ids count too, and 0 is play_card_0
+    if action is None or action == '':
         return jsonify({"error": "No action provided"}), 400
+    # Like ?since= of the state routes: anything but a version number gets the full state
+    since = data.get('since')
+    if since.__class__ is not int:
+        since = None
         
-    success, msg = game.handle_action(game.p1, action)
+    with session.lock:
+        if session.released:
+            misdirected()
+        success, msg = session.act(session.game.p1, action)
+        if success:
+            session.notify()
+            scheduler.schedule(session)
+            # The new state comes back with the answer, no second request needed
+            state = session.encoded(since, text=bool(data.get('text')))
     
     if not success:
         return jsonify({"error": msg}), 400
         
-    return jsonify({"status": "success", "message": msg})
+    body = b'{"status":"success","message":%s,"state":%s}' % (json.dumps(msg).encode(), state)
+    return app.response_class(body, mimetype='application/json')
+
+@app.route('/api/shard/ring', methods=['POST'])
+def set_shard_ring():
+    # Sent by the router when workers are added: games that now hash to another worker
+    # are flushed to the store and let go. The router never forwards /api/shard/ itself.
+    if not SHARD:
+        return jsonify({"error": "Not a shard worker"}), 404
+    new_ring = HashRing(request.json["shards"])
+    released = registry.reassign(lambda game_id: new_ring.owner(game_id) == SHARD)
+    return jsonify({"released": released})
+
+@app.route('/debug/profile', methods=['GET'])
+def profile():
+    # Samples every thread for ?seconds= (default 10, at most 60) and answers the stacks,
+    # folded for flamegraph.pl: curl .../debug/profile?seconds=30 | flamegraph.pl > out.svg
+    if not PROFILE:
+        abort(404)
+    seconds = min(request.args.get('seconds', 10, type=float), 60)
+    interval = max(request.args.get('interval', 0.005, type=float), 0.001)
+    stacks = metrics.SamplingProfiler(interval).sample(seconds)
+    return Response(metrics.SamplingProfiler.folded(stacks), mimetype='text/plain')
 
 if __name__ == '__main__':
     # Ensure static folder exists
@@ -0,0 +1,372 @@
+import numpy as np
+
+from actions import (NUM_ACTIONS, PLAY_CARD_2, ENVIDO_QUIERO, ENVIDO_NO_QUIERO, CALL_ENVIDO,
+                     CALL_FALTA_ENVIDO, TRUCO_QUIERO, TRUCO_NO_QUIERO, CALL_TRUCO,
+                     CALL_ACTIONS, HAND_MASKS, ENVIDO_CALL_MASK, ENVIDO_ANSWER_MASK, TRUCO_ANSWER_MASK)
+from card import TRUCO_VALUE
+from envido import EnvidoState, calculate_envido_points_batch, get_envido_raises, get_quiero_points
+from game import (GamePhase, get_hand_winner, P1_SCORE, P2_SCORE, HAND_NUMBER, PHASE, CURRENT_TURN,
+                  RESUME_TURN, TRUCO_OWNER, TRUCO_TURN, ENVIDO_WINNER, HAND1, HAND2, PLAYED1, PLAYED2,
+                  ON_TABLE, ROUND_WINNERS, ENVIDO_STATE, ENVIDO_HISTORY, ENVIDO_PLAYED,
+                  ENVIDO_POINTS1, ENVIDO_POINTS2, TRUCO_STATE, WAITING_FOR_RESPONSE)
+from truco import TrucoState
+
+# N games of TrucoGame's rules stepped in lockstep, with all state in NumPy arrays so
+# one step costs a fixed number of array operations whatever N is. Seats are 0 (p1) and
+# 1 (p2); -1 means nobody. Actions are the ids of actions.py, one per game, for the
+# player to move. TrucoGame stays the reference: snapshot() and restore() convert to and
+# from its snapshot tuples, which is how the two are cross-checked.
+
+# Envido and truco states as small ints
+ENVIDO_STATES = (EnvidoState.NOT_CALLED, EnvidoState.ENVIDO, EnvidoState.REAL_ENVIDO,
+                 EnvidoState.FALTA_ENVIDO, EnvidoState.ENVIDO_ENVIDO, EnvidoState.ENVIDO_REAL_ENVIDO,
+                 EnvidoState.ENVIDO_ENVIDO_REAL_ENVIDO)
+ENVIDO_CODES = {state: i for i, state in enumerate(ENVIDO_STATES)}
+FALTA = ENVIDO_CODES[EnvidoState.FALTA_ENVIDO]
+TRUCO_STATES = (TrucoState.NOT_CALLED, TrucoState.TRUCO, TrucoState.RETRUCO, TrucoState.VALE_4)
+TRUCO_CODES = {state: i for i, state in enumerate(TRUCO_STATES)}
+WAITING = (None, 'envido', 'truco')
+WAITING_CODES = {w: i for i, w in enumerate(WAITING)}
+
+# ENVIDO_RAISE[state, call] is the state a call (0 envido, 1 real, 2 falta) leads to, or -1
+ENVIDO_RAISE = np.full((len(ENVIDO_STATES), 3), -1, dtype=np.int64)
+ENVIDO_RAISE_MASK = np.zeros(len(ENVIDO_STATES), dtype=np.int64)
+for _code, _state in enumerate(ENVIDO_STATES):
+    for _call, _next in get_envido_raises(_state).items():
+        ENVIDO_RAISE[_code, CALL_ACTIONS[_call] - CALL_ENVIDO] = ENVIDO_CODES[_next]
+        ENVIDO_RAISE_MASK[_code] |= 1 << CALL_ACTIONS[_call]
+# Points of an accepted envido (falta is computed from the score)
+ENVIDO_QUIERO_POINTS = np.array([0] + [get_quiero_points(s, 0, 0) for s in ENVIDO_STATES[1:]], dtype=np.int64)
+# Points of a rejected envido, by the state before the last call (get_reject_points)
+ENVIDO_REJECT_POINTS = np.where(np.arange(len(ENVIDO_STATES)) == 0, 1, ENVIDO_QUIERO_POINTS)
+# The state each non-falta state was raised from; falta keeps its own in envido_prev
+ENVIDO_PARENT = {1: 0, 2: 0, 4: 1, 5: 1, 6: 4}
+
+# HAND_WINNER[tricks, w0, w1, w2, mano] = winning seat + 1, or 0 while the hand goes on.
+# Trick results w are 1 (seat 0), 2 (seat 1) or 0 (parda), as in TrucoGame.round_winners.
+HAND_WINNER = np.zeros((4, 3, 3, 3, 2), dtype=np.int64)
+for _t in range(4):
+    for _w in np.ndindex(3, 3, 3):
+        for _mano in range(2):
+            _winner = get_hand_winner(list(_w[:_t]), _mano + 1) if _t else None
+            HAND_WINNER[_t][_w][_mano] = _winner or 0
+
+TRUCO_VALUES = np.array(TRUCO_VALUE, dtype=np.int64)
+# Hand positions after playing card k (position 3 is always empty)
+_REMOVE = np.array([[1, 2, 3, 3], [0, 2, 3, 3], [0, 1, 3, 3]])
+_BITS = np.arange(NUM_ACTIONS)
+
+# Observation of the player to move, one row per game:
+#   0-2 own cards in hand, 3-5 own played cards, 6-8 opponent's played cards (card ids, -1 none)
+#   9-11 trick results (1 own, 2 opponent's, 0 parda, -1 not played)
+#   12 own score, 13 opponent's score, 14 mano (1 if own), 15 truco state, 16 envido state,
+#   17 waiting for (0 nothing, 1 envido, 2 truco), 18 own envido points,
+#   19 opponent's envido points if an accepted envido revealed them (else -1),
+#   20 can raise the truco, 21 envido already played, 22 target score
+OBS_SIZE = 23
+
+class BatchTrucoEnv:
+    def __init__(self, num_envs, target_score=30, seed=None, auto_reset=True):
+        self.num_envs = num_envs
+        self.target_score = target_score
+        self.auto_reset = auto_reset
+        self.rng = np.random.default_rng(seed)
+        self.index = np.arange(num_envs)
+        n = num_envs
+        self.scores = np.zeros((n, 2), dtype=np.int64)
+        self.hand_number = np.zeros(n, dtype=np.int64)
+        self.done = np.zeros(n, dtype=bool)
+        self.current = np.zeros(n, dtype=np.int64)
+        self.resume = np.full(n, -1, dtype=np.int64)
+        self.truco_owner = np.full(n, -1, dtype=np.int64)
+        self.truco_turn = np.full(n, -1, dtype=np.int64)
+        self.envido_winner = np.full(n, -1, dtype=np.int64)
+        self.hands = np.full((n, 2, 4), -1, dtype=np.int64)
+        self.hand_size = np.zeros((n, 2), dtype=np.int64)
+        self.played = np.full((n, 2, 3), -1, dtype=np.int64)
+        self.table = np.full((n, 2), -1, dtype=np.int64)
+        self.table_size = np.zeros(n, dtype=np.int64)
+        self.round_winners = np.full((n, 3), -1, dtype=np.int64)
+        self.tricks = np.zeros(n, dtype=np.int64)
+        self.envido_state = np.zeros(n, dtype=np.int64)
+        self.envido_prev = np.zeros(n, dtype=np.int64)
+        self.envido_played = np.zeros(n, dtype=bool)
+        self.envido_points = np.zeros((n, 2), dtype=np.int64)
+        self.truco_state = np.zeros(n, dtype=np.int64)
+        self.waiting = np.zeros(n, dtype=np.int64)
+
+    def reset(self, envs=None):
+        # New games in envs (all by default). Returns observations and legal-action masks.
+        envs = self.index if envs is None else envs
+        self.scores[envs] = 0
+        self.hand_number[envs] = 0
+        self.done[envs] = False
+        self.new_hand(envs)
+        return self.observe(), self.legal_mask()
+
+    def new_hand(self, envs):
+        self.current[envs] = self.hand_number[envs] % 2
+        self.resume[envs] = -1
+        self.truco_owner[envs] = -1
+        self.truco_turn[envs] = -1
+        self.envido_winner[envs] = -1
+        self.played[envs] = -1
+        self.table[envs] = -1
+        self.table_size[envs] = 0
+        self.round_winners[envs] = -1
+        self.tricks[envs] = 0
+        self.envido_state[envs] = 0
+        self.envido_prev[envs] = 0
+        self.envido_played[envs] = False
+        self.truco_state[envs] = 0
+        self.waiting[envs] = 0
+        # Six distinct cards per game: the first six of a random permutation
+        self.deal(envs, np.argsort(self.rng.random((len(envs), 40)), axis=1)[:, :6])
+
+    def deal(self, envs, cards):
+        # Replaces the hands of envs: cards is (len(envs), 6), p1's three then p2's
+        cards = np.asarray(cards, dtype=np.int64)
+        self.hands[envs, :, :3] = cards.reshape(-1, 2, 3)
+        self.hands[envs, :, 3] = -1
+        self.hand_size[envs] = 3
+        self.envido_points[envs] = calculate_envido_points_batch(cards.reshape(-1, 3)).reshape(-1, 2)
+
+    def legal_bits(self):
+        # Legal actions as one int bitmask per game, as TrucoGame.get_valid_mask
+        i, cur = self.index, self.current
+        waiting = self.waiting
+        truco_next = np.where(self.truco_state < 3, 1 << (CALL_TRUCO + np.minimum(self.truco_state, 2)), 0)
+
+        open_envido = ((self.tricks == 0) & (self.hand_size[i, cur] == 3) & (self.envido_state == 0)
+                       & ~self.envido_played & (self.truco_state == 0))
+        play = (np.array(HAND_MASKS)[self.hand_size[i, cur]]
+                | np.where(open_envido, ENVIDO_CALL_MASK, 0)
+                | np.where(self.truco_state == 0, 1 << CALL_TRUCO, 0)
+                | np.where((self.truco_state > 0) & (self.truco_turn == cur), truco_next, 0))
+        bits = np.where(waiting == 1, ENVIDO_ANSWER_MASK | ENVIDO_RAISE_MASK[self.envido_state],
+                        np.where(waiting == 2, TRUCO_ANSWER_MASK | truco_next, play))
+        return np.where(self.done, 0, bits)
+
+    def legal_mask(self):
+        return (self.legal_bits()[:, None] >> _BITS) & 1 == 1
+
+    def observe(self):
+        i, cur = self.index, self.current
+        opp = 1 - cur
+        obs = np.empty((self.num_envs, OBS_SIZE), dtype=np.int64)
+        obs[:, 0:3] = self.hands[i, cur, :3]
+        obs[:, 3:6] = self.played[i, cur]
+        obs[:, 6:9] = self.played[i, opp]
+        rw = self.round_winners
+        obs[:, 9:12] = np.where(rw > 0, np.where(rw - 1 == cur[:, None], 1, 2), rw)
+        obs[:, 12] = self.scores[i, cur]
+        obs[:, 13] = self.scores[i, opp]
+        obs[:, 14] = self.hand_number % 2 == cur
+        obs[:, 15] = self.truco_state
+        obs[:, 16] = self.envido_state
+        obs[:, 17] = self.waiting
+        obs[:, 18] = self.envido_points[i, cur]
+        obs[:, 19] = np.where(self.envido_winner >= 0, self.envido_points[i, opp], -1)
+        obs[:, 20] = (self.truco_state > 0) & (self.truco_turn == cur)
+        obs[:, 21] = self.envido_played
+        obs[:, 22] = self.target_score
+        return obs
+
+    def step(self, actions):
+        # Plays one action in every game that is not over. Returns observations, legal
+        # masks, the points each seat scored in this step (N x 2) and done flags; with
+        # auto_reset, finished games start over and their new first observation is returned.
+        actions = np.asarray(actions, dtype=np.int64)
+        live = ~self.done
+        if not (self.legal_bits()[live] >> actions[live] & 1).all():
+            raise ValueError("Illegal action in batch step")
+        n = self.num_envs
+        cur = self.current.copy()
+        opp = 1 - cur
+        before = self.scores.copy()
+        hand_over = np.zeros(n, dtype=bool)
+
+        # Calls
+        calls = live & (((actions >= CALL_ENVIDO) & (actions <= CALL_FALTA_ENVIDO)) | (actions >= CALL_TRUCO))
+        self.resume = np.where(calls & (self.waiting == 0), cur, self.resume)
+        envido_call = np.nonzero(live & (actions >= CALL_ENVIDO) & (actions <= CALL_FALTA_ENVIDO))[0]
+        if len(envido_call):
+            state = self.envido_state[envido_call]
+            self.envido_prev[envido_call] = state
+            self.envido_state[envido_call] = ENVIDO_RAISE[state, actions[envido_call] - CALL_ENVIDO]
+            self.envido_played[envido_call] = True
+            self.waiting[envido_call] = 1
+        truco_call = np.nonzero(live & (actions >= CALL_TRUCO))[0]
+        if len(truco_call):
+            self.truco_state[truco_call] = actions[truco_call] - CALL_TRUCO + 1
+            self.truco_owner[truco_call] = cur[truco_call]
+            self.truco_turn[truco_call] = -1
+            self.waiting[truco_call] = 2
+        self.current = np.where(calls, opp, self.current)
+
+        # Envido answers
+        envido_answer = np.nonzero(live & ((actions == ENVIDO_QUIERO) | (actions == ENVIDO_NO_QUIERO)))[0]
+        if len(envido_answer):
+            e = envido_answer
+            accepted = actions[e] == ENVIDO_QUIERO
+            state = self.envido_state[e]
+            points = self.envido_points[e]
+            mano = self.hand_number[e] % 2
+            winner = np.where(points[:, 0] > points[:, 1], 0, np.where(points[:, 1] > points[:, 0], 1, mano))
+            falta = self.target_score - self.scores[e].max(axis=1)
+            stake = np.where(state == FALTA, falta, ENVIDO_QUIERO_POINTS[state])
+            # A rejection pays the caller what was accepted before the last call
+            winner = np.where(accepted, winner, opp[e])
+            stake = np.where(accepted, stake, ENVIDO_REJECT_POINTS[self.envido_prev[e]])
+            self.scores[e, winner] += stake
+            self.envido_winner[e] = np.where(accepted, winner, self.envido_winner[e])
+            self.waiting[e] = 0
+            self.current[e] = self.resume[e]
+
+        # Truco answers
+        truco_yes = np.nonzero(live & (actions == TRUCO_QUIERO))[0]
+        if len(truco_yes):
+            # As TrucoGame: accepting a retruco settles the hand at vale 4
+            state = self.truco_state[truco_yes]
+            self.truco_state[truco_yes] = np.where(state == 2, 3, state)
+            self.truco_turn[truco_yes] = opp[truco_yes]
+            self.waiting[truco_yes] = 0
+            self.current[truco_yes] = self.resume[truco_yes]
+        truco_no = np.nonzero(live & (actions == TRUCO_NO_QUIERO))[0]
+        if len(truco_no):
+            self.scores[truco_no, opp[truco_no]] += self.truco_state[truco_no]
+            hand_over[truco_no] = True
+
+        # Card plays
+        plays = np.nonzero(live & (actions <= PLAY_CARD_2))[0]
+        if len(plays):
+            p, seat, k = plays, cur[plays], actions[plays]
+            card = self.hands[p, seat, k]
+            self.hands[p, seat] = np.take_along_axis(self.hands[p, seat], _REMOVE[k], axis=1)
+            self.played[p, seat, 3 - self.hand_size[p, seat]] = card
+            self.hand_size[p, seat] -= 1
+            self.table[p, self.table_size[p]] = card
+            self.table_size[p] += 1
+
+            first = p[self.table_size[p] == 1]
+            self.current[first] = opp[first]
+
+            trick = p[self.table_size[p] == 2]
+            if len(trick):
+                second = cur[trick]
+                lead = TRUCO_VALUES[self.table[trick, 0]]
+                answer = TRUCO_VALUES[self.table[trick, 1]]
+                # 1 for seat 0, 2 for seat 1, 0 for parda
+                result = np.where(lead > answer, 2 - second, np.where(answer > lead, second + 1, 0))
+                self.round_winners[trick, self.tricks[trick]] = result
+                self.tricks[trick] += 1
+                self.table[trick] = -1
+                self.table_size[trick] = 0
+                mano = self.hand_number[trick] % 2
+                self.current[trick] = np.where(result > 0, result - 1, mano)
+
+                rw = np.maximum(self.round_winners[trick], 0)
+                winner = HAND_WINNER[self.tricks[trick], rw[:, 0], rw[:, 1], rw[:, 2], mano]
+                won = winner > 0
+                t = trick[won]
+                self.scores[t, winner[won] - 1] += self.truco_state[t] + 1
+                hand_over[t] = True
+
+        # End of hands and games
+        self.hand_number += hand_over
+        over = live & (self.scores >= self.target_score).any(axis=1)
+        self.done |= over
+        rewards = self.scores - before
+        next_hand = np.nonzero(hand_over & ~over)[0]
+        if len(next_hand):
+            self.new_hand(next_hand)
+        dones = over
+        if self.auto_reset and over.any():
+            self.reset(np.nonzero(over)[0])
+        return self.observe(), self.legal_mask(), rewards, dones
+
+    def winner(self):
+        # Seat that reached the target in each finished game, -1 while playing
+        return np.where(self.done, np.where(self.scores[:, 0] >= self.target_score, 0, 1), -1)
+
+    # Conversion to and from TrucoGame snapshots
+
+    def snapshot(self, i):
+        def seat(s):
+            return int(s) + 1 if s >= 0 else 0
+
+        def cards(row, size):
+            return tuple(int(c) for c in row[:size])
+
+        state, prev = int(self.envido_state[i]), int(self.envido_prev[i])
+        history = []
+        while state:
+            history.append(ENVIDO_STATES[state])
+            state, prev = (prev, 0) if state == FALTA else (ENVIDO_PARENT[state], 0)
+        played = 3 - self.hand_size[i]
+        return (
+            int(self.scores[i, 0]), int(self.scores[i, 1]), int(self.hand_number[i]),
+            GamePhase.GAME_OVER if self.done[i] else GamePhase.PLAYING,
+            seat(self.current[i]), seat(self.resume[i]), seat(self.truco_owner[i]),
+            seat(self.truco_turn[i]), seat(self.envido_winner[i]),
+            cards(self.hands[i, 0], self.hand_size[i, 0]), cards(self.hands[i, 1], self.hand_size[i, 1]),
+            cards(self.played[i, 0], played[0]), cards(self.played[i, 1], played[1]),
+            cards(self.table[i], self.table_size[i]),
+            tuple(int(w) for w in self.round_winners[i, :self.tricks[i]]),
+            ENVIDO_STATES[int(self.envido_state[i])], tuple(reversed(history)), bool(self.envido_played[i]),
+            int(self.envido_points[i, 0]), int(self.envido_points[i, 1]),
+            TRUCO_STATES[int(self.truco_state[i])], WAITING[int(self.waiting[i])],
+        )
+
+    def restore(self, i, snapshot):
+        self.scores[i] = snapshot[P1_SCORE], snapshot[P2_SCORE]
+        self.hand_number[i] = snapshot[HAND_NUMBER]
+        self.done[i] = snapshot[PHASE] == GamePhase.GAME_OVER
+        self.current[i] = snapshot[CURRENT_TURN] - 1
+        self.resume[i] = snapshot[RESUME_TURN] - 1
+        self.truco_owner[i] = snapshot[TRUCO_OWNER] - 1
+        self.truco_turn[i] = snapshot[TRUCO_TURN] - 1
+        self.envido_winner[i] = snapshot[ENVIDO_WINNER] - 1
+        for seat, hand, played in ((0, HAND1, PLAYED1), (1, HAND2, PLAYED2)):
+            self.hands[i, seat] = -1
+            self.hands[i, seat, :len(snapshot[hand])] = snapshot[hand]
+            self.hand_size[i, seat] = len(snapshot[hand])
+            self.played[i, seat] = -1
+            self.played[i, seat, :len(snapshot[played])] = snapshot[played]
+        self.table[i] = -1
+        self.table[i, :len(snapshot[ON_TABLE])] = snapshot[ON_TABLE]
+        self.table_size[i] = len(snapshot[ON_TABLE])
+        self.round_winners[i] = -1
+        self.round_winners[i, :len(snapshot[ROUND_WINNERS])] = snapshot[ROUND_WINNERS]
+        self.tricks[i] = len(snapshot[ROUND_WINNERS])
+        history = snapshot[ENVIDO_HISTORY]
+        self.envido_state[i] = ENVIDO_CODES[snapshot[ENVIDO_STATE]]
+        self.envido_prev[i] = ENVIDO_CODES[history[-2]] if len(history) > 1 else 0
+        self.envido_played[i] = snapshot[ENVIDO_PLAYED]
+        self.envido_points[i] = snapshot[ENVIDO_POINTS1], snapshot[ENVIDO_POINTS2]
+        self.truco_state[i] = TRUCO_CODES[snapshot[TRUCO_STATE]]
+        self.waiting[i] = WAITING_CODES[snapshot[WAITING_FOR_RESPONSE]]
+
+def observation_from_info_set(info_set, seat, target_score):
+    # The observation row BatchTrucoEnv gives seat (1 or 2), built from a TrucoGame info set
+    me, other = (0, 1) if seat == 1 else (1, 0)
+    hands, played = (info_set[HAND1], info_set[HAND2]), (info_set[PLAYED1], info_set[PLAYED2])
+    scores = (info_set[P1_SCORE], info_set[P2_SCORE])
+    points = (info_set[ENVIDO_POINTS1], info_set[ENVIDO_POINTS2])
+
+    def pad(cards):
+        return list(cards) + [-1] * (3 - len(cards))
+
+    tricks = [w if w == 0 else (1 if w == seat else 2) for w in info_set[ROUND_WINNERS]]
+    return (pad(hands[me]) + pad(played[me]) + pad(played[other]) + pad(tricks) + [
+        scores[me], scores[other],
+        int(info_set[HAND_NUMBER] % 2 == me),
+        TRUCO_CODES[info_set[TRUCO_STATE]],
+        ENVIDO_CODES[info_set[ENVIDO_STATE]],
+        WAITING_CODES[info_set[WAITING_FOR_RESPONSE]],
+        points[me],
+        points[other] if info_set[ENVIDO_WINNER] else -1,
+        int(info_set[TRUCO_STATE] != TrucoState.NOT_CALLED and info_set[TRUCO_TURN] == seat),
+        int(info_set[ENVIDO_PLAYED]),
+        target_score,
+    ])
@@ -0,0 +1,276 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+from actions import MASK_ACTIONS
+from card import CARDS
+from envido import calculate_envido_points
+from game import TrucoGame, GamePhase
+from player import HeuristicBot, Player
+
+# Performance numbers for the engine, the bots and the HTTP API. Every benchmark returns
+# metrics named after their unit: *_per_s are rates (higher is better) and *_us are
+# microseconds per call (lower is better). Each one runs `repeat` rounds of about
+# `seconds` and keeps its best round, which is the least disturbed by the rest of the
+# machine. Runs are appended to a JSON history, and --compare fails when a metric is
+# worse than in the last recorded run by more than the threshold.
+#
+# Numbers only compare on the same machine: the history file is not shared.
+
+HISTORY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_history.json')
+THRESHOLD = 0.2
+
+BENCHMARKS = {}
+
+def benchmark(fn):
+    BENCHMARKS[fn.__name__] = fn
+    return fn
+
+def _rate(step, seconds):
+    # Calls step() until `seconds` have passed; step returns how many operations it did
+    count = 0
+    start = time.perf_counter()
+    while True:
+        count += step()
+        elapsed = time.perf_counter() - start
+        if elapsed >= seconds:
+            return count / elapsed
+
+def _random_game(rng, target_score=30):
+    # Players only hold cards: moves are drawn from the valid mask, so nothing but the
+    # engine is timed
+    return TrucoGame(Player("A"), Player("B"), target_score=target_score, quiet=True,
+                     seed=rng.getrandbits(32))
+
+def _random_move(game, rng):
+    player = game.current_turn
+    return player, rng.choice(MASK_ACTIONS[game.get_valid_mask(player)])
+
+@benchmark
+def cards(seconds):
+    hands = [random.Random(i).sample(CARDS, 3) for i in range(1000)]
+    def truco_values():
+        for card in CARDS:
+            card.get_truco_value()
+        return len(CARDS)
+    def envido_points():
+        for hand in hands:
+            calculate_envido_points(hand)
+        return len(hands)
+    return {"truco_value_per_s": _rate(truco_values, seconds),
+            "envido_points_per_s": _rate(envido_points, seconds)}
+
+@benchmark
+def engine(seconds):
+    # Whole games with random legal moves: hands and matches per second
+    rng = random.Random(0)
+    hands = matches = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        game = _random_game(rng)
+        while game.phase == GamePhase.PLAYING:
+            game.handle_action_id(*_random_move(game, rng))
+        hands += game.hand_number + 1
+        matches += 1
+    elapsed = time.perf_counter() - start
+    return {"hands_per_s": hands / elapsed, "matches_per_s": matches / elapsed}
+
+@benchmark
+def actions(seconds):
+    # Latency of the calls the web API makes for every move, by action name
+    rng = random.Random(1)
+    valid_time = handle_time = calls = 0.0
+    game = _random_game(rng)
+    while valid_time + handle_time < seconds:
+        if game.phase != GamePhase.PLAYING:
+            game = _random_game(rng)
+        player = game.current_turn
+        t0 = time.perf_counter()
+        names = game.get_valid_actions(player)
+        t1 = time.perf_counter()
+        game.handle_action(player, rng.choice(names))
+        t2 = time.perf_counter()
+        valid_time += t1 - t0
+        handle_time += t2 - t1
+        calls += 1
+    return {"valid_actions_us": valid_time / calls * 1e6, "handle_action_us": handle_time / calls * 1e6}
+
+@benchmark
+def heuristic(seconds):
+    # Decision latency of HeuristicBot over positions from random games
+    rng = random.Random(2)
+    positions = []
+    while len(positions) < 500:
+        game = _random_game(rng)
+        while game.phase == GamePhase.PLAYING:
+            player = game.current_turn
+            bot = HeuristicBot(player.name, rng=random.Random(len(positions)))
+            bot.hand = list(player.hand)
+            positions.append((bot, game.get_state_for_player(player)))
+            game.handle_action_id(*_random_move(game, rng))
+    positions[0][0].get_action(positions[0][1]) # loads the equity table
+    def decide():
+        for bot, state in positions:
+            bot.get_action(state)
+        return len(positions)
+    return {"heuristic_decision_us": 1e6 / _rate(decide, seconds)}
+
+@benchmark
+def api(seconds):
+    # Requests through Flask's test client against an in-memory app (no game store),
+    # with a HeuristicBot opponent answering at once, so the numbers are the API's own
+    server = sys.modules.get('app')
+    if server is None:
+        db = os.environ.get('TRUCO_DB')
+        os.environ['TRUCO_DB'] = ''
+        try:
+            import app as server
+        finally:
+            if db is None:
+                del os.environ['TRUCO_DB']
+            else:
+                os.environ['TRUCO_DB'] = db
+    if server.store is not None:
+        raise RuntimeError("The api benchmark needs the app without a game store, "
+                           "but it was already imported with one")
+    make_bot, delay = server.make_bot, server.scheduler.delay
+    server.make_bot = lambda: HeuristicBot("Bot", rng=random.Random(3))
+    server.scheduler.delay = 0
+    try:
+        return _api(server, seconds)
+    finally:
+        server.make_bot, server.scheduler.delay = make_bot, delay
+
+def _api(server, seconds):
+    client = server.app.test_client()
+    rng = random.Random(4)
+
+    def start():
+        game_id = client.post('/api/start', json={"target_score": 30}).json["game_id"]
+        server.scheduler.wait_idle(10)
+        return game_id, server.registry.get(game_id)
+
+    game_id, _ = start()
+    path = f'/api/games/{game_id}/state?text=1'
+    def state():
+        for _ in range(50):
+            client.get(path)
+        return 50
+    state_rate = _rate(state, seconds)
+
+    game_id, session = start()
+    requests = busy = 0.0
+    while busy < seconds:
+        with session.lock:
+            game = session.game
+            if game.phase == GamePhase.GAME_OVER:
+                game = None
+            else:
+                action = rng.choice(game.get_valid_actions(game.p1))
+        if game is None:
+            game_id, session = start()
+            continue
+        t0 = time.perf_counter()
+        client.post(f'/api/games/{game_id}/action', json={"action": action})
+        busy += time.perf_counter() - t0
+        requests += 1
+        server.scheduler.wait_idle(10)
+    return {"api_state_per_s": state_rate, "api_action_per_s": requests / busy}
+
+def run(names=None, seconds=0.5, repeat=3, report=None):
+    # {metric: best value over `repeat` rounds} of the named benchmarks (default all)
+    metrics = {}
+    for name in names or BENCHMARKS:
+        for _ in range(repeat):
+            for metric, value in BENCHMARKS[name](seconds).items():
+                best = min if metric.endswith('_us') else max
+                metrics[metric] = best(metrics[metric], value) if metric in metrics else value
+        if report:
+            report(name)
+    return metrics
+
+def load_history(path=HISTORY_PATH):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+def record(metrics, path=HISTORY_PATH):
+    # Appends a run with the commit and machine it ran on
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    entry = {"date": datetime.datetime.now().isoformat(timespec='seconds'), "commit": commit,
+             "python": platform.python_version(), "machine": platform.node(), "metrics": metrics}
+    history = load_history(path) + [entry]
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(history, f, indent=1)
+    os.replace(tmp, path)
+    return entry
+
+def regressions(baseline, metrics, threshold=THRESHOLD):
+    # (metric, baseline value, new value) for every metric worse than baseline by more
+    # than threshold (a fraction). Metrics the baseline lacks are not compared.
+    worse = []
+    for metric, value in metrics.items():
+        old = baseline.get(metric)
+        if old is None:
+            continue
+        if metric.endswith('_us') and value > old * (1 + threshold) or \
+                metric.endswith('_per_s') and value < old * (1 - threshold):
+            worse.append((metric, old, value))
+    return worse
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the engine, the bots and the web API")
+    parser.add_argument('benchmarks', nargs='*', metavar='BENCHMARK',
+                        help=f"any of {', '.join(BENCHMARKS)} (default: all)")
+    parser.add_argument('-s', '--seconds', type=float, default=0.5, help="length of each round")
+    parser.add_argument('-r', '--repeat', type=int, default=3, help="rounds per benchmark, the best one counts")
+    parser.add_argument('--history', default=HISTORY_PATH)
+    parser.add_argument('--compare', action='store_true',
+                        help="compare with the last recorded run instead of recording, exit 1 on a regression")
+    parser.add_argument('--threshold', type=float, default=THRESHOLD, help="regression that fails --compare, as a fraction")
+    args = parser.parse_args(argv)
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    baseline = None
+    if args.compare:
+        history = load_history(args.history)
+        if not history:
+            raise SystemExit(f"No recorded runs in {args.history} to compare with")
+        baseline = history[-1]
+    metrics = run(args.benchmarks, args.seconds, args.repeat, report=lambda name: print(f"{name} done", file=sys.stderr))
+
+    for metric, value in metrics.items():
+        line = f"{metric:24} {value:14.2f}"
+        if baseline and metric in baseline["metrics"]:
+            old = baseline["metrics"][metric]
+            line += f"  {(value - old) / old:+7.1%} vs {old:.2f}"
+        print(line)
+
+    if not args.compare:
+        entry = record(metrics, args.history)
+        print(f"Recorded in {args.history} ({entry['commit'] or 'no commit'})")
+        return
+    worse = regressions(baseline["metrics"], metrics, args.threshold)
+    for metric, old, value in worse:
+        print(f"REGRESSION {metric}: {old:.2f} -> {value:.2f}")
+    print(f"Compared with the run of {baseline['date']} ({baseline['commit'] or 'no commit'}): "
+          f"{len(worse)} regressions over {args.threshold:.0%}")
+    if worse:
+        raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
@@ -3,53 +3,125 @@ class Card:
     BASTO = 'Basto'
     ORO = 'Oro'
     COPA = 'Copa'
-    
+
     SUITS = [ESPADA, BASTO, ORO, COPA]
+    RANKS = [1, 2, 3, 4, 5, 6, 7, 10, 11, 12]
+
+    # Cards are interned flyweights: there are exactly 40 instances, one per
+    # card of the Spanish deck, each carrying a 0..39 id (suit * 10 + rank index)
+    # that indexes the precomputed TRUCO_VALUE / ENVIDO_VALUE tables below.
+    __slots__ = ('rank', 'suit', 'id')
+
+    def __new__(cls, rank, suit):
+        card = _BY_RANK_SUIT.get((rank, suit))
+        if card is None:
+            if suit not in cls.SUITS:
+                raise ValueError(f"Invalid suit: {suit}")
+            raise ValueError(f"Invalid rank: {rank}")
+        return card
+
+    def __reduce__(self):
+        # Keep cards interned across pickling (multiprocessing, deepcopy)
+        return (card_from_id, (self.id,))
 
-    def __init__(self, rank, suit):
-        if suit not in self.SUITS:
-            raise ValueError(f"Invalid suit: {suit}")
-        self.rank = rank
-        self.suit = suit
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
 
     def __repr__(self):
-        return f"{self.rank} de {self.suit}"
+        return CARD_NAMES[self.id]
 
     def __str__(self):
-        return f"{self.rank} de {self.suit}"
+        return CARD_NAMES[self.id]
 
-    def __eq__(self, other):
-        if not isinstance(other, Card):
-            return False
-        return self.rank == other.rank and self.suit == other.suit
+    # Equality and hashing are identity based, which is exact because cards are interned.
 
     def get_truco_value(self):
-        # Hierarchy from highest to lowest
-        # 1 Espada > 1 Basto > 7 Espada > 7 Oro > 3s > 2s > 1s (Cup/Gold) > 12s > 11s > 10s > 7s (Cup/Basto) > 6s > 5s > 4s
-        
-        if self.rank == 1 and self.suit == self.ESPADA: return 14
-        if self.rank == 1 and self.suit == self.BASTO: return 13
-        if self.rank == 7 and self.suit == self.ESPADA: return 12
-        if self.rank == 7 and self.suit == self.ORO: return 11
-        
-        if self.rank == 3: return 10
-        if self.rank == 2: return 9
-        
-        if self.rank == 1: return 8 # 1 Copa / 1 Oro
-        
-        if self.rank == 12: return 7
-        if self.rank == 11: return 6
-        if self.rank == 10: return 5
-        
-        if self.rank == 7: return 4 # 7 Copa / 7 Basto
-        
-        if self.rank == 6: return 3
-        if self.rank == 5: return 2
-        if self.rank == 4: return 1
-        
-        return 0
+        return TRUCO_VALUE[self.id]
 
     def get_envido_value(self):
-        if self.rank >= 10:
-            return 0
-        return self.rank
+        return ENVIDO_VALUE[self.id]
+
+
+def _compute_truco_value(rank, suit):
+    # Hierarchy from highest to lowest
+    # 1 Espada > 1 Basto > 7 Espada > 7 Oro > 3s > 2s > 1s (Cup/Gold) > 12s > 11s > 10s > 7s (Cup/Basto) > 6s > 5s > 4s
+
+    if rank == 1 and suit == Card.ESPADA: return 14
+    if rank == 1 and suit == Card.BASTO: return 13
+    if rank == 7 and suit == Card.ESPADA: return 12
+    if rank == 7 and suit == Card.ORO: return 11
+
+    if rank == 3: return 10
+    if rank == 2: return 9
+
+    if rank == 1: return 8 # 1 Copa / 1 Oro
+
+    if rank == 12: return 7
+    if rank == 11: return 6
+    if rank == 10: return 5
+
+    if rank == 7: return 4 # 7 Copa / 7 Basto
+
+    if rank == 6: return 3
+    if rank == 5: return 2
+    if rank == 4: return 1
+
+    return 0
+
+
+def _make_card(card_id, rank, suit):
+    card = object.__new__(Card)
+    card.id = card_id
+    card.rank = rank
+    card.suit = suit
+    return card
+
+
+NUM_CARDS = len(Card.SUITS) * len(Card.RANKS)
+
+# CARDS[i].id == i
+CARDS = tuple(
+    _make_card(s * len(Card.RANKS) + r, rank, suit)
+    for s, suit in enumerate(Card.SUITS)
+    for r, rank in enumerate(Card.RANKS)
+)
+_BY_RANK_SUIT = {(c.rank, c.suit): c for c in CARDS}
+
+# Lookup tables indexed by card id
+TRUCO_VALUE = tuple(_compute_truco_value(c.rank, c.suit) for c in CARDS)
+ENVIDO_VALUE = tuple(0 if c.rank >= 10 else c.rank for c in CARDS)
+SUIT_INDEX = tuple(c.id // len(Card.RANKS) for c in CARDS)
+CARD_NAMES = tuple(f"{c.rank} de {c.suit}" for c in CARDS)
+
+
+def card_from_id(card_id):
+    return CARDS[card_id]
+
+
+# Canonical index of an unordered three-card hand (combinatorial number system):
+# sorted ids a < b < c map to C(a, 1) + C(b, 2) + C(c, 3), a dense 0..9879 range.
+NUM_HANDS = NUM_CARDS * (NUM_CARDS - 1) * (NUM_CARDS - 2) // 6
+BINOM2 = tuple(i * (i - 1) // 2 for i in range(NUM_CARDS))
+BINOM3 = tuple(i * (i - 1) * (i - 2) // 6 for i in range(NUM_CARDS))
+
+
+def hand_index(a, b, c):
+    if a > b: a, b = b, a
+    if b > c: b, c = c, b
+    if a > b: a, b = b, a
+    return a + BINOM2[b] + BINOM3[c]
+
+
+def hand_from_index(index):
+    # Inverse of hand_index, returns the sorted card ids
+    c = NUM_CARDS - 1
+    while BINOM3[c] > index:
+        c -= 1
+    index -= BINOM3[c]
+    b = c - 1
+    while BINOM2[b] > index:
+        b -= 1
+    return index - BINOM2[b], b, c
@@ -1,25 +1,32 @@
 import random
-from card import Card
+from card import CARDS
 
 class Deck:
-    def __init__(self):
+    def __init__(self, rng=None):
+        # rng is a random.Random instance; defaults to the global random module
+        self.rng = rng if rng is not None else random
         self.cards = []
         self.reset()
 
     def reset(self):
-        self.cards = []
-        ranks = [1, 2, 3, 4, 5, 6, 7, 10, 11, 12]
-        for suit in Card.SUITS:
-            for rank in ranks:
-                self.cards.append(Card(rank, suit))
-        self.shuffle()
+        # Cards are interned, so a fresh deck is just a copy of the 40 flyweights.
+        # It is not shuffled here: deal() draws at random from the cards left.
+        self.cards = list(CARDS)
 
     def shuffle(self):
-        random.shuffle(self.cards)
+        self.rng.shuffle(self.cards)
 
     def deal(self, num_cards):
         if len(self.cards) < num_cards:
             raise ValueError("Not enough cards in deck")
-        dealt = self.cards[:num_cards]
-        self.cards = self.cards[num_cards:]
+        # Partial Fisher-Yates: move num_cards random cards to the end and take them.
+        # As random as shuffling the whole deck, for 6 draws per hand instead of 39.
+        cards = self.cards
+        randrange = self.rng.randrange
+        end = len(cards)
+        for i in range(end - 1, end - 1 - num_cards, -1):
+            j = randrange(i + 1)
+            cards[i], cards[j] = cards[j], cards[i]
+        dealt = cards[end - num_cards:]
+        del cards[end - num_cards:]
         return dealt
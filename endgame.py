@@ -0,0 +1,106 @@
+import threading
+
+from actions import MASK_ACTIONS
+from game import GamePhase
+
+class TranspositionTable:
+    # Bounded cache of solved positions keyed by TrucoGame.snapshot() tuples.
+    # Two generations: when the current one fills up it becomes the old one and the
+    # previous old one is dropped, so memory never exceeds 2 * max_entries and
+    # recently used entries survive by being promoted on lookup.
+    # Thread-safe: lookups promote entries and stores rotate the generations, so both
+    # hold the lock, and the hit and miss counts stay exact.
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self.current = {}
+        self.old = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        with self.lock:
+            return len(self.current) + len(self.old)
+
+    def get(self, key):
+        with self.lock:
+            value = self.current.get(key)
+            if value is None:
+                value = self.old.get(key)
+                if value is None:
+                    self.misses += 1
+                    return None
+                self._put(key, value)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self._put(key, value)
+
+    def _put(self, key, value):
+        # Called with the lock held
+        if len(self.current) >= self.max_entries:
+            self.old = self.current
+            self.current = {}
+        self.current[key] = value
+
+    def clear(self):
+        with self.lock:
+            self.current = {}
+            self.old = {}
+
+# Shared by every bot in the process so a long-running server keeps one bounded table.
+# The scheduler's threads all search through it: one locked table rather than one per
+# worker, so positions solved for one game serve the others and memory stays bounded
+# however many workers there are. Lookups are short next to the search between them.
+DEFAULT_TABLE = TranspositionTable()
+
+class EndgameSolver:
+    # Exact minimax over the rest of a hand with every card known (a determinized game),
+    # including truco escalation. Values are the points seat 1 wins minus the points
+    # seat 2 wins from the current position to the end of the hand.
+    def __init__(self, table=None):
+        self.table = table if table is not None else DEFAULT_TABLE
+        self.nodes = 0
+
+    def value(self, game):
+        key = game.snapshot()
+        value = self.table.get(key)
+        if value is not None:
+            return value
+        self.nodes += 1
+
+        p1_score, p2_score, hand_number = game.p1_score, game.p2_score, game.hand_number
+        player = game.current_turn
+        maximizing = player is game.p1
+        best = None
+        # Make/unmake through the key snapshot we already hold
+        for action in MASK_ACTIONS[game.get_valid_mask(player)]:
+            game.handle_action_id(player, action)
+            result = (game.p1_score - p1_score) - (game.p2_score - p2_score)
+            if game.phase == GamePhase.PLAYING and game.hand_number == hand_number:
+                result += self.value(game)
+            game.restore(key)
+            if best is None or (result > best if maximizing else result < best):
+                best = result
+
+        best = best or 0
+        self.table.put(key, best)
+        return best
+
+    def action_values(self, game):
+        # Value of each valid action id for the player to move, from that player's point of view
+        p1_score, p2_score, hand_number = game.p1_score, game.p2_score, game.hand_number
+        player = game.current_turn
+        sign = 1 if player is game.p1 else -1
+        key = game.snapshot()
+        values = {}
+        for action in MASK_ACTIONS[game.get_valid_mask(player)]:
+            game.handle_action_id(player, action)
+            result = (game.p1_score - p1_score) - (game.p2_score - p2_score)
+            if game.phase == GamePhase.PLAYING and game.hand_number == hand_number:
+                result += self.value(game)
+            game.restore(key)
+            values[action] = sign * result
+        return values
@@ -1,3 +1,10 @@
+from card import ENVIDO_VALUE, SUIT_INDEX, NUM_HANDS, BINOM2, BINOM3, hand_index, hand_from_index
+
+try:
+    import numpy as np
+except ImportError:  # numpy is only needed by calculate_envido_points_batch
+    np = None
+
 class EnvidoState:
     NOT_CALLED = "not_called"
     ENVIDO = "envido"
@@ -17,9 +24,9 @@ def get_envido_options(current_state):
     if current_state == EnvidoState.NOT_CALLED:
         return [EnvidoState.ENVIDO, EnvidoState.REAL_ENVIDO, EnvidoState.FALTA_ENVIDO]
     elif current_state == EnvidoState.ENVIDO:
-        return [EnvidoState.ENVIDO_ENVIDO, EnvidoState.REAL_ENVIDO, EnvidoState.FALTA_ENVIDO, EnvidoResponse.QUIERO, EnvidoResponse.NO_QUIERO]
+        return [EnvidoState.ENVIDO_ENVIDO, EnvidoState.ENVIDO_REAL_ENVIDO, EnvidoState.FALTA_ENVIDO, EnvidoResponse.QUIERO, EnvidoResponse.NO_QUIERO]
     elif current_state == EnvidoState.ENVIDO_ENVIDO:
-        return [EnvidoState.ENVIDO_REAL_ENVIDO, EnvidoState.FALTA_ENVIDO, EnvidoResponse.QUIERO, EnvidoResponse.NO_QUIERO]
+        return [EnvidoState.ENVIDO_ENVIDO_REAL_ENVIDO, EnvidoState.FALTA_ENVIDO, EnvidoResponse.QUIERO, EnvidoResponse.NO_QUIERO]
     elif current_state == EnvidoState.REAL_ENVIDO:
         return [EnvidoState.FALTA_ENVIDO, EnvidoResponse.QUIERO, EnvidoResponse.NO_QUIERO]
     elif current_state == EnvidoState.ENVIDO_REAL_ENVIDO:
@@ -30,6 +37,20 @@ def get_envido_options(current_state):
         return [EnvidoResponse.QUIERO, EnvidoResponse.NO_QUIERO]
     return []
 
+# Call that reaches each state of the ladder
+ENVIDO_CALLS = {
+    EnvidoState.ENVIDO: 'envido',
+    EnvidoState.ENVIDO_ENVIDO: 'envido',
+    EnvidoState.REAL_ENVIDO: 'real_envido',
+    EnvidoState.ENVIDO_REAL_ENVIDO: 'real_envido',
+    EnvidoState.ENVIDO_ENVIDO_REAL_ENVIDO: 'real_envido',
+    EnvidoState.FALTA_ENVIDO: 'falta_envido',
+}
+
+def get_envido_raises(current_state):
+    # Calls allowed in current_state, mapped to the state each one leads to
+    return {ENVIDO_CALLS[s]: s for s in get_envido_options(current_state) if s in ENVIDO_CALLS}
+
 # Points evaluation when accepted (Quiero)
 def get_quiero_points(state, current_score_leader, target_score):
     points = {
@@ -76,35 +97,47 @@ def get_reject_points(history):
     prev_state = history[-2]
     return get_quiero_points(prev_state, 0, 30) # For history we just need the non-falta points
 
+def _compute_envido_points(a, b, c):
+    va, vb, vc = ENVIDO_VALUE[a], ENVIDO_VALUE[b], ENVIDO_VALUE[c]
+    sa, sb, sc = SUIT_INDEX[a], SUIT_INDEX[b], SUIT_INDEX[c]
+
+    # With two or more cards of a suit, the best pair of that suit scores 20 + both values.
+    # Otherwise the highest single card counts.
+    if sa == sb == sc:
+        return 20 + va + vb + vc - min(va, vb, vc)
+    if sa == sb:
+        return 20 + va + vb
+    if sa == sc:
+        return 20 + va + vc
+    if sb == sc:
+        return 20 + vb + vc
+    return max(va, vb, vc)
+
+# Envido points of every possible hand, indexed by card.hand_index
+ENVIDO_TABLE = bytes(_compute_envido_points(*hand_from_index(i)) for i in range(NUM_HANDS))
+
+def envido_points_for_ids(a, b, c):
+    return ENVIDO_TABLE[hand_index(a, b, c)]
+
 def calculate_envido_points(cards):
     if len(cards) != 3:
         raise ValueError("Envido requires exactly 3 cards")
+    return ENVIDO_TABLE[hand_index(cards[0].id, cards[1].id, cards[2].id)]
 
-    suits = {}
-    for card in cards:
-        if card.suit not in suits:
-            suits[card.suit] = []
-        suits[card.suit].append(card)
+_np_tables = None
 
-    max_score = 0
-    
-    best_suit = None
-    max_count = 0
-    for suit, suit_cards in suits.items():
-        if len(suit_cards) > max_count:
-            max_count = len(suit_cards)
-            best_suit = suit
-    
-    if max_count >= 2:
-        suit_cards = sorted(suits[best_suit], key=lambda c: c.get_envido_value(), reverse=True)
-        c1 = suit_cards[0]
-        c2 = suit_cards[1]
-        score = 20 + c1.get_envido_value() + c2.get_envido_value()
-        if score > max_score:
-            max_score = score
-            
-    for card in cards:
-        if card.get_envido_value() > max_score:
-            max_score = card.get_envido_value()
-            
-    return max_score
\ No newline at end of file
+def calculate_envido_points_batch(hands):
+    # hands: array-like of shape (N, 3) with card ids. Returns a uint8 array of N envido points.
+    global _np_tables
+    if np is None:
+        raise RuntimeError("calculate_envido_points_batch requires numpy")
+    if _np_tables is None:
+        _np_tables = (
+            np.frombuffer(ENVIDO_TABLE, dtype=np.uint8),
+            np.array(BINOM2, dtype=np.int64),
+            np.array(BINOM3, dtype=np.int64),
+        )
+    table, binom2, binom3 = _np_tables
+
+    ids = np.sort(np.asarray(hands, dtype=np.int64).reshape(-1, 3), axis=1)
+    return table[ids[:, 0] + binom2[ids[:, 1]] + binom3[ids[:, 2]]]
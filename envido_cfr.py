@@ -0,0 +1,301 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+from array import array
+from collections import Counter
+from multiprocessing import Pool
+
+from envido import ENVIDO_TABLE, EnvidoState, get_envido_raises, get_quiero_points, get_reject_points
+
+try:
+    import numpy as np
+except ImportError:  # numpy is only needed to train; reading the table works without it
+    np = None
+
+# CFR+ solver for the envido betting subgame, and the table its average strategy is
+# stored in for bots to read at decision time.
+#
+# The subgame: the mano may open the envido ladder or pass, then the pie may open it or
+# pass; every call is answered with quiero, no quiero or a raise from get_envido_raises.
+# Players only know their own envido points, bucketed by exact value (22 possible
+# values), and the opponent's points are drawn from the distribution over all hands.
+# Payoffs are points for the mano; the falta envido stake depends on the score, so one
+# subgame is solved per falta value 1..MAX_FALTA.
+#
+# Table file layout:
+#   MAGIC, version, MAX_FALTA, nodes, buckets, actions (u16 each)
+#   probability (u8, out of 255): falta x nodes x buckets x actions
+
+MAGIC = b'TRUCOCFR'
+VERSION = 1
+MAX_FALTA = 30
+DEFAULT_ITERATIONS = 500
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'envido_cfr.bin')
+
+MANO, PIE = 0, 1
+PASS = 'pass'
+
+POINT_VALUES = sorted(set(ENVIDO_TABLE))
+NUM_BUCKETS = len(POINT_VALUES)
+BUCKET_OF = {points: i for i, points in enumerate(POINT_VALUES)}
+_counts = Counter(ENVIDO_TABLE)
+PRIOR = [_counts[points] / len(ENVIDO_TABLE) for points in POINT_VALUES]
+
+def _build_tree():
+    # Decision nodes as (actor, actions, children); a child is a node index or a terminal:
+    # ('none',), ('showdown', state) or ('fold', winner, points)
+    nodes = []
+    keys = {}
+
+    def opening(actor):
+        index = len(nodes)
+        nodes.append(None)
+        keys[(actor == MANO, ())] = index
+        calls = get_envido_raises(EnvidoState.NOT_CALLED)
+        actions = [PASS] + [f'call_{call}' for call in calls]
+        children = [opening(PIE) if actor == MANO else ('none',)]
+        children += [response(1 - actor, (state,)) for state in calls.values()]
+        nodes[index] = (actor, actions, children)
+        return index
+
+    def response(actor, history):
+        index = len(nodes)
+        nodes.append(None)
+        keys[(actor == MANO, history)] = index
+        raises = get_envido_raises(history[-1])
+        actions = ['envido_quiero', 'envido_no_quiero'] + [f'call_{call}' for call in raises]
+        children = [('showdown', history[-1]), ('fold', 1 - actor, get_reject_points(list(history)))]
+        children += [response(1 - actor, history + (state,)) for state in raises.values()]
+        nodes[index] = (actor, actions, children)
+        return index
+
+    opening(MANO)
+    return nodes, keys
+
+NODES, NODE_INDEX = _build_tree()
+MAX_ACTIONS = max(len(actions) for _, actions, _ in NODES)
+
+def stake(state, falta):
+    if state == EnvidoState.FALTA_ENVIDO:
+        return falta
+    return get_quiero_points(state, 0, MAX_FALTA)
+
+class EnvidoCFR:
+    # Vector-form CFR+: every traversal updates all buckets of a node at once, so one
+    # iteration walks the (tiny) public tree instead of every pair of hands.
+    def __init__(self, falta):
+        if np is None:
+            raise RuntimeError("Training the envido strategy requires numpy")
+        self.falta = falta
+        self.iteration = 0
+        self.prior = np.array(PRIOR)
+        points = np.array(POINT_VALUES)
+        # Showdown result for the mano, who wins ties
+        self.showdown = np.where(points[:, None] >= points[None, :], 1.0, -1.0)
+        self.regrets = [np.zeros((NUM_BUCKETS, len(actions))) for _, actions, _ in NODES]
+        self.strategy_sum = [np.zeros((NUM_BUCKETS, len(actions))) for _, actions, _ in NODES]
+
+    def strategy(self, node):
+        regrets = self.regrets[node]
+        total = regrets.sum(axis=1, keepdims=True)
+        uniform = np.full_like(regrets, 1.0 / regrets.shape[1])
+        return np.where(total > 0, regrets / np.where(total > 0, total, 1), uniform)
+
+    def average_strategy(self, node):
+        sums = self.strategy_sum[node]
+        total = sums.sum(axis=1, keepdims=True)
+        uniform = np.full_like(sums, 1.0 / sums.shape[1])
+        return np.where(total > 0, sums / np.where(total > 0, total, 1), uniform)
+
+    def terminal_values(self, child, player, opp_reach):
+        # Counterfactual value of every bucket of player at a terminal
+        weights = self.prior * opp_reach
+        sign = 1 if player == MANO else -1
+        if child[0] == 'none':
+            return np.zeros(NUM_BUCKETS)
+        if child[0] == 'fold':
+            _, winner, points = child
+            return np.full(NUM_BUCKETS, (points if winner == player else -points) * weights.sum())
+        utility = stake(child[1], self.falta) * self.showdown
+        if player == MANO:
+            return sign * utility @ weights
+        return sign * utility.T @ weights
+
+    def walk(self, node, player, reach, opp_reach):
+        actor, actions, children = NODES[node]
+        if actor == player:
+            strategy = self.strategy(node)
+            values = np.empty((NUM_BUCKETS, len(actions)))
+            for a, child in enumerate(children):
+                if isinstance(child, int):
+                    values[:, a] = self.walk(child, player, reach * strategy[:, a], opp_reach)
+                else:
+                    values[:, a] = self.terminal_values(child, player, opp_reach)
+            value = (strategy * values).sum(axis=1)
+            # CFR+: regrets never go below zero, later iterations weigh more in the average
+            self.regrets[node] = np.maximum(self.regrets[node] + values - value[:, None], 0)
+            self.strategy_sum[node] += self.iteration * reach[:, None] * strategy
+            return value
+
+        strategy = self.strategy(node)
+        value = np.zeros(NUM_BUCKETS)
+        for a, child in enumerate(children):
+            if isinstance(child, int):
+                value += self.walk(child, player, reach, opp_reach * strategy[:, a])
+            else:
+                value += self.terminal_values(child, player, opp_reach * strategy[:, a])
+        return value
+
+    def iterate(self, iterations=1):
+        ones = np.ones(NUM_BUCKETS)
+        for _ in range(iterations):
+            self.iteration += 1
+            # Alternating updates
+            self.walk(0, MANO, ones, ones)
+            self.walk(0, PIE, ones, ones)
+
+    def best_response(self, node, player, opp_reach):
+        actor, actions, children = NODES[node]
+        strategy = self.average_strategy(node) if actor != player else None
+        values = []
+        for a, child in enumerate(children):
+            reach = opp_reach if actor == player else opp_reach * strategy[:, a]
+            if isinstance(child, int):
+                values.append(self.best_response(child, player, reach))
+            else:
+                values.append(self.terminal_values(child, player, reach))
+        if actor == player:
+            return np.max(values, axis=0)
+        return np.sum(values, axis=0)
+
+    def exploitability(self):
+        # Average gain of a best response against the average strategy, in points per hand
+        ones = np.ones(NUM_BUCKETS)
+        mano = self.prior @ self.best_response(0, MANO, ones)
+        pie = self.prior @ self.best_response(0, PIE, ones)
+        return (mano + pie) / 2
+
+    def save(self, path):
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez(f, falta=self.falta, iteration=self.iteration,
+                     **{f'regrets_{i}': r for i, r in enumerate(self.regrets)},
+                     **{f'strategy_sum_{i}': s for i, s in enumerate(self.strategy_sum)})
+        os.replace(tmp, path)
+
+    def load(self, path):
+        with np.load(path) as data:
+            if int(data['falta']) != self.falta:
+                raise ValueError(f"{path} is a checkpoint for falta {int(data['falta'])}, not {self.falta}")
+            self.iteration = int(data['iteration'])
+            self.regrets = [data[f'regrets_{i}'] for i in range(len(NODES))]
+            self.strategy_sum = [data[f'strategy_sum_{i}'] for i in range(len(NODES))]
+
+def train(task):
+    # Solves the subgame of one falta value, resuming from and saving to its checkpoint
+    falta, iterations, checkpoint_dir, checkpoint_every = task
+    solver = EnvidoCFR(falta)
+    path = os.path.join(checkpoint_dir, f'envido_cfr_{falta}.npz') if checkpoint_dir else None
+    if path and os.path.exists(path):
+        solver.load(path)
+    while solver.iteration < iterations:
+        solver.iterate(min(checkpoint_every, iterations - solver.iteration))
+        if path:
+            solver.save(path)
+    strategy = np.zeros((len(NODES), NUM_BUCKETS, MAX_ACTIONS))
+    for node, (_, actions, _) in enumerate(NODES):
+        strategy[node, :, :len(actions)] = solver.average_strategy(node)
+    return falta, strategy, solver.exploitability()
+
+def train_all(iterations=DEFAULT_ITERATIONS, processes=None, checkpoint_dir=None, checkpoint_every=100):
+    # One falta value per task, spread over all cores
+    if checkpoint_dir:
+        os.makedirs(checkpoint_dir, exist_ok=True)
+    tasks = [(falta, iterations, checkpoint_dir, checkpoint_every) for falta in range(1, MAX_FALTA + 1)]
+    if processes == 1:
+        results = [train(t) for t in tasks]
+    else:
+        with Pool(processes or os.cpu_count()) as pool:
+            results = pool.map(train, tasks)
+    results.sort(key=lambda r: r[0])
+    table = np.stack([strategy for _, strategy, _ in results])
+    exploitability = [e for _, _, e in results]
+    return table, exploitability
+
+def quantize(table):
+    # Probabilities to bytes; a row that rounds to all zeros keeps its best action
+    quantized = np.rint(table * 255).astype(np.uint8)
+    rows = np.nonzero(quantized.sum(axis=-1) == 0)
+    quantized[rows + (table[rows].argmax(axis=-1),)] = 255
+    return quantized
+
+def save_table(path, table):
+    header = MAGIC + array('H', [VERSION, MAX_FALTA, len(NODES), NUM_BUCKETS, MAX_ACTIONS]).tobytes()
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(header)
+        f.write(quantize(table).tobytes())
+    os.replace(tmp, path)
+
+def load_table(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    if not data.startswith(MAGIC):
+        raise ValueError(f"{path} is not an envido strategy table")
+    header = array('H', data[len(MAGIC):len(MAGIC) + 10])
+    if sys.byteorder == 'big':
+        header.byteswap()
+    version, *shape = header
+    if version != VERSION:
+        raise ValueError(f"{path} has envido table version {version}, expected {VERSION}")
+    if shape != [MAX_FALTA, len(NODES), NUM_BUCKETS, MAX_ACTIONS]:
+        raise ValueError(f"{path} was trained for a different envido ladder")
+    body = data[len(MAGIC) + 10:]
+    if len(body) != MAX_FALTA * len(NODES) * NUM_BUCKETS * MAX_ACTIONS:
+        raise ValueError(f"{path} is truncated")
+    return body
+
+_loaded = None
+
+def get_table(path=None):
+    # Loaded on first use. The table ships with the code; training it takes every core
+    # for a while, so it is only done by running this module.
+    global _loaded
+    if _loaded is None:
+        path = path or DEFAULT_PATH
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Envido strategy table {path} is missing, train it with: python envido_cfr.py")
+        _loaded = load_table(path)
+    return _loaded
+
+def envido_policy(is_mano, history, points, falta):
+    # Equilibrium action weights (out of 255) at an envido decision, or None if the
+    # position is not part of the subgame. history: the envido states called so far,
+    # empty when opening; the pie opening means the mano passed.
+    node = NODE_INDEX.get((is_mano, tuple(history)))
+    if node is None:
+        return None
+    falta = min(max(falta, 1), MAX_FALTA)
+    start = (((falta - 1) * len(NODES) + node) * NUM_BUCKETS + BUCKET_OF[points]) * MAX_ACTIONS
+    actions = NODES[node][1]
+    return list(zip(actions, get_table()[start:start + len(actions)]))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Train the envido strategy with CFR+ across all cores")
+    parser.add_argument('-i', '--iterations', type=int, default=DEFAULT_ITERATIONS)
+    parser.add_argument('--processes', type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument('--checkpoint-dir', help="save and resume training state here")
+    parser.add_argument('--checkpoint-every', type=int, default=100, metavar='ITERATIONS')
+    parser.add_argument('-o', '--output', default=DEFAULT_PATH)
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    table, exploitability = train_all(args.iterations, args.processes, args.checkpoint_dir, args.checkpoint_every)
+    save_table(args.output, table)
+    print(f"Wrote {args.output}: {len(NODES)} nodes x {MAX_FALTA} falta values in {time.perf_counter() - start:.1f}s")
+    print(f"  exploitability {min(exploitability):.4f}-{max(exploitability):.4f} points per hand")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,251 @@
+import os
+import sys
+import tempfile
+from array import array
+from functools import lru_cache
+from itertools import combinations_with_replacement
+from math import comb
+
+from card import NUM_HANDS, TRUCO_VALUE, BINOM2, BINOM3, hand_from_index, hand_index
+from game import get_hand_winner
+
+try:
+    import numpy as np
+except ImportError:  # numpy is only needed by hand_equity_batch
+    np = None
+
+# Probability of winning the trick-play part of a hand (who takes the hand without truco
+# calls) against a uniformly random opponent hand, with both sides playing their cards
+# perfectly. One entry per three-card hand, as mano and as pie, unconditionally and
+# conditioned on one known opponent card.
+#
+# Trick play only depends on truco values, so hands are grouped into classes by their
+# sorted values and only classes are solved. The file stores the hand -> class map and
+# the class table, quantized to uint16 (EQUITY_UNKNOWN where the condition is impossible):
+#
+#   MAGIC, version (u16), number of classes (u16)
+#   class of every hand: NUM_HANDS x u16
+#   equity: classes x 2 (mano, pie) x (1 + MAX_VALUE) x u16
+#           column 0 is unconditional, column v conditions on an opponent card of value v
+
+MAGIC = b'TRUCOEQ'
+VERSION = 1
+MAX_VALUE = max(TRUCO_VALUE)
+EQUITY_SCALE = 65534
+EQUITY_UNKNOWN = 65535
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'equity.bin')
+
+# Cards of each truco value in the deck
+VALUE_COUNTS = tuple(TRUCO_VALUE.count(v) for v in range(MAX_VALUE + 1))
+
+@lru_cache(maxsize=None)
+def _trick_play(mine, theirs, round_winners, leader, mano_seat):
+    # 1 if seat 1 (holding `mine`) wins the hand with perfect play from here, else 0.
+    # Hands are sorted tuples of truco values. Mirrors TrucoGame's trick and parda rules.
+    winner = get_hand_winner(round_winners, mano_seat)
+    if winner is not None:
+        return 1 if winner == 1 else 0
+
+    first, second = (mine, theirs) if leader == 1 else (theirs, mine)
+    # The leader picks a card to maximize their result, the follower answers to theirs
+    leader_wants = 1 if leader == 1 else 0
+    best_lead = None
+    for i, lead in enumerate(first):
+        if i and lead == first[i - 1]:
+            continue
+        rest_first = first[:i] + first[i + 1:]
+        best_answer = None
+        for j, answer in enumerate(second):
+            if j and answer == second[j - 1]:
+                continue
+            rest_second = second[:j] + second[j + 1:]
+            if lead > answer:
+                trick = leader
+            elif answer > lead:
+                trick = 3 - leader
+            else:
+                trick = 0
+            next_leader = trick if trick else mano_seat
+            if leader == 1:
+                result = _trick_play(rest_first, rest_second, round_winners + (trick,), next_leader, mano_seat)
+            else:
+                result = _trick_play(rest_second, rest_first, round_winners + (trick,), next_leader, mano_seat)
+            if best_answer is None or (result < best_answer if leader_wants else result > best_answer):
+                best_answer = result
+        if best_lead is None or (best_answer > best_lead if leader_wants else best_answer < best_lead):
+            best_lead = best_answer
+    return best_lead
+
+def _hand_class(ids):
+    return tuple(sorted(TRUCO_VALUE[i] for i in ids))
+
+def _equity(mine, remaining, mano, fixed=()):
+    # Win probability of value class `mine` against every opponent hand drawn from the
+    # `remaining` counts per value, plus the `fixed` known opponent values.
+    mano_seat = 1 if mano else 2
+    free = 3 - len(fixed)
+    wins = total = 0
+    for values, weight in _opponent_hands(remaining, free):
+        theirs = tuple(sorted(values + fixed))
+        wins += weight * _trick_play(mine, theirs, (), mano_seat, mano_seat)
+        total += weight
+    return wins / total if total else None
+
+def build_table():
+    classes = {}
+    class_of = array('H')
+    for index in range(NUM_HANDS):
+        class_of.append(classes.setdefault(_hand_class(hand_from_index(index)), len(classes)))
+
+    width = 1 + MAX_VALUE
+    table = array('H', [EQUITY_UNKNOWN]) * (len(classes) * 2 * width)
+    for mine, cls in classes.items():
+        remaining = list(VALUE_COUNTS)
+        for v in mine:
+            remaining[v] -= 1
+        for position, mano in enumerate((True, False)):
+            base = (cls * 2 + position) * width
+            table[base] = round(_equity(mine, remaining, mano) * EQUITY_SCALE)
+            for v in range(1, MAX_VALUE + 1):
+                if not remaining[v]:
+                    continue # we hold every card of this value
+                remaining[v] -= 1
+                table[base + v] = round(_equity(mine, remaining, mano, (v,)) * EQUITY_SCALE)
+                remaining[v] += 1
+    return len(classes), class_of, table
+
+def save_table(path, num_classes, class_of, table):
+    header = MAGIC + array('H', [VERSION, num_classes]).tobytes()
+    if sys.byteorder == 'big':
+        class_of, table = array('H', class_of), array('H', table)
+        class_of.byteswap()
+        table.byteswap()
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(header)
+        class_of.tofile(f)
+        table.tofile(f)
+    os.replace(tmp, path)
+
+def load_table(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    if not data.startswith(MAGIC):
+        raise ValueError(f"{path} is not an equity table")
+    header = array('H', data[len(MAGIC):len(MAGIC) + 4])
+    if sys.byteorder == 'big':
+        header.byteswap()
+    version, num_classes = header
+    if version != VERSION:
+        raise ValueError(f"{path} has equity table version {version}, expected {VERSION}")
+    body = array('H', data[len(MAGIC) + 4:])
+    if sys.byteorder == 'big':
+        body.byteswap()
+    if len(body) != NUM_HANDS + num_classes * 2 * (1 + MAX_VALUE):
+        raise ValueError(f"{path} is truncated")
+    return num_classes, body[:NUM_HANDS], body[NUM_HANDS:]
+
+_loaded = None
+
+def get_table(path=None):
+    # Loaded on first use. The table ships with the code and is generated by running
+    # this module, never at decision time.
+    global _loaded
+    if _loaded is None:
+        path = path or DEFAULT_PATH
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Equity table {path} is missing, build it with: python equity.py")
+        _loaded = load_table(path)
+    return _loaded
+
+def hand_equity(card_ids, mano, opp_card=None):
+    # card_ids: the three cards dealt to the player (played or not).
+    # opp_card: optional id of a card known to be in the opponent's hand.
+    # Returns None if opp_card is impossible (we hold every card of its value).
+    _, class_of, table = get_table()
+    width = 1 + MAX_VALUE
+    column = 0 if opp_card is None else TRUCO_VALUE[opp_card]
+    value = table[(class_of[hand_index(*card_ids)] * 2 + (0 if mano else 1)) * width + column]
+    if value == EQUITY_UNKNOWN:
+        return None
+    return value / EQUITY_SCALE
+
+def trick_equity(hand, seen, opp_in_hand, round_winners, mano, lead=None):
+    # Probability of winning the hand from the middle of trick play, against a uniformly
+    # random rest of the opponent's hand, both sides playing perfectly from here. Seats are
+    # relative: 1 is us, 2 the opponent. Solved on the spot, there are at most two unknown cards.
+    # hand: ids of our cards in hand. seen: ids of every card we have seen, ours and theirs.
+    # opp_in_hand: cards the opponent still holds. round_winners: tricks so far (1, 2, 0 parda).
+    # lead: (id, seat) of the card on the table, if a trick is half played.
+    mine = tuple(sorted(TRUCO_VALUE[i] for i in hand))
+    remaining = list(VALUE_COUNTS)
+    for i in seen:
+        remaining[TRUCO_VALUE[i]] -= 1
+    mano_seat = 1 if mano else 2
+    round_winners = tuple(round_winners)
+
+    if lead is not None and lead[1] == 2:
+        # We answer their card without knowing the rest of their hand: best answer on average
+        led = TRUCO_VALUE[lead[0]]
+        best = 0
+        for v in set(mine):
+            rest = list(mine)
+            rest.remove(v)
+            trick = 1 if v > led else 2 if led > v else 0
+            wins = total = 0
+            for theirs, weight in _opponent_hands(remaining, opp_in_hand):
+                wins += weight * _trick_play(tuple(rest), theirs, round_winners + (trick,), trick or mano_seat, mano_seat)
+                total += weight
+            best = max(best, wins / total)
+        return best
+
+    wins = total = 0
+    for theirs, weight in _opponent_hands(remaining, opp_in_hand):
+        if lead is None:
+            leader = (round_winners[-1] or mano_seat) if round_winners else mano_seat
+            result = _trick_play(mine, theirs, round_winners, leader, mano_seat)
+        else:
+            # They answer our card knowing their hand
+            led = TRUCO_VALUE[lead[0]]
+            result = 1
+            for j, answer in enumerate(theirs):
+                trick = 1 if led > answer else 2 if answer > led else 0
+                rest = theirs[:j] + theirs[j + 1:]
+                result = min(result, _trick_play(mine, rest, round_winners + (trick,), trick or mano_seat, mano_seat))
+        wins += weight * result
+        total += weight
+    return wins / total
+
+def _opponent_hands(remaining, n):
+    # Sorted value tuples of n cards drawn from the `remaining` counts per value, with how
+    # many hands of cards each stands for
+    for values in combinations_with_replacement(range(1, MAX_VALUE + 1), n):
+        weight = 1
+        for v in set(values):
+            weight *= comb(remaining[v], values.count(v))
+        if weight:
+            yield values, weight
+
+_np_tables = None
+
+def hand_equity_batch(hands, mano):
+    # hands: (N, 3) card ids, mano: N booleans. Unconditional equities as a float array.
+    global _np_tables
+    if np is None:
+        raise RuntimeError("hand_equity_batch requires numpy")
+    if _np_tables is None:
+        _, class_of, table = get_table()
+        _np_tables = (np.array(class_of, dtype=np.int64), np.array(table, dtype=np.int64),
+                      np.array(BINOM2, dtype=np.int64), np.array(BINOM3, dtype=np.int64))
+    class_of, table, binom2, binom3 = _np_tables
+
+    ids = np.sort(np.asarray(hands, dtype=np.int64).reshape(-1, 3), axis=1)
+    classes = class_of[ids[:, 0] + binom2[ids[:, 1]] + binom3[ids[:, 2]]]
+    column = np.where(np.asarray(mano, dtype=bool), 0, 1)
+    return table[(classes * 2 + column) * (1 + MAX_VALUE)] / EQUITY_SCALE
+
+if __name__ == '__main__':
+    path = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_PATH
+    num_classes, class_of, table = build_table()
+    save_table(path, num_classes, class_of, table)
+    print(f"Wrote {path}: {num_classes} hand classes, {os.path.getsize(path)} bytes")
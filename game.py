@@ -1,8 +1,15 @@
+from actions import (PLAY_CARD_2, ENVIDO_QUIERO, ENVIDO_NO_QUIERO, CALL_FALTA_ENVIDO, TRUCO_QUIERO,
+                     TRUCO_NO_QUIERO, CALL_TRUCO, NUM_ACTIONS, ACTION_NAMES, ACTION_IDS, CALL_ACTIONS,
+                     CALL_TYPES, HAND_MASKS, ENVIDO_CALL_MASK, ENVIDO_ANSWER_MASK, TRUCO_ANSWER_MASK,
+                     mask_to_names)
+from card import TRUCO_VALUE, CARDS, card_from_id
 from deck import Deck
-from envido import calculate_envido_points, EnvidoState, EnvidoResponse, get_quiero_points, get_no_quiero_points
+from envido import calculate_envido_points, EnvidoState, EnvidoResponse, get_envido_raises, get_quiero_points, get_reject_points
 from truco import TrucoState, get_truco_points, get_next_truco_state
 
+import itertools
 import random
+from collections import deque
 
 class GamePhase:
     DEALING = "dealing"
@@ -10,26 +17,356 @@ class GamePhase:
     ROUND_END = "round_end"
     GAME_OVER = "game_over"
 
+class GameEvent:
+    # Structured events emitted by TrucoGame. Payloads are tuples; seats are 1 (p1) or 2 (p2).
+    ROUND_START = "round_start"            # (hand_number, dealer_seat)
+    DEAL = "deal"                          # (p1_card_ids, p2_card_ids), not narrated
+    ENVIDO_QUIERO = "envido_quiero"        # (seat,)
+    ENVIDO_NO_QUIERO = "envido_no_quiero"  # (seat,)
+    TRUCO_QUIERO = "truco_quiero"          # (seat,)
+    TRUCO_NO_QUIERO = "truco_no_quiero"    # (seat,)
+    CALL = "call"                          # (seat, call_type)
+    PLAY_CARD = "play_card"                # (seat, card_id)
+    ENVIDO_POINTS = "envido_points"        # (p1_points, p2_points)
+    ENVIDO_WON = "envido_won"              # (seat, points, won_as_mano_tie)
+    ENVIDO_REJECTED = "envido_rejected"    # (seat, points)
+    TRICK = "trick"                        # (winner_id,) 0 for parda
+    HAND_WON = "hand_won"                  # (seat, points)
+    GAME_OVER = "game_over"                # (seat,)
+
+# Integer codes of the events, in the order above, for logs and clients
+EVENT_KINDS = (GameEvent.ROUND_START, GameEvent.DEAL, GameEvent.ENVIDO_QUIERO, GameEvent.ENVIDO_NO_QUIERO,
+               GameEvent.TRUCO_QUIERO, GameEvent.TRUCO_NO_QUIERO, GameEvent.CALL, GameEvent.PLAY_CARD,
+               GameEvent.ENVIDO_POINTS, GameEvent.ENVIDO_WON, GameEvent.ENVIDO_REJECTED, GameEvent.TRICK,
+               GameEvent.HAND_WON, GameEvent.GAME_OVER)
+EVENT_CODES = {kind: code for code, kind in enumerate(EVENT_KINDS)}
+DEAL_CODE = EVENT_CODES[GameEvent.DEAL]
+
+# Events a narrated game keeps: enough for the current hand and a few before it
+LOG_SIZE = 256
+
+# Flavor text. The first phrase of each list is what the human player says.
+QUIERO_ENVIDO_PHRASES = ("¡Quiero!", "¡Se la rre banca, quiero!", "¡Quiero y retruco no... mentira, quiero!", "Venga ese envido.")
+NO_QUIERO_ENVIDO_PHRASES = ("No quiero.", "Paso.", "Son buenas, me achico.", "No me da el cuero, no quiero.")
+QUIERO_TRUCO_PHRASES = ("¡Quiero!", "¡Vení que me la banco!", "A ver si sos tan guapo, ¡quiero!", "Dale, quiero.")
+NO_QUIERO_TRUCO_PHRASES = ("Me voy al mazo.", "Te la dejo.", "No tengo nada, me chicho.", "Buen truco, me achico.")
+CALL_NAMES = {
+    'envido': '¡Envido!', 'real_envido': '¡Real Envido!', 'falta_envido': '¡Falta Envido carajo!',
+    'truco': '¡Truco!', 'retruco': '¡Quiero Retruco!', 'vale_4': '¡Quiero Vale Cuatro!'
+}
+BOT_CALL_PHRASES = {
+    'truco': ("¡Truco!", "Jugá que te canto Truco.", "Te veo flojo... ¡Truco!"),
+    'envido': ("¡Envido!", "Tengo puntitos... ¡Envido!", "Canto Envido."),
+}
+_RESPONSE_PHRASES = {
+    GameEvent.ENVIDO_QUIERO: QUIERO_ENVIDO_PHRASES,
+    GameEvent.ENVIDO_NO_QUIERO: NO_QUIERO_ENVIDO_PHRASES,
+    GameEvent.TRUCO_QUIERO: QUIERO_TRUCO_PHRASES,
+    GameEvent.TRUCO_NO_QUIERO: NO_QUIERO_TRUCO_PHRASES,
+}
+
+class EventLog:
+    # The last `size` events of a narrated game as (code, payload, variant) entries;
+    # variant is the flavor phrase drawn when the event happened. Entries are numbered
+    # from 0 over the whole game and a client holding the first n asks for what came
+    # after with since(n), so memory per game stays the same however long it runs.
+    # Text is rendered only for whoever asks, by the game's narrate.
+    def __init__(self, narrate, size=LOG_SIZE):
+        self.narrate = narrate
+        self.entries = deque(maxlen=size)
+        self.total = 0
+
+    @property
+    def start(self):
+        # Number of the oldest entry kept
+        return self.total - len(self.entries)
+
+    def append(self, code, payload, variant=0):
+        self.entries.append((code, payload, variant))
+        self.total += 1
+
+    def truncate(self, total):
+        # Drops the events after the first `total`, as far as they are still kept
+        while self.total > total:
+            if self.entries:
+                self.entries.pop()
+            self.total -= 1
+
+    def since(self, number=0):
+        # Entries numbered `number` and up, those that are still kept
+        return list(itertools.islice(self.entries, max(number - self.start, 0), None))
+
+    def public(self, number=0):
+        # since(number) as [code, *payload] lists for clients, without the cards of a
+        # deal: each client gets its own hand in the state
+        return [[code] if code == DEAL_CODE else [code, *payload] for code, payload, _ in self.since(number)]
+
+    def _lines(self, entry):
+        code, payload, variant = entry
+        text = self.narrate(EVENT_KINDS[code], payload, variant)
+        return text if isinstance(text, tuple) else (text,)
+
+    def texts(self, number=0):
+        # One string per entry of since(number), '' for events nothing is said about
+        return ["\n".join(self._lines(entry)) for entry in self.since(number)]
+
+    def lines(self, number=0):
+        # The narration of since(number), line by line
+        return [line for entry in self.since(number) for line in self._lines(entry)]
+
+    def dump(self):
+        # JSON-friendly state for GameStore, read back by load()
+        return {"total": self.total, "entries": list(self.entries)}
+
+    def load(self, state):
+        self.entries.clear()
+        self.entries.extend((code, tuple(payload), variant) for code, payload, variant in state["entries"])
+        self.total = state["total"]
+
+# Positions of some fields in TrucoGame.snapshot()
+(P1_SCORE, P2_SCORE, HAND_NUMBER, PHASE, CURRENT_TURN, RESUME_TURN, TRUCO_OWNER, TRUCO_TURN,
+ ENVIDO_WINNER, HAND1, HAND2, PLAYED1, PLAYED2, ON_TABLE, ROUND_WINNERS, ENVIDO_STATE,
+ ENVIDO_HISTORY, ENVIDO_PLAYED, ENVIDO_POINTS1, ENVIDO_POINTS2, TRUCO_STATE, WAITING_FOR_RESPONSE) = range(22)
+
+def get_hand_winner(round_winners, mano_seat):
+    # Seat (1 or 2) that wins the hand given the trick results so far (1, 2, or 0 for parda),
+    # or None if the hand goes on.
+    p1_wins = round_winners.count(1)
+    p2_wins = round_winners.count(2)
+    pardas = round_winners.count(0)
+
+    if p1_wins == 2:
+        return 1
+    if p2_wins == 2:
+        return 2
+    if len(round_winners) >= 2:
+        # Complex parda logic
+        if pardas == 1:
+            # If they tied one, whoever won the other wins the round
+            if p2_wins == 1: return 2
+            if p1_wins == 1: return 1
+        elif pardas >= 2:
+            # If two pardas, mano wins
+            return mano_seat
+    return None
+
 class TrucoGame:
-    def __init__(self, p1, p2, target_score=30):
+    def __init__(self, p1, p2, target_score=30, quiet=False, seed=None, log_size=LOG_SIZE):
         self.p1 = p1
         self.p2 = p2
-        self.deck = Deck()
+        # A seed gives the game its own generator so it can be reproduced exactly,
+        # otherwise the deck shuffles with the global random module.
+        self.seed = seed
+        self.rng = random.Random(seed) if seed is not None else random
+        self.deck = Deck(self.rng)
         self.p1_score = 0
         self.p2_score = 0
         self.target_score = target_score
         self.hand_number = 0
-        self.log = []
+        # The last log_size events, or all of them for None
+        self.events = EventLog(self.narrate, log_size)
+        # In quiet mode nothing is narrated: no events are logged nor flavor phrases drawn.
+        # Structured events still reach subscribers, if there are any.
+        self.quiet = quiet
+        self.listeners = []
+        # Flavor phrases use their own generator so narration never shifts the game's randomness
+        self.flavor_rng = random.Random(seed)
+        # What apply() needs to take an action back, popped by undo()
+        self.undo_stack = []
+        # Inside apply(): the generators drawn from, with their state before the first draw
+        self.drawn = None
+        # Bumped on every event, i.e. every change a client can see
+        self.version = 0
         
         self.reset_round()
+
+    def clone(self, rng=None):
+        # Quiet copy for search bots: placeholder players, no log, no listeners.
+        # Future deals draw from rng (a fresh generator by default), never from this game's.
+        from player import Player # player.py imports this module
+        game = TrucoGame.__new__(TrucoGame)
+        game.p1 = Player(self.p1.name)
+        game.p2 = Player(self.p2.name)
+        game.seed = None
+        game.rng = rng if rng is not None else random.Random()
+        game.deck = Deck(game.rng)
+        game.target_score = self.target_score
+        game.events = EventLog(game.narrate)
+        game.quiet = True
+        game.listeners = []
+        game.flavor_rng = game.rng
+        game.undo_stack = []
+        game.drawn = None
+        game.version = 0
+        game.restore(self.snapshot())
+        return game
+
+    # A snapshot is a flat, hashable tuple of everything handle_action reads or writes
+    # during play. Players are stored by seat (1, 2, or 0 for none) and cards by id, so it
+    # does not depend on Player objects and can be restored onto any TrucoGame.
+    # The deck is not part of it: it is reshuffled at the start of every hand.
+    def snapshot(self):
+        p1, p2 = self.p1, self.p2
+        seats = {None: 0, p1: 1, p2: 2}
+        return (
+            self.p1_score, self.p2_score, self.hand_number, self.phase,
+            seats[self.current_turn], seats[self.resume_turn], seats[self.truco_owner],
+            seats[self.truco_turn], seats[self.envido_winner],
+            tuple([c.id for c in p1.hand]), tuple([c.id for c in p2.hand]),
+            tuple([c.id for c in self.played_cards_p1]), tuple([c.id for c in self.played_cards_p2]),
+            tuple([c.id for c in self.cards_played_this_turn]),
+            tuple(self.round_winners),
+            self.envido_state, tuple(self.envido_history), self.envido_played,
+            self.envido_points_p1, self.envido_points_p2,
+            self.truco_state, self.waiting_for_response,
+        )
+
+    def info_set(self, player):
+        # The snapshot as seen by player: the opponent's cards in hand are hidden (-1),
+        # and so are the opponent's envido points unless an accepted envido revealed them.
+        snapshot = list(self.snapshot())
+        opp_hand = HAND2 if player is self.p1 else HAND1
+        snapshot[opp_hand] = (-1,) * len(snapshot[opp_hand])
+        if self.envido_winner is None:
+            snapshot[ENVIDO_POINTS2 if player is self.p1 else ENVIDO_POINTS1] = -1
+        return tuple(snapshot)
+
+    def restore(self, snapshot):
+        (self.p1_score, self.p2_score, self.hand_number, self.phase,
+         current_turn, resume_turn, truco_owner, truco_turn, envido_winner,
+         hand1, hand2, played1, played2, on_table, round_winners,
+         self.envido_state, envido_history, self.envido_played,
+         self.envido_points_p1, self.envido_points_p2,
+         self.truco_state, self.waiting_for_response) = snapshot
+        players = (None, self.p1, self.p2)
+        self.current_turn = players[current_turn]
+        self.resume_turn = players[resume_turn]
+        self.truco_owner = players[truco_owner]
+        self.truco_turn = players[truco_turn]
+        self.envido_winner = players[envido_winner]
+        self.hand_winner = None
+        self.p1.hand = [CARDS[i] for i in hand1]
+        self.p2.hand = [CARDS[i] for i in hand2]
+        self.played_cards_p1 = [CARDS[i] for i in played1]
+        self.played_cards_p2 = [CARDS[i] for i in played2]
+        self.p1.played_cards = list(self.played_cards_p1)
+        self.p2.played_cards = list(self.played_cards_p2)
+        self.cards_played_this_turn = [CARDS[i] for i in on_table]
+        self.round_winners = list(round_winners)
+        self.envido_history = list(envido_history)
+
+    def apply(self, action):
+        # Make/unmake interface for search: plays action for whoever's turn it is,
+        # through the unchanged handle_action rules, and remembers how to take it back:
+        # the snapshot, the version and events, and the generators if it drew from them
+        # (an action that ends a hand deals the next one).
+        snapshot = self.snapshot()
+        version, events = self.version, self.events.total
+        self.drawn = []
+        try:
+            success, msg = self.handle_action(self.current_turn, action)
+        finally:
+            drawn, self.drawn = self.drawn, None
+        if success:
+            self.undo_stack.append((snapshot, drawn, version, events))
+        return success
+
+    def undo(self):
+        snapshot, drawn, self.version, events = self.undo_stack.pop()
+        self.restore(snapshot)
+        for rng, state in drawn:
+            rng.setstate(state)
+        self.events.truncate(events)
+
+    def _drawing(self, rng):
+        # Called before every draw from a generator. Inside apply(), saves its state the
+        # first time.
+        if self.drawn is not None and all(r is not rng for r, _ in self.drawn):
+            self.drawn.append((rng, rng.getstate()))
         
-    def add_log(self, msg):
-        self.log.append(msg)
+    @property
+    def log(self):
+        # Narration of the events still in the log, line by line
+        return self.events.lines()
+
+    def subscribe(self, listener):
+        # listener(kind, payload) is called for every GameEvent
+        self.listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        self.listeners.remove(listener)
+
+    def emit(self, kind, *payload):
+        self.version += 1
+        for listener in self.listeners:
+            listener(kind, payload)
+        if not self.quiet:
+            self.events.append(EVENT_CODES[kind], payload, self.flavor(kind, payload))
+
+    def flavor(self, kind, payload):
+        # The bot's phrase for a call or an answer, drawn when it happens so narrating
+        # later always says the same
+        phrases = None
+        if kind == GameEvent.CALL and payload[0] == 2:
+            phrases = BOT_CALL_PHRASES.get(payload[1])
+        elif kind in _RESPONSE_PHRASES and payload[0] == 2:
+            phrases = _RESPONSE_PHRASES[kind]
+        if not phrases:
+            return 0
+        self._drawing(self.flavor_rng)
+        return self.flavor_rng.randrange(len(phrases))
+
+    def narrate(self, kind, payload, variant=0):
+        if kind == GameEvent.ROUND_START:
+            hand_number, dealer = payload
+            return (f"--- Arranca la Mano {hand_number + 1} ---", f"Reparte: {self.seat_name(dealer)}")
+        if kind == GameEvent.DEAL:
+            return ()
+        if kind == GameEvent.PLAY_CARD:
+            seat, card_id = payload
+            return f"{self.seat_name(seat)} juega: {card_from_id(card_id)}"
+        if kind == GameEvent.CALL:
+            seat, call_type = payload
+            if seat == 2 and call_type in BOT_CALL_PHRASES:
+                return f"{self.seat_name(seat)}: {BOT_CALL_PHRASES[call_type][variant]}"
+            return f"{self.seat_name(seat)}: {CALL_NAMES.get(call_type, call_type)}"
+        if kind in _RESPONSE_PHRASES:
+            seat, = payload
+            # Bot says the phrase drawn by flavor(), the player always the first one
+            return f"{self.seat_name(seat)}: {_RESPONSE_PHRASES[kind][variant]}"
+        if kind == GameEvent.ENVIDO_POINTS:
+            p1_points, p2_points = payload
+            return f"Puntos de Envido: Vos ({p1_points}) vs TrucoBot ({p2_points})"
+        if kind == GameEvent.ENVIDO_WON:
+            seat, pts, by_mano = payload
+            if by_mano:
+                return f"Empate. Vos sos mano y ganás {pts} puntos." if seat == 1 else f"Empate. TrucoBot es mano y gana {pts} puntos."
+            return f"Vos ganás {pts} puntos de Envido." if seat == 1 else f"TrucoBot gana {pts} puntos de Envido."
+        if kind == GameEvent.ENVIDO_REJECTED:
+            seat, pts = payload
+            return f"Vos ganás {pts} puntos porque TrucoBot no quiso." if seat == 1 else f"TrucoBot gana {pts} puntos porque no quisiste."
+        if kind == GameEvent.TRICK:
+            winner_id, = payload
+            return ("-> ¡Parda! (Empate)", "-> Vos ganás la baza.", "-> TrucoBot gana la baza.")[winner_id]
+        if kind == GameEvent.HAND_WON:
+            seat, pts = payload
+            return f"¡Vos ganás la mano! Sumás {pts} puntos." if seat == 1 else f"TrucoBot gana la mano. Suma {pts} puntos."
+        if kind == GameEvent.GAME_OVER:
+            seat, = payload
+            return "¡Ganaste la partida!" if seat == 1 else "TrucoBot ganó la partida."
+        return kind
+
+    def seat_name(self, seat):
+        return "Vos" if seat == 1 else "TrucoBot"
+
+    def seat_of(self, player):
+        return 1 if player == self.p1 else 2
         
     def reset_round(self):
         self.phase = GamePhase.DEALING
         self.current_turn = self.p1 if self.hand_number % 2 == 0 else self.p2
         self.hand_winner = None
+        self._drawing(self.deck.rng)
         self.deck.reset()
         
         # Round state
@@ -49,10 +386,10 @@ class TrucoGame:
         self.truco_turn = None # Who can RAISE the truco
         
         self.waiting_for_response = None # 'envido' or 'truco'
+        self.resume_turn = None # Who has to play once the pending calls are answered
         self.cards_played_this_turn = []
         
-        self.add_log(f"--- Arranca la Mano {self.hand_number + 1} ---")
-        self.add_log(f"Reparte: {'Vos' if self.current_turn != self.p1 else 'TrucoBot'}")
+        self.emit(GameEvent.ROUND_START, self.hand_number, 2 if self.current_turn == self.p1 else 1)
         
         self.deal()
         
@@ -62,15 +399,27 @@ class TrucoGame:
         self.envido_points_p1 = calculate_envido_points(self.p1.hand)
         self.envido_points_p2 = calculate_envido_points(self.p2.hand)
         self.phase = GamePhase.PLAYING
+        self.emit(GameEvent.DEAL, tuple([c.id for c in self.p1.hand]), tuple([c.id for c in self.p2.hand]))
         
+    def play(self):
+        # Drives a match between two players that implement get_action(game_state).
+        # Returns the winning player.
+        while self.phase != GamePhase.GAME_OVER:
+            player = self.current_turn
+            action = player.get_action(self.get_state_for_player(player))
+            success, msg = self.handle_action(player, action)
+            if not success:
+                raise ValueError(f"{player.name}: {msg}")
+        return self.p1 if self.p1_score >= self.target_score else self.p2
+
     def get_opponent(self, player):
-        return self.p2 if player == self.p1 else self.p1
+        return self.p2 if player is self.p1 else self.p1
         
     def get_state_for_player(self, player):
         opp = self.get_opponent(player)
         
         is_turn = (self.current_turn == player)
-        valid_actions = self.get_valid_actions(player) if is_turn else []
+        valid_mask = self.get_valid_mask(player) if is_turn else 0
         
         return {
             "phase": self.phase,
@@ -81,109 +430,146 @@ class TrucoGame:
             "opp_played": [str(c) for c in (self.played_cards_p2 if player == self.p1 else self.played_cards_p1)],
             "cards_on_table": [str(c) for c in self.cards_played_this_turn],
             "is_turn": is_turn,
-            "valid_actions": valid_actions,
+            "valid_actions": mask_to_names(valid_mask),
+            "valid_mask": valid_mask,
             "envido_state": self.envido_state,
             "truco_state": self.truco_state,
             "my_envido": self.envido_points_p1 if player == self.p1 else self.envido_points_p2,
             "hand_number": self.hand_number,
             "round_winners": self.round_winners,
             "waiting_for_response": self.waiting_for_response,
-            "log": self.log,
-            "truco_turn": 1 if self.truco_turn == self.p1 else (2 if self.truco_turn == self.p2 else None)
+            "events": self.events,
+            "truco_turn": 1 if self.truco_turn == self.p1 else (2 if self.truco_turn == self.p2 else None),
+            "seat": self.seat_of(player),
+            "target_score": self.target_score,
+            "info_set": self.info_set(player),
+            "version": self.version,
+        }
+
+    def get_spectator_state(self):
+        # The table as someone watching it sees it: scores, played cards and calls by
+        # seat, how many cards each player still holds but not which, no envido points
+        return {
+            "phase": self.phase,
+            "players": [self.p1.name, self.p2.name],
+            "scores": [self.p1_score, self.p2_score],
+            "cards_left": [len(self.p1.hand), len(self.p2.hand)],
+            "played": [[str(c) for c in self.played_cards_p1], [str(c) for c in self.played_cards_p2]],
+            "cards_on_table": [str(c) for c in self.cards_played_this_turn],
+            "turn": self.seat_of(self.current_turn) if self.phase == GamePhase.PLAYING else None,
+            "envido_state": self.envido_state,
+            "truco_state": self.truco_state,
+            "hand_number": self.hand_number,
+            "round_winners": self.round_winners,
+            "waiting_for_response": self.waiting_for_response,
+            "events": self.events,
+            "truco_turn": 1 if self.truco_turn == self.p1 else (2 if self.truco_turn == self.p2 else None),
+            "target_score": self.target_score,
+            "version": self.version,
         }
         
-    def get_valid_actions(self, player):
+    def get_valid_mask(self, player):
+        # Bitmask over the action ids of actions.py
         if self.phase != GamePhase.PLAYING:
-            return []
+            return 0
             
-        actions = []
-        
         if self.waiting_for_response == 'envido':
-            actions.extend(['envido_quiero', 'envido_no_quiero'])
-            # Can also raise
-            if self.envido_state == EnvidoState.ENVIDO:
-                actions.extend(['call_envido', 'call_real_envido', 'call_falta_envido'])
-            elif self.envido_state in [EnvidoState.REAL_ENVIDO, EnvidoState.ENVIDO_ENVIDO]:
-                actions.extend(['call_falta_envido'])
-            return actions
+            mask = ENVIDO_ANSWER_MASK
+            # Can also raise, following the envido ladder
+            for call in get_envido_raises(self.envido_state):
+                mask |= 1 << CALL_ACTIONS[call]
+            return mask
             
         if self.waiting_for_response == 'truco':
-            actions.extend(['truco_quiero', 'truco_no_quiero'])
+            mask = TRUCO_ANSWER_MASK
             # Can raise if state allows
             next_state = get_next_truco_state(self.truco_state)
             if next_state:
-                actions.append(f'call_{next_state}')
-            return actions
+                mask |= 1 << CALL_ACTIONS[next_state]
+            return mask
             
         # Normal play
-        for i in range(len(player.hand)):
-            actions.append(f"play_card_{i}")
+        mask = HAND_MASKS[len(player.hand)]
             
         # Call Envido (only if first round and no cards played by this player)
-        has_played = (len(self.played_cards_p1) > 0 if player == self.p1 else len(self.played_cards_p2) > 0)
+        has_played = len(self.played_cards_p1 if player is self.p1 else self.played_cards_p2) > 0
         # Fix: envido_played tracking stops multiple envido calls if it already passed.
-        if len(self.round_winners) == 0 and not has_played and self.envido_state == EnvidoState.NOT_CALLED and not self.envido_played and self.truco_state == TrucoState.NOT_CALLED:
-            actions.extend(['call_envido', 'call_real_envido', 'call_falta_envido'])
+        if not self.round_winners and not has_played and self.envido_state == EnvidoState.NOT_CALLED and not self.envido_played and self.truco_state == TrucoState.NOT_CALLED:
+            mask |= ENVIDO_CALL_MASK
             
         # Call Truco (Sequence: Nada -> Truco -> Retruco -> Vale 4)
         if self.truco_state == TrucoState.NOT_CALLED:
-            actions.append('call_truco')
-        elif self.truco_turn == player:
+            mask |= 1 << CALL_TRUCO
+        elif self.truco_turn is player:
             next_state = get_next_truco_state(self.truco_state)
             if next_state:
-                actions.append(f'call_{next_state}')
-                
-        # Make sure that playing a card is ONLY allowed if 'truco' isn't waiting
-        if self.waiting_for_response == 'truco':
-            actions = [a for a in actions if not a.startswith('play_card_')]
+                mask |= 1 << CALL_ACTIONS[next_state]
                 
-        return actions
+        return mask
+
+    def get_valid_actions(self, player):
+        # Action names, for the web API and the console
+        return mask_to_names(self.get_valid_mask(player))
 
     def handle_action(self, player, action):
-        if player != self.current_turn:
+        # String adapter over handle_action_id; ids are accepted as they are
+        if action.__class__ is not int:
+            # Anything but a name (a list from a JSON body, say) is just invalid
+            action_id = ACTION_IDS.get(action) if action.__class__ is str else None
+            if action_id is None:
+                return False, f"Invalid action {action}"
+            action = action_id
+        return self.handle_action_id(player, action)
+
+    def handle_action_id(self, player, action):
+        if player is not self.current_turn:
             return False, "Not your turn"
             
-        if action not in self.get_valid_actions(player):
-            return False, f"Invalid action {action}"
+        if not 0 <= action < NUM_ACTIONS or not self.get_valid_mask(player) >> action & 1:
+            return False, f"Invalid action {ACTION_NAMES[action] if 0 <= action < NUM_ACTIONS else action}"
 
-        name = "Vos" if player == self.p1 else "TrucoBot"
+        seat = 1 if player is self.p1 else 2
 
-        # Flavor text helpers
-        quiero_envido_phrases = ["¡Quiero!", "¡Se la rre banca, quiero!", "¡Quiero y retruco no... mentira, quiero!", "Venga ese envido."]
-        no_quiero_envido_phrases = ["No quiero.", "Paso.", "Son buenas, me achico.", "No me da el cuero, no quiero."]
-        quiero_truco_phrases = ["¡Quiero!", "¡Vení que me la banco!", "A ver si sos tan guapo, ¡quiero!", "Dale, quiero."]
-        no_quiero_truco_phrases = ["Me voy al mazo.", "Te la dejo.", "No tengo nada, me chicho.", "Buen truco, me achico."]
-        
-        # Determine specific phrase for Bot vs Player
-        def get_phrase(phrases_list, is_bot):
-            return random.choice(phrases_list) if is_bot else phrases_list[0]
-
-        is_bot = player == self.p2
+        # Handle Play Card
+        if action <= PLAY_CARD_2:
+            card = player.play_card(action)
+            self.cards_played_this_turn.append(card)
+            
+            if player is self.p1:
+                self.played_cards_p1.append(card)
+            else:
+                self.played_cards_p2.append(card)
+                
+            self.emit(GameEvent.PLAY_CARD, seat, card.id)
+                
+            # If both have played, resolve the trick
+            if len(self.cards_played_this_turn) == 2:
+                self.resolve_trick()
+            else:
+                self.current_turn = self.get_opponent(player)
+                
+            return True, f"Played {card}"
 
         # Handle Responses
-        if action == 'envido_quiero':
-            phrase = get_phrase(quiero_envido_phrases, is_bot)
-            self.add_log(f"{name}: {phrase}")
+        if action == ENVIDO_QUIERO:
+            self.emit(GameEvent.ENVIDO_QUIERO, seat)
             self.resolve_envido(accepted=True)
             self.waiting_for_response = None
-            self.current_turn = self.get_opponent(player) # Return turn to whoever called it (simplified)
-            # Actually turn returns to whoever has to play a card
-            # To be accurate, turn returns to whoever's turn it was before the calls started
+            # Turn returns to whoever's turn it was before the calls started
+            self.current_turn = self.resume_turn
             return True, "Envido accepted"
             
-        elif action == 'envido_no_quiero':
-            phrase = get_phrase(no_quiero_envido_phrases, is_bot)
-            self.add_log(f"{name}: {phrase}")
+        elif action == ENVIDO_NO_QUIERO:
+            self.emit(GameEvent.ENVIDO_NO_QUIERO, seat)
             self.resolve_envido(accepted=False)
             self.waiting_for_response = None
-            self.current_turn = self.get_opponent(player)
+            self.current_turn = self.resume_turn
             return True, "Envido rejected"
             
-        elif action.startswith('truco_quiero'):
-            phrase = get_phrase(quiero_truco_phrases, is_bot)
+        elif action == TRUCO_QUIERO:
             next_state = get_next_truco_state(self.truco_state)
             
-            self.add_log(f"{name}: {phrase}")
+            self.emit(GameEvent.TRUCO_QUIERO, seat)
             if next_state == TrucoState.VALE_4 and self.truco_state == TrucoState.RETRUCO:
                  self.truco_state = TrucoState.VALE_4 # accepted vale 4
                  self.truco_turn = None # nobody can raise anymore
@@ -197,68 +583,33 @@ class TrucoGame:
                  
             self.truco_turn = self.get_opponent(player) # The one who didn't accept gets the turn to raise
             self.waiting_for_response = None
-            self.current_turn = self.get_opponent(player)
+            self.current_turn = self.resume_turn
             return True, "Truco accepted"
             
-        elif action == 'truco_no_quiero':
-            phrase = get_phrase(no_quiero_truco_phrases, is_bot)
-            self.add_log(f"{name}: {phrase}")
+        elif action == TRUCO_NO_QUIERO:
+            self.emit(GameEvent.TRUCO_NO_QUIERO, seat)
             self.resolve_truco_rejection(player)
             return True, "Truco rejected"
 
         # Handle Calls
-        if action.startswith('call_'):
-            call_type = action[len('call_'):]
-            call_names = {
-                'envido': '¡Envido!', 'real_envido': '¡Real Envido!', 'falta_envido': '¡Falta Envido carajo!',
-                'truco': '¡Truco!', 'retruco': '¡Quiero Retruco!', 'vale_4': '¡Quiero Vale Cuatro!'
-            }
-            cname = call_names.get(call_type, call_type)
-            # Flavor variation for bot
-            if is_bot and call_type == 'truco':
-                cname = random.choice(["¡Truco!", "Jugá que te canto Truco.", "Te veo flojo... ¡Truco!"])
-            elif is_bot and call_type == 'envido':
-                cname = random.choice(["¡Envido!", "Tengo puntitos... ¡Envido!", "Canto Envido."])
-                
-            self.add_log(f"{name}: {cname}")
-            
-            if call_type in ['envido', 'real_envido', 'falta_envido']:
-                self.envido_state = call_type
-                self.envido_history.append(call_type)
-                self.envido_played = True
-                self.waiting_for_response = 'envido'
-                self.current_turn = self.get_opponent(player)
-                return True, f"Called {call_type}"
-            elif call_type in ['truco', 'retruco', 'vale_4']:
-                self.truco_state = call_type # state becomes the call immediately
-                self.truco_owner = player # only owner can be rejected
-                self.truco_turn = None # nobody can raise while waiting
-                self.waiting_for_response = 'truco'
-                self.current_turn = self.get_opponent(player)
-                return True, f"Called {call_type}"
-
-        # Handle Play Card
-        if action.startswith('play_card_'):
-            idx = int(action.split('_')[2])
-            card = player.play_card(idx)
-            self.cards_played_this_turn.append(card)
-            
-            if player == self.p1:
-                self.played_cards_p1.append(card)
-            else:
-                self.played_cards_p2.append(card)
-                
-            self.add_log(f"{name} juega: {card}")
-                
-            # If both have played, resolve the trick
-            if len(self.cards_played_this_turn) == 2:
-                self.resolve_trick()
-            else:
-                self.current_turn = self.get_opponent(player)
-                
-            return True, f"Played {card}"
-            
-        return False, "Unknown action"
+        call_type = CALL_TYPES[action]
+        self.emit(GameEvent.CALL, seat, call_type)
+        if self.waiting_for_response is None:
+            # First call of a chain: remember who was about to play
+            self.resume_turn = player
+        
+        if action <= CALL_FALTA_ENVIDO:
+            self.envido_state = get_envido_raises(self.envido_state)[call_type]
+            self.envido_history.append(self.envido_state)
+            self.envido_played = True
+            self.waiting_for_response = 'envido'
+        else:
+            self.truco_state = call_type # state becomes the call immediately
+            self.truco_owner = player # only owner can be rejected
+            self.truco_turn = None # nobody can raise while waiting
+            self.waiting_for_response = 'truco'
+        self.current_turn = self.get_opponent(player)
+        return True, f"Called {call_type}"
 
     def resolve_envido(self, accepted):
         if accepted:
@@ -269,35 +620,35 @@ class TrucoGame:
             # In tie, player who is "Mano" (P1 if hand_number is even) wins
             is_p1_mano = (self.hand_number % 2 == 0)
             
-            self.add_log(f"Puntos de Envido: Vos ({self.envido_points_p1}) vs TrucoBot ({self.envido_points_p2})")
+            self.emit(GameEvent.ENVIDO_POINTS, self.envido_points_p1, self.envido_points_p2)
             
             if self.envido_points_p1 > self.envido_points_p2:
                 self.p1_score += pts
                 self.envido_winner = self.p1
-                self.add_log(f"Vos ganás {pts} puntos de Envido.")
+                self.emit(GameEvent.ENVIDO_WON, 1, pts, False)
             elif self.envido_points_p2 > self.envido_points_p1:
                 self.p2_score += pts
                 self.envido_winner = self.p2
-                self.add_log(f"TrucoBot gana {pts} puntos de Envido.")
+                self.emit(GameEvent.ENVIDO_WON, 2, pts, False)
             else:
                 if is_p1_mano:
                     self.p1_score += pts
                     self.envido_winner = self.p1
-                    self.add_log(f"Empate. Vos sos mano y ganás {pts} puntos.")
+                    self.emit(GameEvent.ENVIDO_WON, 1, pts, True)
                 else:
                     self.p2_score += pts
                     self.envido_winner = self.p2
-                    self.add_log(f"Empate. TrucoBot es mano y gana {pts} puntos.")
+                    self.emit(GameEvent.ENVIDO_WON, 2, pts, True)
         else:
-            # simple for now
-            pts = get_no_quiero_points(self.envido_state)
+            # The caller wins what was already accepted before the last call
+            pts = get_reject_points(self.envido_history)
             opp = self.get_opponent(self.current_turn)
             if opp == self.p1:
                 self.p1_score += pts
-                self.add_log(f"Vos ganás {pts} puntos porque TrucoBot no quiso.")
+                self.emit(GameEvent.ENVIDO_REJECTED, 1, pts)
             else:
                 self.p2_score += pts
-                self.add_log(f"TrucoBot gana {pts} puntos porque no quisiste.")
+                self.emit(GameEvent.ENVIDO_REJECTED, 2, pts)
                 
         self.check_game_over()
 
@@ -322,8 +673,8 @@ class TrucoGame:
         # So we need to map c1 and c2 to p1 and p2 based on who played first
         first_player = self.get_opponent(self.current_turn)
         
-        v1 = c1.get_truco_value()
-        v2 = c2.get_truco_value()
+        v1 = TRUCO_VALUE[c1.id]
+        v2 = TRUCO_VALUE[c2.id]
         
         winner_id = 0 # 0=parda, 1=p1, 2=p2
         trick_winner = None
@@ -337,12 +688,9 @@ class TrucoGame:
             
         if trick_winner == self.p1:
             winner_id = 1
-            self.add_log("-> Vos ganás la baza.")
         elif trick_winner == self.p2:
             winner_id = 2
-            self.add_log("-> TrucoBot gana la baza.")
-        else:
-            self.add_log("-> ¡Parda! (Empate)")
+        self.emit(GameEvent.TRICK, winner_id)
             
         self.round_winners.append(winner_id)
         self.cards_played_this_turn = []
@@ -358,40 +706,14 @@ class TrucoGame:
         
     def check_round_end(self):
         # Determine if someone has won 2 tricks or if pardas dictate a win
-        p1_wins = self.round_winners.count(1)
-        p2_wins = self.round_winners.count(2)
-        pardas = self.round_winners.count(0)
-        
-        round_over = False
-        winner = None
-        
-        if p1_wins == 2:
-            round_over = True; winner = self.p1
-        elif p2_wins == 2:
-            round_over = True; winner = self.p2
-        elif len(self.round_winners) >= 2:
-            # Complex parda logic
-            if pardas == 1:
-                # If they tied one, whoever won the other wins the round
-                if p1_wins == 1: round_over = True; winner = self.p1
-                if p2_wins == 1: round_over = True; winner = self.p2
-            elif pardas >= 2:
-                # If two pardas, mano wins (p1 if hand%2==0)
-                round_over = True
-                winner = self.p1 if self.hand_number % 2 == 0 else self.p2
-        elif len(self.round_winners) == 3:
-             # Should be covered above, but just in case
-             if p1_wins > p2_wins: winner = self.p1
-             else: winner = self.p2
-             round_over = True
-             
-        if round_over:
+        winner_seat = get_hand_winner(self.round_winners, 1 if self.hand_number % 2 == 0 else 2)
+        if winner_seat is not None:
             pts = get_truco_points(self.truco_state)
-            if winner == self.p1:
-                self.add_log(f"¡Vos ganás la mano! Sumás {pts} puntos.")
+            if winner_seat == 1:
+                self.emit(GameEvent.HAND_WON, 1, pts)
                 self.p1_score += pts
             else:
-                self.add_log(f"TrucoBot gana la mano. Suma {pts} puntos.")
+                self.emit(GameEvent.HAND_WON, 2, pts)
                 self.p2_score += pts
             self.end_round()
 
@@ -404,9 +726,6 @@ class TrucoGame:
     def check_game_over(self):
         if self.p1_score >= self.target_score or self.p2_score >= self.target_score:
             self.phase = GamePhase.GAME_OVER
-            if self.p1_score >= self.target_score:
-                self.add_log("¡Ganaste la partida!")
-            else:
-                self.add_log("TrucoBot ganó la partida.")
+            self.emit(GameEvent.GAME_OVER, 1 if self.p1_score >= self.target_score else 2)
             return True
         return False
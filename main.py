@@ -8,4 +8,7 @@ if __name__ == "__main__":
     bot = RandomBot("Bot")
     
     game = TrucoGame(human, bot)
-    game.play()
+    winner = game.play()
+    for msg in game.events.lines(human.seen_events):
+        print(msg)
+    print(f"{winner.name} wins {game.p1_score} - {game.p2_score}")
@@ -0,0 +1,240 @@
+import bisect
+import os
+import sys
+import threading
+import time
+import types
+from collections import Counter as Tally, deque
+
+from actions import ACTION_NAMES
+from card import Card
+
+# Runtime metrics of the web server in the Prometheus text format, and a sampling
+# profiler. Nothing here runs unless app.py installs it (TRUCO_METRICS=1): the timers
+# are wrappers put on the server's own games and sessions when they are created, so
+# with metrics off the code paths are exactly the uninstrumented ones, and the games
+# search bots clone internally are never timed either way.
+
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                   0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+# Live games whose size is measured for truco_game_memory_bytes on each scrape
+MEMORY_SAMPLE = 16
+
+def _labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{n}="{v}"' for n, v in zip(names, values)) + '}'
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, labels
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, label_values=(), amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            values = sorted(self.values.items())
+        lines += [f"{self.name}{_labels(self.labels, key)} {value}" for key, value in values]
+        return lines
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help, labels, buckets
+        # label values -> [count per bucket..., count above the last bucket, sum]
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, label_values=()):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [0] * (len(self.buckets) + 2)
+            series[i] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            series = sorted((key, list(values)) for key, values in self.series.items())
+        for key, values in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), values):
+                cumulative += count
+                labels = _labels(self.labels + ('le',), key + (bound,))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, key)} {values[-1]}")
+            lines.append(f"{self.name}_count{_labels(self.labels, key)} {cumulative}")
+        return lines
+
+class Gauge:
+    # Read when scraped: fn() returns the value, or {label values: value}
+    def __init__(self, name, help, fn, labels=(), kind='gauge'):
+        self.name, self.help, self.fn, self.labels, self.kind = name, help, fn, labels, kind
+
+    def render(self):
+        value = self.fn()
+        values = value.items() if isinstance(value, dict) else [((), value)]
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + \
+               [f"{self.name}{_labels(self.labels, key)} {v}" for key, v in values]
+
+HANDLE_ACTION = Histogram('truco_handle_action_seconds', "TrucoGame.handle_action of server games")
+STATE = Histogram('truco_state_seconds', "TrucoGame.get_state_for_player of server games")
+VIEW = Histogram('truco_view_seconds', "Building and encoding a state view, cached ones included",
+                 ('kind',))
+BOT = Histogram('truco_bot_decision_seconds', "Bot get_action, by bot class", ('bot',))
+REQUEST = Histogram('truco_request_seconds', "Flask request handling until the response is returned "
+                    "(streams: until they start)", ('route',))
+RESPONSES = Counter('truco_responses_total', "Responses by route and status", ('route', 'status'))
+ACTIONS = Counter('truco_actions_total', "Accepted actions by type and seat", ('action', 'seat'))
+
+def _timed(fn, histogram, label_values=()):
+    observe = histogram.observe
+    def timed(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            observe(time.perf_counter() - start, label_values)
+    return timed
+
+def instrument_game(game, bots=()):
+    # Times this game's handle_action and get_state_for_player and the get_action of
+    # the players in `bots`, by patching the instances. Clones made by search bots are
+    # new instances and stay untimed.
+    handle_action = game.handle_action
+    def counted(player, action):
+        start = time.perf_counter()
+        try:
+            success, msg = result = handle_action(player, action)
+        finally:
+            HANDLE_ACTION.observe(time.perf_counter() - start)
+        if success:
+            name = ACTION_NAMES[action] if action.__class__ is int else action
+            ACTIONS.inc((name, game.seat_of(player)))
+        return result
+    game.handle_action = counted
+    game.get_state_for_player = _timed(game.get_state_for_player, STATE)
+    for bot in bots:
+        bot.get_action = _timed(bot.get_action, BOT, (type(bot).__name__,))
+
+_SHARED = (type, types.ModuleType, types.FunctionType, types.MethodType, types.BuiltinFunctionType, Card)
+
+def deep_size(obj):
+    # Bytes of obj and everything it holds, not counting code, modules and cards (shared)
+    seen = set()
+    size = 0
+    stack = [obj]
+    while stack:
+        o = stack.pop()
+        if id(o) in seen or isinstance(o, _SHARED):
+            continue
+        seen.add(id(o))
+        size += sys.getsizeof(o)
+        if isinstance(o, dict):
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset, deque)):
+            stack.extend(o)
+        elif hasattr(o, '__dict__'):
+            stack.append(vars(o))
+    return size
+
+def game_memory(session):
+    # Called with session.lock held. What one live game costs: its state (players and
+    # listeners aside) and the views kept for its clients.
+    game = session.game
+    parts = [value for key, value in vars(game).items() if key not in ('p1', 'p2', 'listeners')]
+    parts += [game.p1.hand, game.p2.hand, session.views, session.spectator_views, session.encoded_views]
+    return deep_size(parts)
+
+def _memory_per_game(registry):
+    with registry.lock:
+        sessions = list(registry.sessions.values())[-MEMORY_SAMPLE:]
+    sizes = []
+    for session in sessions:
+        with session.lock:
+            sizes.append(game_memory(session))
+    return sum(sizes) / len(sizes) if sizes else 0
+
+def install(app, registry, sessions_class):
+    # Instruments the Flask app and the sessions, and serves /metrics. Games still need
+    # instrument_game() as they are created or loaded.
+    from flask import g, request
+
+    sessions_class.encoded = _view_timer(sessions_class.encoded)
+
+    @app.before_request
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def observe_request(response):
+        start = g.pop('metrics_start', None)
+        route = request.endpoint or 'unknown'
+        if start is not None:
+            REQUEST.observe(time.perf_counter() - start, (route,))
+        RESPONSES.inc((route, response.status_code))
+        return response
+
+    gauges = [
+        Gauge('truco_live_games', "Games in memory", lambda: len(registry)),
+        Gauge('truco_game_memory_bytes', f"Mean size of the {MEMORY_SAMPLE} most recently used games",
+              lambda: _memory_per_game(registry)),
+        Gauge('truco_games_evicted_total', "Games dropped from memory", lambda: registry.evicted, kind='counter'),
+        Gauge('truco_games_loaded_total', "Games rebuilt from the store", lambda: registry.loaded, kind='counter'),
+    ]
+    metrics = [HANDLE_ACTION, STATE, VIEW, BOT, REQUEST, RESPONSES, ACTIONS] + gauges
+
+    def serve_metrics():
+        body = "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+        return app.response_class(body, mimetype='text/plain; version=0.0.4')
+    app.add_url_rule('/metrics', 'metrics', serve_metrics)
+
+def _view_timer(encoded):
+    def timed(session, since=None, spectator=False, text=False):
+        start = time.perf_counter()
+        try:
+            return encoded(session, since, spectator, text)
+        finally:
+            VIEW.observe(time.perf_counter() - start, ('spectator' if spectator else 'player',))
+    return timed
+
+class SamplingProfiler:
+    # Every `interval` seconds, records the stack of every other thread. The result is
+    # in the folded format of flamegraph.pl and speedscope: one line per distinct stack,
+    # thread name first and then its frames from the outermost, with how often it was seen.
+    def __init__(self, interval=0.005):
+        self.interval = interval
+
+    def sample(self, seconds):
+        # Tally of folded stacks over `seconds`, sampled from the calling thread
+        own = threading.get_ident()
+        names = {}
+        stacks = Tally()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                frames = []
+                while frame is not None:
+                    code = frame.f_code
+                    frames.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                frames.append(names.get(ident, str(ident)))
+                stacks[";".join(reversed(frames))] += 1
+            time.sleep(self.interval)
+        return stacks
+
+    @staticmethod
+    def folded(stacks):
+        return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
@@ -0,0 +1,242 @@
+import os
+import threading
+import time
+
+import numpy as np
+
+from actions import NUM_ACTIONS
+from batch_env import OBS_SIZE, observation_from_info_set
+
+# A small policy MLP in plain NumPy: features of the player's observation in, one logit
+# per action id out, illegal actions masked before the softmax. Observations are the rows
+# BatchTrucoEnv returns, so the same net plays from a get_state_for_player dict and from
+# batched self-play. Weights live in an .npz file:
+#
+#   format: FORMAT_VERSION, refused by load() if it differs
+#   generation: training step the weights come from (0 for untrained)
+#   w0, b0, w1, b1, ...: layer weights (inputs x outputs) and biases, float32
+
+FORMAT_VERSION = 1
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'neural_policy.npz')
+HIDDEN_SIZES = (128, 64)
+
+# Feature layout: each hand slot one-hot over the 40 cards (the slot is what play_card_k
+# plays), the cards each side played, trick results one-hot (own, opponent's, parda),
+# then scores and call states.
+CARD_SLOTS = 3 * 40
+PLAYED = 2 * 40
+TRICKS = 3 * 3
+FEATURE_SIZE = CARD_SLOTS + PLAYED + TRICKS + 2 + 1 + 4 + 7 + 3 + 3 + 2
+_ACTION_BITS = np.arange(NUM_ACTIONS)
+
+def _one_hot(out, offset, values, size):
+    # Sets out[row, offset + value] for every row whose value is in range(size)
+    rows = np.nonzero((values >= 0) & (values < size))[0]
+    out[rows, offset + values[rows]] = 1.0
+
+def features(obs):
+    # (N, OBS_SIZE) observations of batch_env -> (N, FEATURE_SIZE) float32 inputs
+    obs = np.asarray(obs).reshape(-1, OBS_SIZE)
+    out = np.zeros((len(obs), FEATURE_SIZE), dtype=np.float32)
+    for slot in range(3):
+        _one_hot(out, 40 * slot, obs[:, slot], 40)
+    for column in range(3, 9):
+        # Own played cards (3-5) share one 40-card block, the opponent's (6-8) the next
+        _one_hot(out, CARD_SLOTS + 40 * (column >= 6), obs[:, column], 40)
+    offset = CARD_SLOTS + PLAYED
+    for column in range(9, 12):
+        results = obs[:, column]
+        _one_hot(out, offset, np.where(results == 0, 2, results - 1), 3)
+        offset += 3
+    target = obs[:, 22].astype(np.float32)
+    out[:, offset] = obs[:, 12] / target
+    out[:, offset + 1] = obs[:, 13] / target
+    out[:, offset + 2] = obs[:, 14]
+    offset += 3
+    _one_hot(out, offset, obs[:, 15], 4)
+    _one_hot(out, offset + 4, obs[:, 16], 7)
+    _one_hot(out, offset + 11, obs[:, 17], 3)
+    offset += 14
+    out[:, offset] = obs[:, 18] / 33.0
+    out[:, offset + 1] = obs[:, 19] >= 0
+    out[:, offset + 2] = np.maximum(obs[:, 19], 0) / 33.0
+    out[:, offset + 3] = obs[:, 20]
+    out[:, offset + 4] = obs[:, 21]
+    return out
+
+def encode_state(game_state):
+    # Feature vector of a get_state_for_player dict
+    obs = observation_from_info_set(game_state['info_set'], game_state['seat'], game_state['target_score'])
+    return features(np.array(obs))[0]
+
+def mask_array(valid_mask):
+    # Bitmask of valid action ids -> boolean row
+    return (valid_mask >> _ACTION_BITS) & 1 == 1
+
+def _masked_softmax(logits, masks):
+    logits = np.where(masks, logits, -np.inf)
+    logits -= logits.max(axis=1, keepdims=True)
+    p = np.exp(logits)
+    return p / p.sum(axis=1, keepdims=True)
+
+class PolicyNet:
+    def __init__(self, weights, biases, generation=0):
+        self.weights = [np.asarray(w, dtype=np.float32) for w in weights]
+        self.biases = [np.asarray(b, dtype=np.float32) for b in biases]
+        self.generation = generation
+
+    @classmethod
+    def initialize(cls, seed=0, hidden_sizes=HIDDEN_SIZES):
+        # He-initialized weights, zero biases
+        rng = np.random.default_rng(seed)
+        sizes = (FEATURE_SIZE,) + tuple(hidden_sizes) + (NUM_ACTIONS,)
+        weights = [rng.normal(0, np.sqrt(2 / n), (n, m)) for n, m in zip(sizes, sizes[1:])]
+        return cls(weights, [np.zeros(m) for m in sizes[1:]])
+
+    def forward(self, x):
+        # (N, FEATURE_SIZE) -> (N, NUM_ACTIONS) logits
+        for w, b in zip(self.weights[:-1], self.biases[:-1]):
+            x = np.maximum(x @ w + b, 0)
+        return x @ self.weights[-1] + self.biases[-1]
+
+    def policy(self, x, masks):
+        # Action probabilities, zero outside the (N, NUM_ACTIONS) boolean masks
+        return _masked_softmax(self.forward(x), masks)
+
+    def gradients(self, x, masks, actions, advantages):
+        # Gradients of -mean(advantage * log p(action)), the policy-gradient loss, as
+        # (weight gradients, bias gradients) in layer order
+        activations = [x]
+        for w, b in zip(self.weights[:-1], self.biases[:-1]):
+            activations.append(np.maximum(activations[-1] @ w + b, 0))
+        delta = _masked_softmax(activations[-1] @ self.weights[-1] + self.biases[-1], masks)
+        delta[np.arange(len(x)), actions] -= 1
+        delta *= (advantages / len(x))[:, None]
+        grad_w, grad_b = [], []
+        for layer in reversed(range(len(self.weights))):
+            grad_w.append(activations[layer].T @ delta)
+            grad_b.append(delta.sum(axis=0))
+            if layer:
+                delta = (delta @ self.weights[layer].T) * (activations[layer] > 0)
+        return grad_w[::-1], grad_b[::-1]
+
+    def save(self, path):
+        arrays = {'format': FORMAT_VERSION, 'generation': self.generation}
+        for i, (w, b) in enumerate(zip(self.weights, self.biases)):
+            arrays[f'w{i}'], arrays[f'b{i}'] = w, b
+        tmp = path + '.tmp.npz'
+        np.savez(tmp, **arrays)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            if 'format' not in data:
+                raise ValueError(f"{path} is not a policy weights file")
+            if int(data['format']) != FORMAT_VERSION:
+                raise ValueError(f"{path} has weights format {int(data['format'])}, expected {FORMAT_VERSION}")
+            layers = sum(1 for name in data.files if name.startswith('w'))
+            net = cls([data[f'w{i}'] for i in range(layers)], [data[f'b{i}'] for i in range(layers)],
+                      int(data['generation']))
+        if net.weights[0].shape[0] != FEATURE_SIZE or net.weights[-1].shape[1] != NUM_ACTIONS:
+            raise ValueError(f"{path} was trained for a different feature encoding")
+        return net
+
+_loaded = None
+
+def get_net(path=None):
+    # Loaded on first use. Without a weights file the net is untrained (random play).
+    global _loaded
+    if _loaded is None:
+        path = path or DEFAULT_PATH
+        _loaded = PolicyNet.load(path) if os.path.exists(path) else PolicyNet.initialize()
+    return _loaded
+
+class _Request:
+    __slots__ = ('features', 'mask', 'result', 'error', 'done')
+
+    def __init__(self, features, mask):
+        self.features = features
+        self.mask = mask
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+class BatchedInference:
+    # Policy evaluations requested from many threads (bot moves of different games) run
+    # as one batched forward pass. The first request into an empty queue opens a window
+    # of `window` seconds and everything that arrives meanwhile, up to max_batch, joins
+    # it. Under load batches fill before the window closes, so the cost per decision
+    # falls as the number of concurrent games rises.
+    def __init__(self, net, max_batch=64, window=0.002):
+        self.net = net
+        self.max_batch = max_batch
+        self.window = window
+        self.queue = []
+        self.cond = threading.Condition()
+        self.thread = None
+        self.stopped = False
+        self.batches = 0
+        self.requests = 0
+
+    def predict(self, features, mask):
+        # Action probabilities for one feature vector and boolean mask. Blocks until
+        # the batch it joined has been evaluated.
+        request = _Request(features, mask)
+        with self.cond:
+            if self.stopped:
+                raise RuntimeError("Inference has been shut down")
+            self.queue.append(request)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='inference', daemon=True)
+                self.thread.start()
+            self.cond.notify_all()
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        if request.result is None:
+            raise RuntimeError("Inference has been shut down")
+        return request.result
+
+    def _next_batch(self):
+        with self.cond:
+            while not self.queue and not self.stopped:
+                self.cond.wait()
+            deadline = time.monotonic() + self.window
+            while len(self.queue) < self.max_batch and not self.stopped:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+            batch = self.queue[:self.max_batch]
+            del self.queue[:self.max_batch]
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if self.stopped:
+                for request in batch:
+                    request.done.set()
+                return
+            try:
+                probs = self.net.policy(np.stack([r.features for r in batch]), np.stack([r.mask for r in batch]))
+            except Exception as e:
+                # Every caller of the batch gets the error; the thread goes on with the next one
+                for request in batch:
+                    request.error = e
+                    request.done.set()
+                continue
+            self.batches += 1
+            self.requests += len(batch)
+            for request, p in zip(batch, probs):
+                request.result = p
+                request.done.set()
+
+    def shutdown(self):
+        with self.cond:
+            self.stopped = True
+            pending, self.queue = self.queue, []
+            self.cond.notify_all()
+        for request in pending:
+            request.done.set()
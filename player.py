@@ -1,8 +1,24 @@
+import math
 import random
+import time
+from itertools import combinations
+
+from actions import (PLAY_CARD_2, ENVIDO_QUIERO, ENVIDO_NO_QUIERO, CALL_ENVIDO, TRUCO_QUIERO,
+                     TRUCO_NO_QUIERO, CALL_TRUCO, CALL_RETRUCO, CALL_VALE_4, ACTION_NAMES, MASK_ACTIONS,
+                     PLAY_MASK, ENVIDO_CALL_MASK, ENVIDO_ANSWER_MASK, mask_to_names)
+from card import NUM_CARDS, TRUCO_VALUE
+from envido import envido_points_for_ids
+from envido_cfr import PASS, envido_policy
+from equity import hand_equity, trick_equity
+from endgame import EndgameSolver
+from game import (TrucoGame, GamePhase, P1_SCORE, P2_SCORE, HAND_NUMBER, HAND1, HAND2,
+                  PLAYED1, PLAYED2, ON_TABLE, ROUND_WINNERS, ENVIDO_HISTORY, ENVIDO_POINTS1, ENVIDO_POINTS2)
 
 class Player:
-    def __init__(self, name):
+    def __init__(self, name, rng=None):
         self.name = name
+        # Source of randomness for bot decisions; defaults to the global random module
+        self.rng = rng if rng is not None else random
         self.hand = []
         self.score = 0
         self.played_cards = []
@@ -22,56 +38,390 @@ class APIPlayer(Player):
     # API Player doesn't make automatic decisions, it waits for inputs from the Web UI.
     pass
 
-class HeuristicBot(Player):
+class HumanPlayer(Player):
+    # Console player, used by main.py
+    def __init__(self, name, rng=None):
+        super().__init__(name, rng)
+        self.seen_events = 0 # events of the game log already printed
+
     def get_action(self, game_state):
-        # Determine valid actions from game state
+        events = game_state['events']
+        for msg in events.lines(self.seen_events):
+            print(msg)
+        self.seen_events = events.total
+
+        print(f"\nVos {game_state['my_score']} - {game_state['opp_score']} Rival")
+        if game_state['cards_on_table']:
+            print("En la mesa:", ", ".join(game_state['cards_on_table']))
+        print("Tus cartas:", ", ".join(f"[{c['id']}] {c['str']}" for c in game_state['my_cards']))
+
         valid_actions = game_state.get('valid_actions', [])
+        for i, action in enumerate(valid_actions):
+            print(f"  {i}) {action}")
+        while True:
+            choice = input("> ").strip()
+            if choice in valid_actions:
+                return choice
+            if choice.isdigit() and int(choice) < len(valid_actions):
+                return valid_actions[int(choice)]
+            print("Acción inválida.")
+
+class RandomBot(Player):
+    # Plays uniformly at random among the valid actions. Baseline for tournaments.
+    def get_action(self, game_state):
+        valid_actions = game_state.get('valid_actions', [])
+        if valid_actions:
+            return self.rng.choice(valid_actions)
+        return None
+
+class HeuristicBot(Player):
+    # Minimum hand equity to make each truco call
+    TRUCO_THRESHOLDS = {CALL_TRUCO: 0.7, CALL_RETRUCO: 0.75, CALL_VALE_4: 0.85}
+
+    def truco_equity(self, game_state):
+        info = game_state['info_set']
+        seat = game_state['seat']
+        hand, played = info[HAND1 if seat == 1 else HAND2], info[PLAYED1 if seat == 1 else PLAYED2]
+        mine = hand + played
+        opp_played = info[PLAYED2 if seat == 1 else PLAYED1]
+        mano = (info[HAND_NUMBER] % 2 == 0) == (seat == 1)
+        if info[ROUND_WINNERS]:
+            # Once a trick is decided the dealt hand no longer says who wins: solve the rest
+            round_winners = [w if w == 0 else 1 if w == seat else 2 for w in info[ROUND_WINNERS]]
+            on_table = info[ON_TABLE]
+            lead = (on_table[0], 1 if on_table[0] in played else 2) if on_table else None
+            opp_in_hand = len(info[HAND2 if seat == 1 else HAND1])
+            return trick_equity(hand, mine + opp_played, opp_in_hand, round_winners, mano, lead)
+        equity = None
+        if opp_played:
+            equity = hand_equity(mine, mano, opp_played[0])
+        if equity is None:
+            equity = hand_equity(mine, mano)
+        return equity
+
+    def get_action(self, game_state):
+        # Valid actions as a bitmask over the ids of actions.py
+        mask = game_state.get('valid_mask', 0)
         
         # Helper rules
         envido_points = game_state.get('my_envido', 0)
         
         # 1. Answer Envido
-        if 'envido_quiero' in valid_actions:
+        if mask >> ENVIDO_QUIERO & 1:
             if envido_points >= 26:
                 return 'envido_quiero'
             else:
                 return 'envido_no_quiero'
                 
         # 2. Call Envido?
-        if 'call_envido' in valid_actions and envido_points >= 28:
+        if mask >> CALL_ENVIDO & 1 and envido_points >= 28:
             return 'call_envido'
             
-        # 3. Answer or call Truco/Retruco/Vale 4
-        if 'truco_quiero' in valid_actions:
-            # We must respond to a truco call.
-            has_high_card = any(c.get_truco_value() >= 10 for c in self.hand)
-            if has_high_card or random.random() < 0.3:
-                return 'truco_quiero'
-            return 'truco_no_quiero'
-            
-        if 'call_retruco' in valid_actions and random.random() < 0.2:
-            return 'call_retruco'
-        if 'call_vale_4' in valid_actions and random.random() < 0.1:
-            return 'call_vale_4'
+        # 3. Answer or call Truco/Retruco/Vale 4, by the equity of our hand
+        truco_calls = [a for a in self.TRUCO_THRESHOLDS if mask >> a & 1]
+        if mask >> TRUCO_QUIERO & 1 or truco_calls:
+            equity = self.truco_equity(game_state)
+            for call in truco_calls:
+                if equity >= self.TRUCO_THRESHOLDS[call] or self.rng.random() < 0.05:
+                    return ACTION_NAMES[call]
+            if mask >> TRUCO_QUIERO & 1:
+                if equity >= 0.45 or self.rng.random() < 0.1:
+                    return 'truco_quiero'
+                return 'truco_no_quiero'
 
         # 4. Play Card
-        card_actions = [a for a in valid_actions if a.startswith('play_card_')]
-        if card_actions:
+        if mask & PLAY_MASK:
             # Play highest card if we are losing the round or it's the first round
             # Just simple for now: play largest card
             best_idx = 0
             best_val = -1
             for i, c in enumerate(self.hand):
-                if c.get_truco_value() > best_val:
-                    best_val = c.get_truco_value()
+                val = TRUCO_VALUE[c.id]
+                if val > best_val:
+                    best_val = val
                     best_idx = i
             # Or mix it up
-            if random.random() < 0.2:
-                best_idx = random.randint(0, len(self.hand)-1)
+            if self.rng.random() < 0.2:
+                best_idx = self.rng.randint(0, len(self.hand)-1)
                 
             return f'play_card_{best_idx}'
             
         # Fallback random action
-        if valid_actions:
-            return random.choice(valid_actions)
+        if mask:
+            return ACTION_NAMES[self.rng.choice(MASK_ACTIONS[mask])]
         return None
+
+class CFRBot(HeuristicBot):
+    # Envido decisions sampled from the CFR+ equilibrium table (envido_cfr.py),
+    # everything else as HeuristicBot
+    def get_action(self, game_state):
+        mask = game_state.get('valid_mask', 0)
+        envido_mask = mask & (ENVIDO_ANSWER_MASK | ENVIDO_CALL_MASK)
+        if envido_mask:
+            info = game_state['info_set']
+            mano = (info[HAND_NUMBER] % 2 == 0) == (game_state['seat'] == 1)
+            falta = game_state['target_score'] - max(game_state['my_score'], game_state['opp_score'])
+            policy = envido_policy(mano, info[ENVIDO_HISTORY], game_state['my_envido'], falta)
+            if policy is not None:
+                actions, weights = zip(*policy)
+                action = self.rng.choices(actions, weights)[0]
+                if action != PASS:
+                    return action
+                # Passing: play on without opening the envido
+                mask &= ~envido_mask
+                game_state = dict(game_state, valid_mask=mask, valid_actions=mask_to_names(mask))
+        return super().get_action(game_state)
+
+class NeuralBot(Player):
+    # Plays from the NumPy policy net (neural.py). With an `inference` batcher the
+    # forward pass is shared with the other games asking at the same time; greedy
+    # picks the most likely action instead of sampling.
+    def __init__(self, name, rng=None, net=None, inference=None, greedy=False):
+        super().__init__(name, rng)
+        self.net = net
+        self.inference = inference
+        self.greedy = greedy
+
+    def get_action(self, game_state):
+        valid_mask = game_state.get('valid_mask', 0)
+        if not valid_mask:
+            return None
+        # Imported here so that only this bot needs numpy
+        from neural import encode_state, get_net, mask_array
+        x, mask = encode_state(game_state), mask_array(valid_mask)
+        if self.inference is not None:
+            probs = self.inference.predict(x, mask)
+        else:
+            probs = (self.net or get_net()).policy(x[None], mask[None])[0]
+        if self.greedy:
+            action = int(probs.argmax())
+        else:
+            action = self.rng.choices(range(len(probs)), probs)[0]
+        return ACTION_NAMES[action]
+
+
+class _Node:
+    # Search tree node. Edges are keyed by card id for card plays (so the same opponent
+    # card is the same edge across determinizations) and by NUM_CARDS + action id otherwise.
+    __slots__ = ('parent', 'seat', 'children', 'visits', 'reward', 'avail')
+
+    def __init__(self, parent, seat):
+        self.parent = parent
+        self.seat = seat # who moved into this node; rewards are from their point of view
+        self.children = {}
+        self.visits = 0
+        self.reward = 0.0
+        self.avail = 1
+
+def _moves(game):
+    # (edge key, action id) of every valid action
+    player = game.current_turn
+    hand = player.hand
+    return [(hand[action].id if action <= PLAY_CARD_2 else NUM_CARDS + action, action)
+            for action in MASK_ACTIONS[game.get_valid_mask(player)]]
+
+class _Determinizer:
+    # Produces full snapshots from an info set by filling in the opponent's hidden cards
+    # (and envido points), consistent with everything public so far. Calling it samples one.
+    def __init__(self, info_set, seat, rng):
+        my_hand, self.opp_hand = (HAND1, HAND2) if seat == 1 else (HAND2, HAND1)
+        self.opp_points = ENVIDO_POINTS2 if seat == 1 else ENVIDO_POINTS1
+        self.played = info_set[PLAYED2 if seat == 1 else PLAYED1]
+        self.num_hidden = len(info_set[self.opp_hand])
+        known = set(info_set[my_hand]) | set(info_set[PLAYED1]) | set(info_set[PLAYED2])
+        self.unknown = [i for i in range(NUM_CARDS) if i not in known]
+        self.rng = rng
+        self.snapshot = list(info_set)
+
+        self.candidates = None
+        if info_set[self.opp_points] >= 0 and self.num_hidden:
+            # An accepted envido revealed the opponent's points: only matching hands remain
+            revealed = info_set[self.opp_points]
+            self.candidates = [h for h in combinations(self.unknown, self.num_hidden)
+                               if envido_points_for_ids(*(self.played + h)) == revealed] or None
+
+    def all_hands(self):
+        if self.candidates is not None:
+            return list(self.candidates)
+        return list(combinations(self.unknown, self.num_hidden))
+
+    def fill(self, hand):
+        self.snapshot[self.opp_hand] = hand
+        self.snapshot[self.opp_points] = envido_points_for_ids(*(self.played + hand))
+        return tuple(self.snapshot)
+
+    def __call__(self):
+        if self.candidates is not None:
+            hand = self.candidates[self.rng.randrange(len(self.candidates))]
+        else:
+            hand = tuple(self.rng.sample(self.unknown, self.num_hidden))
+        return self.fill(hand)
+
+class ISMCTSBot(Player):
+    # Single-observer information set Monte Carlo tree search. Every iteration samples an
+    # opponent hand consistent with what this player has seen, then searches the
+    # determinized game to the end of the current hand. Anytime: it stops at the deadline.
+    # From the second trick on, the few remaining continuations are solved exactly instead.
+    def __init__(self, name, rng=None, time_budget_ms=150, max_iterations=None, exploration=0.7,
+                 endgame=True, endgame_solver=None, clock=time.perf_counter):
+        super().__init__(name, rng)
+        self.time_budget_ms = time_budget_ms
+        self.clock = clock
+        self.max_iterations = max_iterations
+        self.exploration = exploration
+        self.endgame_solver = None
+        if endgame:
+            self.endgame_solver = endgame_solver if endgame_solver is not None else EndgameSolver()
+        self.search_game = None
+        self.last_search = {}
+
+    def get_action(self, game_state):
+        valid_mask = game_state.get('valid_mask', 0)
+        actions = MASK_ACTIONS[valid_mask]
+        if len(actions) <= 1:
+            return ACTION_NAMES[actions[0]] if actions else None
+
+        start = self.clock()
+        deadline = start + self.time_budget_ms / 1000.0
+        game = self.get_search_game(game_state['target_score'])
+        determinize = self.determinizer(game_state['info_set'], game_state['seat'])
+        self.last_search = {"iterations": 0, "endgame": False}
+
+        # In the 2nd and 3rd trick the card to play is solved exactly. Calls and responses
+        # stay with the tree search: a perfect-information solver assumes the opponent
+        # can see our cards, so it would never expect a truco to be accepted.
+        plays = [a for a in actions if a <= PLAY_CARD_2]
+        endgame = bool(plays) and bool(game_state['info_set'][ROUND_WINNERS]) and self.endgame_solver is not None
+        if endgame and len(plays) < len(actions):
+            # Leave the solver half of the budget
+            action = self.tree_search(game, determinize, valid_mask, start, (start + deadline) / 2)
+            if action not in plays:
+                return ACTION_NAMES[action]
+        if endgame:
+            return ACTION_NAMES[self.solve_endgame(game, determinize, plays, start, deadline)]
+        return ACTION_NAMES[self.tree_search(game, determinize, valid_mask, start, deadline)]
+
+    def tree_search(self, game, determinize, valid_mask, start, deadline):
+        # Returns the action id to play
+        root = _Node(None, 0)
+        iterations = 0
+        while True:
+            self.iterate(game, root, determinize())
+            iterations += 1
+            if self.max_iterations is not None and iterations >= self.max_iterations:
+                break
+            if self.clock() >= deadline:
+                break
+
+        elapsed = self.clock() - start
+        self.last_search.update({
+            "iterations": iterations,
+            "elapsed_ms": elapsed * 1000.0,
+            "iterations_per_sec": iterations / elapsed if elapsed > 0 else 0.0,
+        })
+
+        # Most visited root move. Card indexes in the search game match the real hand.
+        game.restore(determinize())
+        best_action, best_visits = None, -1
+        for key, action in _moves(game):
+            child = root.children.get(key)
+            if child is not None and child.visits > best_visits and valid_mask >> action & 1:
+                best_action, best_visits = action, child.visits
+        return best_action if best_action is not None else self.rng.choice(MASK_ACTIONS[valid_mask])
+
+    def solve_endgame(self, game, determinize, plays, start, deadline):
+        # Perfect-information Monte Carlo: solve every consistent opponent hand exactly,
+        # in random order until the deadline, and play the best card on average.
+        hands = determinize.all_hands()
+        self.rng.shuffle(hands)
+        totals = dict.fromkeys(plays, 0.0)
+        solved = 0
+        for hand in hands:
+            game.restore(determinize.fill(hand))
+            values = self.endgame_solver.action_values(game)
+            for action in plays:
+                totals[action] += values[action]
+            solved += 1
+            if self.max_iterations is not None and solved >= self.max_iterations:
+                break
+            if self.clock() >= deadline:
+                break
+
+        elapsed = self.clock() - start
+        self.last_search.update({
+            "endgame": True,
+            "endgame_solved": solved,
+            "endgame_exhaustive": solved == len(hands),
+            "elapsed_ms": elapsed * 1000.0,
+        })
+        return max(plays, key=lambda action: totals[action])
+
+    def get_search_game(self, target_score):
+        if self.search_game is None or self.search_game.target_score != target_score:
+            self.search_game = TrucoGame(Player("p1"), Player("p2"), target_score, quiet=True,
+                                         seed=self.rng.getrandbits(64))
+        return self.search_game
+
+    def determinizer(self, info_set, seat):
+        return _Determinizer(info_set, seat, self.rng)
+
+    def iterate(self, game, root, determinization):
+        game.restore(determinization)
+        hand_number = determinization[HAND_NUMBER]
+        rng = self.rng
+        node = root
+
+        # Selection and expansion
+        while game.phase == GamePhase.PLAYING and game.hand_number == hand_number:
+            moves = _moves(game)
+            mover = 1 if game.current_turn is game.p1 else 2
+            children = node.children
+            untried = [m for m in moves if m[0] not in children]
+            if untried:
+                for key, _ in moves:
+                    if key in children:
+                        children[key].avail += 1
+                key, action = untried[rng.randrange(len(untried))]
+                node = children[key] = _Node(node, mover)
+                game.handle_action_id(game.current_turn, action)
+                break
+
+            best, best_action, best_score = None, None, -math.inf
+            for key, action in moves:
+                child = children[key]
+                child.avail += 1
+                score = child.reward / child.visits + self.exploration * math.sqrt(math.log(child.avail) / child.visits)
+                if score > best_score:
+                    best, best_action, best_score = child, action, score
+            game.handle_action_id(game.current_turn, best_action)
+            node = best
+
+        # Playout to the end of the hand
+        while game.phase == GamePhase.PLAYING and game.hand_number == hand_number:
+            player = game.current_turn
+            game.handle_action_id(player, self.playout_action(game, game.get_valid_mask(player)))
+
+        # Points won this hand, from seat 1's point of view
+        margin = ((game.p1_score - determinization[P1_SCORE]) - (game.p2_score - determinization[P2_SCORE])) / 4.0
+        while node is not None:
+            node.visits += 1
+            node.reward += margin if node.seat == 1 else -margin
+            node = node.parent
+
+    def playout_action(self, game, mask):
+        # Cheap rule-of-thumb playout policy: uniformly random calls and refusals
+        # make playouts too noisy to rank moves.
+        rng = self.rng
+        player = game.current_turn
+        if mask >> ENVIDO_QUIERO & 1:
+            points = game.envido_points_p1 if player is game.p1 else game.envido_points_p2
+            return ENVIDO_QUIERO if points >= 27 else ENVIDO_NO_QUIERO
+        if mask >> TRUCO_QUIERO & 1:
+            strength = sum(TRUCO_VALUE[c.id] for c in player.hand)
+            return TRUCO_QUIERO if strength >= 9 * len(player.hand) or rng.random() < 0.2 else TRUCO_NO_QUIERO
+        plays = mask & PLAY_MASK
+        if plays and rng.random() < 0.9:
+            actions = MASK_ACTIONS[plays]
+        else:
+            actions = MASK_ACTIONS[mask]
+        return actions[rng.randrange(len(actions))]
@@ -0,0 +1,240 @@
+import argparse
+import os
+import time
+from collections import namedtuple
+
+from actions import ENVIDO_QUIERO, ENVIDO_NO_QUIERO, TRUCO_QUIERO, TRUCO_NO_QUIERO, CALL_ACTIONS
+from card import CARDS
+from envido import calculate_envido_points
+from game import TrucoGame, GameEvent, GamePhase
+from player import Player
+
+# Append-only binary game records. A file is MAGIC and a version (u16, little-endian)
+# followed by records, each one a varint byte length and then, all varints:
+#
+#   target score, seed + 1 (0: the game had no seed), number of hands,
+#   the six card ids dealt in each hand (p1's three, then p2's), number of actions,
+#   the action ids in the order they were played, final p1 score, final p2 score
+#
+# Action ids are below 128, so every action and card takes one byte: a 10-hand game is
+# about 200 bytes. Records are decoded one at a time from a buffered stream, so files of
+# any size are read in constant memory. Replaying a record through TrucoGame reproduces
+# the game exactly; the final scores are checked against the ones recorded.
+
+MAGIC = b'TRUCOREC'
+VERSION = 1
+HEADER = MAGIC + VERSION.to_bytes(2, 'little')
+READ_SIZE = 1 << 20
+
+GameRecord = namedtuple('GameRecord', 'seed target_score hands actions scores')
+
+def _put_varint(out, value):
+    while value > 0x7f:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+
+def _get_varint(data, pos):
+    # (value, position after it); IndexError if data ends inside the varint
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+def encode(record):
+    body = bytearray()
+    _put_varint(body, record.target_score)
+    _put_varint(body, 0 if record.seed is None else record.seed + 1)
+    _put_varint(body, len(record.hands))
+    for hand in record.hands:
+        body.extend(hand)
+    _put_varint(body, len(record.actions))
+    body.extend(record.actions)
+    _put_varint(body, record.scores[0])
+    _put_varint(body, record.scores[1])
+    out = bytearray()
+    _put_varint(out, len(body))
+    return bytes(out + body)
+
+def decode(body):
+    target_score, pos = _get_varint(body, 0)
+    seed, pos = _get_varint(body, pos)
+    num_hands, pos = _get_varint(body, pos)
+    hands = tuple(tuple(body[pos + 6 * i:pos + 6 * i + 6]) for i in range(num_hands))
+    pos += 6 * num_hands
+    num_actions, pos = _get_varint(body, pos)
+    actions = bytes(body[pos:pos + num_actions])
+    pos += num_actions
+    p1_score, pos = _get_varint(body, pos)
+    p2_score, pos = _get_varint(body, pos)
+    if pos != len(body) or len(actions) != num_actions:
+        raise ValueError("Malformed game record")
+    return GameRecord(seed - 1 if seed else None, target_score, hands, actions, (p1_score, p2_score))
+
+class GameRecorder:
+    # Listens to a game from its start and builds its GameRecord. Card plays arrive as
+    # card ids and are stored as the hand slot they were played from, like the action.
+    _ANSWERS = {
+        GameEvent.ENVIDO_QUIERO: ENVIDO_QUIERO,
+        GameEvent.ENVIDO_NO_QUIERO: ENVIDO_NO_QUIERO,
+        GameEvent.TRUCO_QUIERO: TRUCO_QUIERO,
+        GameEvent.TRUCO_NO_QUIERO: TRUCO_NO_QUIERO,
+    }
+
+    def __init__(self, game):
+        self.game = game
+        self.hands = []
+        self.actions = bytearray()
+        # The first hand was dealt when the game was created
+        self._deal([c.id for c in game.p1.hand], [c.id for c in game.p2.hand])
+        game.subscribe(self.on_event)
+
+    def _deal(self, p1_cards, p2_cards):
+        self.hands.append(tuple(p1_cards) + tuple(p2_cards))
+        self.holding = {1: list(p1_cards), 2: list(p2_cards)}
+
+    def on_event(self, kind, payload):
+        if kind == GameEvent.DEAL:
+            self._deal(*payload)
+        elif kind == GameEvent.PLAY_CARD:
+            seat, card_id = payload
+            hand = self.holding[seat]
+            self.actions.append(hand.index(card_id))
+            hand.remove(card_id)
+        elif kind == GameEvent.CALL:
+            self.actions.append(CALL_ACTIONS[payload[1]])
+        elif kind in self._ANSWERS:
+            self.actions.append(self._ANSWERS[kind])
+
+    def record(self):
+        game = self.game
+        return GameRecord(game.seed, game.target_score, tuple(self.hands), bytes(self.actions),
+                          (game.p1_score, game.p2_score))
+
+class RecordWriter:
+    # Appends records to path, writing the header if the file is new
+    def __init__(self, path):
+        exists = os.path.exists(path) and os.path.getsize(path) > 0
+        if exists:
+            with open(path, 'rb') as f:
+                if f.read(len(HEADER)) != HEADER:
+                    raise ValueError(f"{path} is not a version {VERSION} game record file")
+        self.file = open(path, 'ab')
+        if not exists:
+            self.file.write(HEADER)
+        self.count = 0
+
+    def write(self, record):
+        # A GameRecord, or one already encoded
+        self.file.write(record if isinstance(record, bytes) else encode(record))
+        self.count += 1
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def read_records(path):
+    # Yields the GameRecords of path in order, reading it in READ_SIZE chunks
+    for body in read_bodies(path):
+        yield decode(body)
+
+def read_bodies(path):
+    # Yields the encoded records of path without their length prefix, for decode()
+    with open(path, 'rb') as f:
+        if f.read(len(HEADER)) != HEADER:
+            raise ValueError(f"{path} is not a version {VERSION} game record file")
+        data = b''
+        pos = 0
+        while True:
+            try:
+                length, start = _get_varint(data, pos)
+                end = start + length
+                if end > len(data):
+                    raise IndexError
+            except IndexError:
+                chunk = f.read(READ_SIZE)
+                if not chunk:
+                    if pos < len(data):
+                        raise ValueError(f"{path} ends with a truncated record")
+                    return
+                data = data[pos:] + chunk
+                pos = 0
+                continue
+            yield data[start:end]
+            pos = end
+
+def _deal(game, cards):
+    # Gives both players the recorded cards instead of the ones the deck dealt
+    game.p1.hand = [CARDS[i] for i in cards[:3]]
+    game.p2.hand = [CARDS[i] for i in cards[3:]]
+    game.envido_points_p1 = calculate_envido_points(game.p1.hand)
+    game.envido_points_p2 = calculate_envido_points(game.p2.hand)
+
+def replay(record, quiet=True):
+    # The finished TrucoGame of a record. Raises ValueError if the record does not
+    # replay: an illegal action, missing hands, or other final scores than recorded.
+    game = TrucoGame(Player("Jugador 1"), Player("Jugador 2"), target_score=record.target_score,
+                     quiet=quiet, seed=record.seed, log_size=None)
+    hands = iter(record.hands)
+    try:
+        _deal(game, next(hands))
+        for action in record.actions:
+            hand_number = game.hand_number
+            success, msg = game.handle_action_id(game.current_turn, action)
+            if not success:
+                raise ValueError(f"Record does not replay: {msg}")
+            if game.hand_number != hand_number and game.phase == GamePhase.PLAYING:
+                _deal(game, next(hands))
+    except StopIteration:
+        raise ValueError("Record has fewer hands than it plays") from None
+    if (game.p1_score, game.p2_score) != record.scores:
+        raise ValueError(f"Replay ends {game.p1_score}-{game.p2_score}, recorded {record.scores[0]}-{record.scores[1]}")
+    return game
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check and inspect game record files")
+    sub = parser.add_subparsers(dest='command', required=True)
+    verify = sub.add_parser('verify', help="replay every game and check its final score")
+    verify.add_argument('path')
+    show = sub.add_parser('show', help="replay one game and print its log")
+    show.add_argument('path')
+    show.add_argument('index', type=int)
+    args = parser.parse_args(argv)
+
+    if args.command == 'show':
+        games = 0
+        for record in read_records(args.path):
+            if games == args.index:
+                print("\n".join(replay(record, quiet=False).log))
+                return
+            games += 1
+        raise SystemExit(f"{args.path} has only {games} games")
+
+    start = time.perf_counter()
+    games = hands = actions = errors = 0
+    for i, record in enumerate(read_records(args.path)):
+        try:
+            replay(record)
+        except ValueError as e:
+            errors += 1
+            print(f"game {i}: {e}")
+        games += 1
+        hands += len(record.hands)
+        actions += len(record.actions)
+    elapsed = time.perf_counter() - start
+    print(f"{games} games, {hands} hands, {actions} actions replayed in {elapsed:.1f}s "
+          f"({games / elapsed:.0f} games/s), {errors} errors")
+    if errors:
+        raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
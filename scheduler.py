@@ -0,0 +1,90 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+class BotScheduler:
+    # Plays bot turns off the request threads. One timer thread keeps a heap of
+    # (due time, session) and hands due sessions to a pool of workers, so waiting out
+    # the delay costs no thread per game. A session is queued at most once at a time,
+    # which keeps each game's moves in order while different games run in parallel.
+    def __init__(self, workers=4, delay=0.0, clock=time.monotonic):
+        self.delay = delay
+        self.clock = clock
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix='bot')
+        self.heap = []
+        self.counter = itertools.count() # tie-breaker, sessions don't compare
+        self.pending = set() # ids of sessions queued or being played
+        self.cond = threading.Condition()
+        self.thread = None
+        self.stopped = False
+
+    def schedule(self, session):
+        # Called with session.lock held, after anything that may hand the turn to the bot
+        if not session.bot_to_move():
+            return
+        with self.cond:
+            if session.id in self.pending or self.stopped:
+                return
+            self.pending.add(session.id)
+            self._push(session)
+
+    def _push(self, session):
+        # Called with self.cond held
+        heapq.heappush(self.heap, (self.clock() + self.delay, next(self.counter), session))
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name='bot-timer', daemon=True)
+            self.thread.start()
+        self.cond.notify_all()
+
+    def _run(self):
+        with self.cond:
+            while not self.stopped:
+                if not self.heap:
+                    self.cond.wait()
+                    continue
+                due, _, session = self.heap[0]
+                wait = due - self.clock()
+                if wait > 0:
+                    self.cond.wait(wait)
+                    continue
+                heapq.heappop(self.heap)
+                self.executor.submit(self._play, session)
+
+    def _play(self, session):
+        with session.lock:
+            version = session.game.version
+        try:
+            session.play_bot_turn()
+        except Exception:
+            logger.exception("Bot move failed in game %s", session.id)
+        with session.lock:
+            # Again if it still has the turn after its move (it won the trick and leads
+            # the next one), or after the game changed while it was thinking. Without
+            # either, asking again would only fail again.
+            again = session.game.version != version and session.bot_to_move()
+            # Still under the session lock, so an action that hands the turn back to
+            # the bot cannot see this session as pending after its last move
+            with self.cond:
+                if again and not self.stopped:
+                    self._push(session)
+                else:
+                    self.pending.discard(session.id)
+                    self.cond.notify_all()
+
+    def wait_idle(self, timeout=None):
+        # Blocks until no bot move is queued or running. Returns False on timeout.
+        with self.cond:
+            return self.cond.wait_for(lambda: not self.pending, timeout)
+
+    def shutdown(self):
+        with self.cond:
+            self.stopped = True
+            self.heap = []
+            self.pending.clear()
+            self.cond.notify_all()
+        self.executor.shutdown(wait=True)
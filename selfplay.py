@@ -0,0 +1,232 @@
+import argparse
+import multiprocessing as mp
+import os
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from batch_env import OBS_SIZE, BatchTrucoEnv
+from neural import DEFAULT_PATH, PolicyNet, features
+
+# Self-play training of the policy net (neural.py). Actor processes play batches of games
+# with the current weights and write one fixed-size record per decision into a ring
+# buffer in shared memory; the learner samples minibatches from it and takes policy
+# gradient steps. Records are copied straight into the shared array, so nothing is
+# pickled between processes. New weights reach the actors through the weights file:
+# the learner saves it and bumps the generation in the buffer header, and actors reload
+# when they see a new generation.
+#
+# Actors play on BatchTrucoEnv, which follows TrucoGame's rules (it is tested against
+# TrucoGame move by move) at a few hundred thousand steps per second. The return of a
+# decision is the point margin of its hand for the player who took it, envido included.
+
+RECORD = np.dtype([
+    ('obs', np.int16, OBS_SIZE), # observation of the player to move
+    ('mask', np.uint16),         # valid actions, bitmask over action ids
+    ('action', np.uint8),
+    ('ret', np.float32),         # points won minus points lost in the hand
+])
+
+# Header: int64 counters in front of the records
+WRITTEN, GAMES, GENERATION, STOP = range(4)
+HEADER_SIZE = 4 * 8
+
+# Longest possible hand: six cards plus every envido and truco call and answer
+MAX_HAND_STEPS = 32
+RETURN_SCALE = 4.0
+
+class ReplayBuffer:
+    # Ring of the last `capacity` records in shared memory. Writers and readers take the
+    # lock only to copy their rows in or out.
+    def __init__(self, capacity, lock=None):
+        self.capacity = capacity
+        self.lock = lock or mp.Lock()
+        self.shm = shared_memory.SharedMemory(create=True, size=HEADER_SIZE + capacity * RECORD.itemsize)
+        self._map()
+        self.header[:] = 0
+
+    def _map(self):
+        self.header = np.ndarray(4, dtype=np.int64, buffer=self.shm.buf)
+        self.records = np.ndarray(self.capacity, dtype=RECORD, buffer=self.shm.buf, offset=HEADER_SIZE)
+
+    def __getstate__(self):
+        # Only needed where processes are spawned rather than forked: attach by name
+        return self.capacity, self.lock, self.shm.name
+
+    def __setstate__(self, state):
+        self.capacity, self.lock, name = state
+        self.shm = shared_memory.SharedMemory(name=name)
+        self._map()
+
+    def write(self, records, games=0):
+        records = records[-self.capacity:]
+        with self.lock:
+            start = self.header[WRITTEN]
+            self.records[(start + np.arange(len(records))) % self.capacity] = records
+            self.header[WRITTEN] += len(records)
+            self.header[GAMES] += games
+
+    def sample(self, size, rng):
+        with self.lock:
+            filled = min(self.header[WRITTEN], self.capacity)
+            if filled == 0:
+                return self.records[:0].copy()
+            return self.records[rng.integers(filled, size=size)]
+
+    def __len__(self):
+        return int(min(self.header[WRITTEN], self.capacity))
+
+    def close(self, unlink=False):
+        # The arrays point into the mapping and have to go before it is closed
+        del self.header, self.records
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+def sample_actions(probs, rng):
+    # One action per row, drawn from each row's probabilities
+    cumulative = probs.cumsum(axis=1)
+    u = rng.random(len(probs)) * cumulative[:, -1]
+    return (cumulative > u[:, None]).argmax(axis=1)
+
+def actor(buffer, weights_path, num_envs, target_score, seed):
+    env = BatchTrucoEnv(num_envs, target_score=target_score, seed=seed)
+    rng = np.random.default_rng(seed)
+    obs, masks = env.reset()
+    generation, net = None, None
+    # Decisions of each game's current hand, written out when the hand ends
+    steps = np.zeros((num_envs, MAX_HAND_STEPS), dtype=RECORD)
+    seats = np.zeros((num_envs, MAX_HAND_STEPS), dtype=np.int64)
+    length = np.zeros(num_envs, dtype=np.int64)
+    points = np.zeros((num_envs, 2), dtype=np.int64)
+    index = np.arange(num_envs)
+
+    while not buffer.header[STOP]:
+        if buffer.header[GENERATION] != generation:
+            generation = buffer.header[GENERATION]
+            net = PolicyNet.load(weights_path)
+        actions = sample_actions(net.policy(features(obs), masks), rng)
+        row = steps[index, length]
+        row['obs'] = obs
+        row['mask'] = env.legal_bits()
+        row['action'] = actions
+        steps[index, length] = row
+        seats[index, length] = env.current
+        length += 1
+        hand_number = env.hand_number.copy()
+        obs, masks, rewards, dones = env.step(actions)
+        points += rewards
+
+        ended = np.nonzero(dones | (env.hand_number != hand_number))[0]
+        if len(ended):
+            counts = length[ended]
+            games = np.repeat(ended, counts)
+            moves = np.arange(counts.sum()) - np.repeat(counts.cumsum() - counts, counts)
+            records = steps[games, moves]
+            seat = seats[games, moves]
+            records['ret'] = points[games, seat] - points[games, 1 - seat]
+            buffer.write(records, games=int(dones.sum()))
+            length[ended] = 0
+            points[ended] = 0
+    buffer.close()
+
+class Adam:
+    def __init__(self, net, lr=1e-3, beta1=0.9, beta2=0.999, eps=1e-8):
+        self.lr, self.beta1, self.beta2, self.eps = lr, beta1, beta2, eps
+        params = net.weights + net.biases
+        self.m = [np.zeros_like(p) for p in params]
+        self.v = [np.zeros_like(p) for p in params]
+        self.t = 0
+
+    def step(self, net, grad_w, grad_b):
+        self.t += 1
+        correction = np.sqrt(1 - self.beta2 ** self.t) / (1 - self.beta1 ** self.t)
+        for p, g, m, v in zip(net.weights + net.biases, grad_w + grad_b, self.m, self.v):
+            m *= self.beta1
+            m += (1 - self.beta1) * g
+            v *= self.beta2
+            v += (1 - self.beta2) * g * g
+            p -= (self.lr * correction * m / (np.sqrt(v) + self.eps)).astype(p.dtype)
+
+def learn_step(net, optimizer, batch):
+    x = features(batch['obs'])
+    masks = (batch['mask'][:, None].astype(np.int64) >> np.arange(net.weights[-1].shape[1])) & 1 == 1
+    advantages = batch['ret'] / RETURN_SCALE
+    advantages -= advantages.mean()
+    grad_w, grad_b = net.gradients(x, masks, batch['action'].astype(np.int64), advantages)
+    optimizer.step(net, grad_w, grad_b)
+
+def train(seconds=60, actors=None, envs=256, capacity=500000, batch_size=1024, lr=1e-3,
+          publish_every=20, target_score=30, seed=0, output=DEFAULT_PATH, resume=False,
+          report_every=1.0, report=print):
+    # Runs actors and the learner for `seconds` and saves the final weights to output.
+    # Returns the totals: games, transitions, learner updates and final generation.
+    net = PolicyNet.load(output) if resume and os.path.exists(output) else PolicyNet.initialize(seed)
+    net.save(output)
+    optimizer = Adam(net, lr)
+    buffer = ReplayBuffer(capacity)
+    buffer.header[GENERATION] = net.generation
+    actors = actors or max(1, (os.cpu_count() or 2) - 1)
+    processes = [mp.Process(target=actor, args=(buffer, output, envs, target_score, seed * 1000 + i + 1),
+                            daemon=True)
+                 for i in range(actors)]
+    for p in processes:
+        p.start()
+
+    rng = np.random.default_rng(seed)
+    start = last_report = time.perf_counter()
+    last_games = last_written = updates = last_updates = 0
+    try:
+        while time.perf_counter() - start < seconds:
+            if len(buffer) < batch_size:
+                time.sleep(0.01)
+            else:
+                learn_step(net, optimizer, buffer.sample(batch_size, rng))
+                updates += 1
+                if updates % publish_every == 0:
+                    net.generation += 1
+                    net.save(output)
+                    buffer.header[GENERATION] = net.generation
+            now = time.perf_counter()
+            if now - last_report >= report_every:
+                games, written = int(buffer.header[GAMES]), int(buffer.header[WRITTEN])
+                elapsed = now - last_report
+                report(f"{now - start:6.1f}s  {(games - last_games) / elapsed:7.0f} games/s  "
+                       f"{(written - last_written) / elapsed:8.0f} transitions/s  "
+                       f"buffer {len(buffer) / capacity:4.0%}  "
+                       f"{(updates - last_updates) / elapsed:5.1f} updates/s  generation {net.generation}")
+                last_report, last_games, last_written, last_updates = now, games, written, updates
+    finally:
+        buffer.header[STOP] = 1
+        for p in processes:
+            p.join()
+        totals = {"games": int(buffer.header[GAMES]), "transitions": int(buffer.header[WRITTEN]),
+                  "updates": updates, "generation": net.generation}
+        buffer.close(unlink=True)
+    net.save(output)
+    return totals
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Train the policy net by self-play")
+    parser.add_argument('-s', '--seconds', type=float, default=60)
+    parser.add_argument('--actors', type=int, default=None, help="actor processes (default: cores - 1)")
+    parser.add_argument('--envs', type=int, default=256, help="games each actor plays at once")
+    parser.add_argument('--capacity', type=int, default=500000, help="replay buffer size in decisions")
+    parser.add_argument('--batch-size', type=int, default=1024)
+    parser.add_argument('--lr', type=float, default=1e-3)
+    parser.add_argument('--publish-every', type=int, default=20, metavar='UPDATES',
+                        help="learner updates between weight pushes to the actors")
+    parser.add_argument('--target-score', type=int, default=30)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--resume', action='store_true', help="continue from the weights in --output")
+    parser.add_argument('-o', '--output', default=DEFAULT_PATH)
+    args = parser.parse_args(argv)
+
+    totals = train(args.seconds, args.actors, args.envs, args.capacity, args.batch_size, args.lr,
+                   args.publish_every, args.target_score, args.seed, args.output, args.resume)
+    print(f"Wrote {args.output}: generation {totals['generation']}, {totals['updates']} updates "
+          f"on {totals['transitions']} transitions from {totals['games']} games")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,275 @@
+import json
+import logging
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from actions import ACTION_IDS
+from game import GamePhase
+
+logger = logging.getLogger(__name__)
+
+# Views kept per session to answer `since` requests with a delta
+VIEW_HISTORY = 16
+# Seconds between sweeps of the store for games idle longer than the ttl
+PURGE_EVERY = 600
+
+class GameMoved(Exception):
+    # The game id belongs to another shard (shard.py)
+    pass
+
+class GameSession:
+    # A live match and the lock that serializes every request touching it
+    def __init__(self, game_id, game, store=None, actions=0):
+        self.id = game_id
+        self.game = game
+        # Accepted actions go to the store (store.py), numbered from 1
+        self.store = store
+        self.actions = actions
+        self.lock = threading.Lock()
+        self.last_used = 0.0
+        # Streams wait on `changed` for the next game version
+        self.changed = threading.Condition(self.lock)
+        # Recently sent views of the player's state: version -> (fields, events logged),
+        # and the same for spectators
+        self.views = OrderedDict()
+        self.spectator_views = OrderedDict()
+        # Encoded views of the current version, by (spectator, since, text)
+        self.encoded_views = {}
+        self.encoded_version = None
+        # Set once the game has moved to another shard: whoever still holds the session
+        # must not touch it, the new owner replays it from the store
+        self.released = False
+
+    def notify(self):
+        # Called with self.lock held, after the game changed
+        self.changed.notify_all()
+
+    def act(self, player, action):
+        # Called with self.lock held. handle_action, recording the action if accepted.
+        game = self.game
+        success, msg = game.handle_action(player, action)
+        if success:
+            self.actions += 1
+            if self.store is not None:
+                action_id = action if action.__class__ is int else ACTION_IDS[action]
+                self.store.append(self.id, self.actions, game.seat_of(player), action_id, game)
+        return success, msg
+
+    def bot_to_move(self):
+        # The bot (p2) plays whenever it has the turn, including answering a call
+        game = self.game
+        return not self.released and game.phase == GamePhase.PLAYING and game.current_turn is game.p2
+
+    def play_bot_turn(self):
+        # Called without self.lock. Plays the bot's move if it is its turn and returns the
+        # action, or None. The bot thinks with the lock released, so the game's requests
+        # and streams are served meanwhile; its move is applied only if the game is still
+        # at the version it thought about.
+        with self.lock:
+            if not self.bot_to_move():
+                return None
+            game = self.game
+            version = game.version
+            state = game.get_state_for_player(game.p2)
+        action = game.p2.get_action(state)
+        with self.lock:
+            if game.version != version or not self.bot_to_move():
+                return None
+            success, msg = self.act(game.p2, action) if action else (False, "No action")
+            if not success:
+                # A bot out of step with the rules would be asked again forever: the game
+                # goes on with a legal move instead
+                logger.warning("Bot move %r rejected in game %s (%s), playing a legal one", action, self.id, msg)
+                action = game.get_valid_actions(game.p2)[0]
+                success, msg = self.act(game.p2, action)
+            if success:
+                self.notify()
+                return action
+            return None
+
+    def view(self, since=None, spectator=False, text=False):
+        # Called with self.lock held. The player's state at the current version, or the
+        # spectators' one, with the game's events as `events` ([code, *payload] lists)
+        # numbered from `event_start`, and their narration as `text` if asked for. A
+        # client that already has version `since` only gets the fields that changed after
+        # it and the events that came after; otherwise the whole state, with every event
+        # still in the log.
+        game = self.game
+        state = game.get_spectator_state() if spectator else game.get_state_for_player(game.p1)
+        views = self.spectator_views if spectator else self.views
+        events = state.pop('events')
+        # The search bots' encoding of the position, no use to a client
+        state.pop('info_set', None)
+        # Copy the lists the game keeps mutating, so stored views stay as they were sent
+        state = {k: list(v) if isinstance(v, list) else v for k, v in state.items()}
+        if game.version not in views:
+            views[game.version] = (state, events.total)
+            if len(views) > VIEW_HISTORY:
+                views.popitem(last=False)
+
+        previous = views.get(since)
+        if previous is None or previous[1] < events.start:
+            # New client, or it would miss events that already left the log
+            view, event_start = dict(state), events.start
+        else:
+            fields, event_start = previous
+            view = {k: v for k, v in state.items() if fields.get(k) != v}
+            view.update(version=game.version, since=since)
+        view.update(events=events.public(event_start), event_start=event_start)
+        if text:
+            view['text'] = events.texts(event_start)
+        return view
+
+    def encoded(self, since=None, spectator=False, text=False):
+        # Called with self.lock held. view() as JSON bytes. Views only change with the
+        # game's version, so each one is encoded once per version and every viewer
+        # asking for it with the same `since` (all spectators following along) gets the
+        # same bytes.
+        version = self.game.version
+        if self.encoded_version != version:
+            self.encoded_views.clear()
+            self.encoded_version = version
+        if since not in (self.spectator_views if spectator else self.views):
+            since = None
+        key = (spectator, since, text)
+        body = self.encoded_views.get(key)
+        if body is None:
+            body = json.dumps(self.view(since, spectator, text), separators=(',', ':')).encode()
+            self.encoded_views[key] = body
+        return body
+
+class GameRegistry:
+    # Live games by id, in least-recently-used order. Games idle for longer than ttl
+    # seconds are dropped, and once max_games are live, creating a game evicts the least
+    # recently used one, so memory stays bounded however many clients come and go.
+    # With a store, games evicted to make room are only dropped from memory: an id that is
+    # not live is looked up in the store and rehydrated, then passed to on_load. Expired
+    # and removed games, and finished ones once dropped, are deleted from the store too.
+    # A shard worker serves only the ids that owns(game_id) accepts (see reassign).
+    def __init__(self, max_games=10000, ttl=3600, clock=time.monotonic, store=None, on_load=None):
+        self.max_games = max_games
+        self.ttl = ttl
+        self.clock = clock
+        self.store = store
+        self.on_load = on_load
+        self.owns = None
+        self.sessions = OrderedDict()
+        self.loading = {} # game id -> Event set once it has been read from the store
+        self.lock = threading.Lock()
+        self.evicted = 0
+        self.loaded = 0
+        self.purged = None # when the store was last swept
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def create(self, game, game_id=None):
+        # Raises GameMoved for an id another shard owns: the router may have picked it
+        # under the ring from before a rebalance
+        with self.lock:
+            if self.owns is not None and game_id and not self.owns(game_id):
+                raise GameMoved(game_id)
+            now = self.clock()
+            self._evict_expired(now)
+            if self.store is not None and (self.purged is None or now - self.purged >= PURGE_EVERY):
+                self.purged = now
+                self.store.purge(self.ttl)
+            session = self._add(GameSession(game_id or secrets.token_urlsafe(12), game, self.store), now)
+            if self.store is not None:
+                self.store.create(session.id, game)
+            return session
+
+    def _add(self, session, now):
+        # Called with self.lock held
+        while len(self.sessions) >= self.max_games:
+            self._drop(self.sessions.popitem(last=False)[1], expired=False)
+        session.last_used = now
+        self.sessions[session.id] = session
+        return session
+
+    def get(self, game_id):
+        # The session, or None if the id is unknown or the game expired. Raises GameMoved
+        # for an id another shard owns.
+        with self.lock:
+            if self.owns is not None and game_id and not self.owns(game_id):
+                raise GameMoved(game_id)
+            session = self.sessions.get(game_id)
+            now = self.clock()
+            if session is not None and now - session.last_used > self.ttl:
+                self._drop(self.sessions.pop(game_id), expired=True)
+                session = None
+            if session is not None:
+                session.last_used = now
+                self.sessions.move_to_end(game_id)
+                return session
+            if self.store is None or not game_id:
+                return None
+            # Loading waits for the disk: it happens outside the lock, once per id, and
+            # concurrent requests for the same id wait for that load
+            loading = self.loading.get(game_id)
+            if loading is None:
+                loading = self.loading[game_id] = threading.Event()
+                waiting = False
+            else:
+                waiting = True
+        if waiting:
+            loading.wait()
+            return self.get(game_id)
+        session = None
+        try:
+            loaded = self.store.load(game_id)
+            if loaded is not None:
+                game, actions = loaded
+                with self.lock:
+                    # The ring may have changed meanwhile
+                    if self.owns is not None and not self.owns(game_id):
+                        raise GameMoved(game_id)
+                    session = self._add(GameSession(game_id, game, self.store, actions), self.clock())
+                    self.loaded += 1
+        finally:
+            with self.lock:
+                del self.loading[game_id]
+            loading.set()
+        if session is not None and self.on_load is not None:
+            self.on_load(session)
+        return session
+
+    def reassign(self, owns):
+        # Keeps serving only the ids owns(game_id) accepts. Live games it rejects are
+        # dropped and released, and the store flushed, so that the shard that owns them
+        # now loads them with every action. Returns how many games were let go.
+        with self.lock:
+            self.owns = owns
+            moved = [self.sessions.pop(game_id) for game_id in list(self.sessions) if not owns(game_id)]
+        for session in moved:
+            # Waits for a request or bot move already inside the game
+            with session.lock:
+                session.released = True
+                session.notify()
+        if self.store is not None:
+            self.store.flush()
+        return len(moved)
+
+    def remove(self, game_id):
+        with self.lock:
+            session = self.sessions.pop(game_id, None)
+        if self.store is not None:
+            self.store.delete(game_id)
+        return session
+
+    def _drop(self, session, expired):
+        # Called with self.lock held, for a session evicted from memory. Only the games
+        # that can still be played and were used within the ttl stay in the store.
+        self.evicted += 1
+        if self.store is not None and (expired or session.game.phase == GamePhase.GAME_OVER):
+            self.store.delete(session.id)
+
+    def _evict_expired(self, now):
+        # Called with self.lock held. The oldest entries come first, so stop at the first live one.
+        while self.sessions:
+            session = next(iter(self.sessions.values()))
+            if now - session.last_used <= self.ttl:
+                break
+            self._drop(self.sessions.popitem(last=False)[1], expired=True)
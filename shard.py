@@ -0,0 +1,289 @@
+import argparse
+import bisect
+import hashlib
+import http.client
+import itertools
+import json
+import logging
+import multiprocessing as mp
+import os
+import re
+import secrets
+import signal
+import socket
+import threading
+import time
+
+from werkzeug.http import parse_cookie
+from werkzeug.serving import make_server
+
+# Multi-process deployment of app.py. One process per core is a worker running the whole
+# app on a local port, and each game lives in exactly one worker: the one a consistent
+# hash ring picks for its id. A router in front reads the game id of every request (from
+# /api/games/<id>/... or the game_id cookie) and forwards it to that worker, so no game
+# state is shared or locked between processes and bot moves run on every core.
+#
+# The router picks the id of each new game, so it always knows where a game is. Workers
+# write every action to the shared SQLite store (store.py). Adding a worker changes the
+# ring: the old workers flush and let go of the games that now hash elsewhere, and the
+# new owner replays each one from the store on its first request. Consistent hashing
+# moves only about 1/N of the games when going to N workers.
+#
+# A worker asked for a game it no longer owns answers 421; the router waits for the
+# rebalance to finish and sends the request again to the owner.
+
+REPLICAS = 64 # points per shard on the ring, evens out the share of each one
+GAME_PATH = re.compile(r'/api/games/([^/]+)/')
+# Not forwarded: they describe one connection, not the request
+HOP_HEADERS = {'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization', 'te',
+               'trailers', 'transfer-encoding', 'upgrade'}
+READ_SIZE = 1 << 16
+
+logger = logging.getLogger(__name__)
+
+def _hash(key):
+    # Stable across processes, unlike hash() of a str
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big')
+
+class HashRing:
+    # Consistent hashing of game ids over shard names: every shard has REPLICAS points on
+    # a ring of 64-bit hashes, and a key belongs to the first point at or after its hash
+    def __init__(self, shards, replicas=REPLICAS):
+        self.shards = tuple(shards)
+        points = sorted((_hash(f"{shard}#{i}"), shard) for shard in self.shards for i in range(replicas))
+        self.hashes = [h for h, _ in points]
+        self.owners = [shard for _, shard in points]
+
+    def owner(self, key):
+        i = bisect.bisect_left(self.hashes, _hash(key))
+        return self.owners[i % len(self.owners)]
+
+class Router:
+    # WSGI app forwarding each request to the worker that owns its game. workers maps
+    # shard names to (host, port). Requests without a game (static files) go round robin.
+    def __init__(self, workers):
+        self.workers = dict(workers)
+        self.ring = HashRing(self.workers)
+        self.idle = {name: [] for name in self.workers} # kept-alive connections per worker
+        self.lock = threading.Lock()
+        self.rebalancing = threading.Lock()
+        self.counter = itertools.count()
+        self.forwarded = 0
+        self.retried = 0
+
+    def add_worker(self, name, address):
+        # Makes a started worker part of the ring. Returns how many live games the other
+        # workers let go; they are loaded by their new owners when next requested.
+        with self.rebalancing:
+            shards = list(self.workers) + [name]
+            released = 0
+            for worker in self.workers:
+                status, body = self._call(worker, 'POST', '/api/shard/ring',
+                                          {'shards': shards})
+                if status != 200:
+                    raise RuntimeError(f"Worker {worker} refused the new ring: {body}")
+                released += body['released']
+            with self.lock:
+                self.workers[name] = address
+                self.idle[name] = []
+                self.ring = HashRing(shards)
+        logger.info("Worker %s added, %d games moved", name, released)
+        return released
+
+    def _call(self, name, method, path, data):
+        # A JSON request to one worker, outside the pool
+        conn = http.client.HTTPConnection(*self.workers[name], timeout=60)
+        try:
+            conn.request(method, path, json.dumps(data), {'Content-Type': 'application/json'})
+            response = conn.getresponse()
+            return response.status, json.loads(response.read())
+        finally:
+            conn.close()
+
+    def _connection(self, name):
+        with self.lock:
+            idle = self.idle[name]
+            if idle:
+                return idle.pop(), True
+        return http.client.HTTPConnection(*self.workers[name]), False
+
+    def _keep(self, name, conn):
+        with self.lock:
+            self.idle[name].append(conn)
+
+    def _send(self, name, method, target, body, headers):
+        conn, pooled = self._connection(name)
+        try:
+            conn.request(method, target, body, headers)
+            return conn, conn.getresponse()
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            conn.close()
+            if not pooled:
+                raise
+        # The worker had closed the kept-alive connection before reading the request
+        conn = http.client.HTTPConnection(*self.workers[name])
+        conn.request(method, target, body, headers)
+        return conn, conn.getresponse()
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        if path.startswith('/api/shard/'):
+            start_response('404 Not Found', [('Content-Type', 'text/plain')])
+            return [b'Not Found']
+        method = environ['REQUEST_METHOD']
+        target = environ.get('RAW_URI') or path
+        if '?' not in target and environ.get('QUERY_STRING'):
+            target += '?' + environ['QUERY_STRING']
+        length = int(environ.get('CONTENT_LENGTH') or 0)
+        body = environ['wsgi.input'].read(length) if length else None
+        headers = {key[5:].replace('_', '-').title(): value for key, value in environ.items()
+                   if key.startswith('HTTP_') and key[5:].replace('_', '-').lower() not in HOP_HEADERS}
+        if environ.get('CONTENT_TYPE'):
+            headers['Content-Type'] = environ['CONTENT_TYPE']
+        if body is not None:
+            headers['Content-Length'] = str(len(body))
+        # Only the router names games
+        headers.pop('X-Truco-Game-Id', None)
+        if method == 'POST' and path == '/api/start':
+            game_id = secrets.token_urlsafe(12)
+            headers['X-Truco-Game-Id'] = game_id
+        else:
+            match = GAME_PATH.match(path)
+            game_id = match.group(1) if match else parse_cookie(environ).get('game_id')
+
+        for attempt in range(2):
+            with self.lock:
+                names = list(self.workers)
+                name = self.ring.owner(game_id) if game_id else names[next(self.counter) % len(names)]
+            try:
+                conn, response = self._send(name, method, target, body, headers)
+            except OSError as e:
+                logger.error("Worker %s unreachable: %s", name, e)
+                start_response('502 Bad Gateway', [('Content-Type', 'text/plain')])
+                return [b'Bad Gateway']
+            if response.status != 421 or attempt:
+                break
+            # Sent before a rebalance took effect: once it is over, the ring has the owner
+            response.read()
+            self._keep(name, conn)
+            self.retried += 1
+            with self.rebalancing:
+                pass
+        self.forwarded += 1
+
+        start_response(f"{response.status} {response.reason}",
+                       [(key, value) for key, value in response.getheaders() if key.lower() not in HOP_HEADERS])
+        return self._relay(name, conn, response)
+
+    def _relay(self, name, conn, response):
+        # The worker's body as it arrives, so event streams stay live
+        done = False
+        try:
+            while True:
+                chunk = response.read1(READ_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+            done = True
+        finally:
+            if done and not response.will_close:
+                self._keep(name, conn)
+            else:
+                conn.close()
+
+def worker(name, shards, port, host='127.0.0.1'):
+    # Runs in its own process: the app, as shard `name` of `shards`
+    os.environ['TRUCO_SHARD'] = name
+    os.environ['TRUCO_SHARDS'] = ','.join(shards)
+    # Request lines of every worker would interleave on the terminal
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    import app
+    server = make_server(host, port, app.app, threaded=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Actions still queued are committed before the process ends
+        if app.store is not None:
+            app.store.close()
+
+def _wait_listening(address, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection(address, timeout=1).close()
+            return
+        except OSError:
+            if not process.is_alive():
+                raise RuntimeError(f"Worker {process.name} exited with code {process.exitcode}")
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"Worker {process.name} is not listening on port {address[1]}")
+            time.sleep(0.05)
+
+class Cluster:
+    # Worker processes on worker_port, worker_port + 1, ... of 127.0.0.1, and the router
+    # that clients talk to. Workers are started fresh (spawn) so none inherits the
+    # router's threads or connections.
+    def __init__(self, workers=None, worker_port=5001):
+        self.worker_port = worker_port
+        self.context = mp.get_context('spawn')
+        self.processes = {}
+        names = [f"w{i}" for i in range(workers or os.cpu_count() or 1)]
+        self.router = Router({name: self._start(name, names) for name in names})
+
+    def _start(self, name, shards):
+        port = self.worker_port + len(self.processes)
+        process = self.context.Process(target=worker, args=(name, shards, port), name=f"truco-{name}",
+                                       daemon=True)
+        process.start()
+        self.processes[name] = process
+        _wait_listening(('127.0.0.1', port), process)
+        return '127.0.0.1', port
+
+    def add_worker(self):
+        # Starts one more worker and rebalances onto it. Returns how many games moved.
+        name = f"w{len(self.processes)}"
+        address = self._start(name, list(self.router.workers) + [name])
+        return self.router.add_worker(name, address)
+
+    def serve(self, host='127.0.0.1', port=5000):
+        # Serves the router until interrupted. SIGHUP adds a worker.
+        server = make_server(host, port, self.router, threaded=True)
+        def on_hangup(signum, frame):
+            threading.Thread(target=self.add_worker, name='rebalance', daemon=True).start()
+        signal.signal(signal.SIGHUP, on_hangup)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+    def shutdown(self):
+        for process in self.processes.values():
+            process.terminate()
+        for process in self.processes.values():
+            process.join()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the game from several worker processes")
+    parser.add_argument('-w', '--workers', type=int, default=None, help="worker processes (default: cores)")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--worker-port', type=int, default=5001, help="first port of the workers, on 127.0.0.1")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    cluster = Cluster(args.workers, args.worker_port)
+    print(f"Serving on http://{args.host}:{args.port} with {len(cluster.processes)} workers "
+          f"(kill -HUP {os.getpid()} adds one)")
+    try:
+        cluster.serve(args.host, args.port)
+    finally:
+        cluster.shutdown()
+
+if __name__ == '__main__':
+    main()
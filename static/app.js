@@ -1,34 +1,122 @@
 let gameState = null;
-let lastLogLength = 0;
+// Each tab addresses its own game by id, so several tabs can play at once
+let gameId = null;
+// Server-Sent Events stream of state changes; null while polling instead
+let stateStream = null;
+// Number of the first game event not shown yet (speech bubbles)
+let lastEvent = 0;
+
+// Event codes of game.py (EVENT_CODES). Events arrive as [code, ...payload] in
+// `events`, numbered from `event_start`, with their narration in `text`.
+const EVENT = {
+    ROUND_START: 0, DEAL: 1, ENVIDO_QUIERO: 2, ENVIDO_NO_QUIERO: 3, TRUCO_QUIERO: 4,
+    TRUCO_NO_QUIERO: 5, CALL: 6, PLAY_CARD: 7, ENVIDO_POINTS: 8, ENVIDO_WON: 9,
+    ENVIDO_REJECTED: 10, TRICK: 11, HAND_WON: 12, GAME_OVER: 13,
+};
+// Said out loud by the seat in payload[0]: shown in a speech bubble
+const SPOKEN = new Set([EVENT.CALL, EVENT.ENVIDO_QUIERO, EVENT.ENVIDO_NO_QUIERO,
+    EVENT.TRUCO_QUIERO, EVENT.TRUCO_NO_QUIERO]);
+// Whose event it is: payload[0] is a seat for these (for TRICK the winner, 0 for parda)
+const SEATED = new Set([...SPOKEN, EVENT.PLAY_CARD, EVENT.ENVIDO_WON, EVENT.ENVIDO_REJECTED,
+    EVENT.TRICK, EVENT.HAND_WON, EVENT.GAME_OVER]);
+// Someone won something: highlighted in the log and listed in the round summary
+const RESULTS = new Set([EVENT.TRICK, EVENT.ENVIDO_WON, EVENT.ENVIDO_REJECTED, EVENT.HAND_WON]);
+// Events kept for the log panel
+const MAX_EVENTS = 256;
 let lastPhase = null;
 
 async function startGame(targetScore = 30) {
     try {
-        await fetch('/api/start', {
+        const res = await fetch('/api/start', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({ target_score: targetScore })
         });
+        gameId = (await res.json()).game_id;
+        gameState = null;
         document.getElementById('start-menu-overlay').classList.add('hidden');
         document.getElementById('game-over-overlay').classList.add('hidden');
         document.getElementById('game-over-overlay').classList.remove('boo-effect');
-        lastLogLength = 0;
+        lastEvent = 0;
         lastPhase = null;
-        pollState();
+        openStream();
     } catch (e) {
         console.error("Failed to start", e);
     }
 }
 
+function openStream() {
+    closeStream();
+    if (!window.EventSource) {
+        pollState();
+        return;
+    }
+    stateStream = new EventSource(`/api/games/${gameId}/stream?text=1`);
+    stateStream.onmessage = (event) => {
+        if (!applyUpdate(JSON.parse(event.data))) return;
+        if (gameState.phase === 'game_over') closeStream();
+        render();
+    };
+    stateStream.onerror = () => {
+        // Stream unavailable or dropped: fall back to polling
+        closeStream();
+        pollState();
+    };
+}
+
+function closeStream() {
+    if (stateStream) {
+        stateStream.close();
+        stateStream = null;
+    }
+}
+
+// Updates after the first one only carry what changed since the version we have
+// (`since`) and the events from `event_start` on. Returns false if the update
+// was not applied.
+function applyUpdate(update) {
+    if (update.since !== undefined) {
+        if (!gameState || update.since !== gameState.version) {
+            // Built on a version we don't have: get the whole state again
+            if (!gameState || update.version > gameState.version) {
+                gameState = null;
+                pollState();
+            }
+            return false;
+        }
+        const kept = update.event_start - gameState.event_start;
+        update = Object.assign({}, gameState, update, {
+            event_start: gameState.event_start,
+            events: gameState.events.slice(0, kept).concat(update.events),
+            text: gameState.text.slice(0, kept).concat(update.text),
+        });
+    }
+    const extra = update.events.length - MAX_EVENTS;
+    if (extra > 0) {
+        update = Object.assign({}, update, {
+            event_start: update.event_start + extra,
+            events: update.events.slice(extra),
+            text: update.text.slice(extra),
+        });
+    }
+    gameState = update;
+    return true;
+}
+
 async function pollState() {
     try {
-        const response = await fetch('/api/state');
-        if (response.ok) {
-            gameState = await response.json();
+        const since = gameState ? `&since=${gameState.version}` : '';
+        const response = await fetch(`/api/games/${gameId}/state?text=1${since}`);
+        if (response.status === 304) {
+            if (!stateStream && gameState.phase === 'playing' && !gameState.is_turn) {
+                setTimeout(pollState, 1000);
+            }
+        } else if (response.ok) {
+            if (!applyUpdate(await response.json())) return;
             render();
 
             // If it's not my turn and game is playing, poll again quickly
-            if (gameState.phase === 'playing' && !gameState.is_turn) {
+            if (!stateStream && gameState.phase === 'playing' && !gameState.is_turn) {
                 setTimeout(pollState, 1000);
             }
         }
@@ -39,14 +127,16 @@ async function pollState() {
 
 async function sendAction(actionStr) {
     try {
-        const res = await fetch('/api/action', {
+        const res = await fetch(`/api/games/${gameId}/action`, {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ action: actionStr })
+            body: JSON.stringify({ action: actionStr, since: gameState ? gameState.version : undefined, text: true })
         });
 
         if (res.ok) {
-            pollState();
+            // The answer carries the new state; the stream (or polling) brings the bot's reply
+            if (applyUpdate((await res.json()).state)) render();
+            if (!stateStream) pollState();
         } else {
             const err = await res.json();
             alert("Error: " + err.error);
@@ -74,32 +164,27 @@ function render() {
         clearSpeechBubbles();
     }
 
-    // Handle new log messages (Speech bubbles)
-    if (gameState.log.length > lastLogLength) {
-        const newLogs = gameState.log.slice(lastLogLength);
-        newLogs.forEach(msg => {
-            if (msg.includes('Vos:') && (msg.includes('¡') || msg.includes('No quiero') || msg.includes('mazo'))) {
-                showSpeechBubble('my', msg.split('Vos:')[1].trim());
-            } else if (msg.includes('TrucoBot:') && (msg.includes('¡') || msg.includes('No quiero') || msg.includes('mazo'))) {
-                showSpeechBubble('opp', msg.split('TrucoBot:')[1].trim());
-            }
-        });
-        lastLogLength = gameState.log.length;
+    // Speech bubbles for what was said since the last render
+    for (let i = Math.max(lastEvent - gameState.event_start, 0); i < gameState.events.length; i++) {
+        const event = gameState.events[i];
+        if (SPOKEN.has(event[0])) {
+            const text = gameState.text[i];
+            showSpeechBubble(event[1] === 1 ? 'my' : 'opp', text.slice(text.indexOf(': ') + 2));
+        }
     }
+    lastEvent = gameState.event_start + gameState.events.length;
 
     // Handle Folding Animations and Round Summary
     if (lastPhase === 'playing' && gameState.phase === 'round_end') {
         clearSpeechBubbles(); // Clear them immediately at end of hand
         setTimeout(() => showRoundSummary(), 1000);
 
-        const recentLog = gameState.log[gameState.log.length - 1] || '';
-        const prevLog = gameState.log[gameState.log.length - 2] || '';
-        if (recentLog.includes('no quiso') || prevLog.includes('Me voy al mazo') || prevLog.includes('Te la dejo') || prevLog.includes('me chicho') || prevLog.includes('me achico')) {
-            if (recentLog.includes('Vos ganás') || recentLog.includes('Vos ganas')) {
-                document.getElementById('opp-hand').classList.add('fold-animation-opp');
-            } else if (recentLog.includes('TrucoBot gana')) {
-                document.getElementById('my-hand').classList.add('fold-animation');
-            }
+        // A truco turned down ends the hand: whoever said no quiero throws in the cards
+        const fold = handEvents().find(event => event[0] === EVENT.TRUCO_NO_QUIERO);
+        if (fold && fold[1] === 2) {
+            document.getElementById('opp-hand').classList.add('fold-animation-opp');
+        } else if (fold) {
+            document.getElementById('my-hand').classList.add('fold-animation');
         }
     }
 
@@ -167,6 +252,21 @@ function clearSpeechBubbles() {
     document.getElementById('opp-speech').classList.remove('active');
 }
 
+// Indexes into gameState.events of the current hand's events
+function handEventIndexes() {
+    let start = gameState.events.length;
+    while (start > 0 && gameState.events[start - 1][0] !== EVENT.ROUND_START) start--;
+    return gameState.events.map((_, i) => i).slice(start);
+}
+
+function handEvents() {
+    return handEventIndexes().map(i => gameState.events[i]);
+}
+
+function isResult(event) {
+    return RESULTS.has(event[0]) && !(event[0] === EVENT.TRICK && event[1] === 0);
+}
+
 function renderLog() {
     const logContainer = document.getElementById('log-messages');
 
@@ -175,12 +275,15 @@ function renderLog() {
     let html = '';
 
     // Reverse or forward? Forward is better with auto-scroll down
-    gameState.log.forEach(msg => {
+    gameState.events.forEach((event, i) => {
+        if (!gameState.text[i]) return;
         let cls = 'log-entry';
-        if (msg.includes('ganá') || msg.includes('gana')) cls += ' important';
-        if (msg.includes('TrucoBot')) cls += ' opp-msg'; // Optional
+        if (isResult(event) || event[0] === EVENT.GAME_OVER) cls += ' important';
+        if (SEATED.has(event[0]) && event[1] === 2) cls += ' opp-msg';
 
-        html += `<div class="${cls}">${msg}</div>`;
+        gameState.text[i].split('\n').forEach(line => {
+            html += `<div class="${cls}">${line}</div>`;
+        });
     });
 
     logContainer.innerHTML = html;
@@ -344,18 +447,14 @@ function renderGameOver() {
 }
 
 function showRoundSummary() {
-    // We construct the summary from the recent logs
+    // We construct the summary from the events of the hand
     const txt = document.getElementById('round-summary-text');
 
-    // Find logs that say "ganá" "gana" or "Sumás" since the last dealing
+    // Everything won in this hand, latest first
     let summaryText = "";
-    for (let i = gameState.log.length - 1; i >= 0; i--) {
-        const msg = gameState.log[i];
-        if (msg.includes('--- Arranca')) break;
-        if (msg.includes('ganá') || msg.includes('gana') || msg.includes('Sumás') || msg.includes('Suma')) {
-            summaryText += `<p>${msg}</p>`;
-        }
-    }
+    handEventIndexes().reverse().forEach(i => {
+        if (isResult(gameState.events[i])) summaryText += `<p>${gameState.text[i]}</p>`;
+    });
 
     if (!summaryText) summaryText = "<p>Ronda completada.</p>";
 
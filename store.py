@@ -0,0 +1,233 @@
+import json
+import logging
+import random
+import sqlite3
+import threading
+import time
+
+from game import TrucoGame
+
+logger = logging.getLogger(__name__)
+
+# Durable log of live games, so a restarted server picks them up where they were.
+# A game is stored as its creation (id, target score, seed) plus every accepted action
+# in order; replaying the actions on a TrucoGame with the same seed deals the same cards
+# and narrates the same log, so it rebuilds the game exactly. Every SNAPSHOT_EVERY
+# actions the full state is stored too (TrucoGame snapshot, both generators, event log
+# and version), and loading replays only the actions after the latest snapshot.
+#
+# Writes never wait for the disk: they are queued and a writer thread commits whatever
+# accumulated in the last commit_interval seconds as one transaction, one fsync for the
+# whole batch (group commit). flush() waits until everything queued so far is durable.
+# A batch that fails is retried, then written one statement at a time so only the
+# writes that still fail are lost; they are logged and flush() reports them.
+#
+# Games are deleted when they are over or have been idle for the registry's ttl: the
+# registry deletes the ones it drops from memory for either reason, and purge() sweeps
+# the idle ones no server has in memory (GameRegistry calls it every PURGE_EVERY seconds).
+
+SNAPSHOT_EVERY = 32
+# Attempts at a batch failing with an operational error (locked, disk full, I/O)
+RETRIES = 5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+    id TEXT PRIMARY KEY,
+    target_score INTEGER NOT NULL,
+    seed INTEGER NOT NULL,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS actions (
+    game_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    seat INTEGER NOT NULL,
+    action INTEGER NOT NULL,
+    PRIMARY KEY (game_id, seq)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS snapshots (
+    game_id TEXT PRIMARY KEY,
+    seq INTEGER NOT NULL,
+    state TEXT NOT NULL
+);
+"""
+INSERT_GAME = "INSERT INTO games (id, target_score, seed, created, updated) VALUES (?, ?, ?, ?, ?)"
+# Actions and snapshots of deleted games go with them
+DELETE_ORPHANS = ("DELETE FROM actions WHERE game_id NOT IN (SELECT id FROM games)",
+                  "DELETE FROM snapshots WHERE game_id NOT IN (SELECT id FROM games)")
+
+def _connect(path):
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=FULL")
+    return conn
+
+def _rng_state(state):
+    # random.Random.getstate() after a JSON round trip
+    version, internal, gauss = state
+    return version, tuple(internal), gauss
+
+class GameStore:
+    def __init__(self, path, make_players, commit_interval=0.005, snapshot_every=SNAPSHOT_EVERY):
+        # make_players() returns the (p1, p2) a rehydrated game is played by
+        self.path = path
+        self.make_players = make_players
+        self.commit_interval = commit_interval
+        self.snapshot_every = snapshot_every
+        with _connect(path) as conn:
+            conn.executescript(SCHEMA)
+        self.queue = []
+        self.creating = set() # ids of the games whose creation is not committed yet
+        self.cond = threading.Condition()
+        self.queued = 0 # writes queued since start
+        self.committed = 0 # of which committed
+        self.lost = 0 # and failed for good
+        self.batches = 0
+        self.thread = None
+        self.stopped = False
+
+    def _put(self, sql, params):
+        with self.cond:
+            if self.stopped:
+                raise RuntimeError("Game store is closed")
+            self.queue.append((sql, params))
+            self.queued += 1
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='game-store', daemon=True)
+                self.thread.start()
+            self.cond.notify_all()
+
+    def create(self, game_id, game):
+        if game.seed is None:
+            raise ValueError("Stored games need a seed to deal the same cards again")
+        with self.cond:
+            self.creating.add(game_id)
+        now = time.time()
+        self._put(INSERT_GAME, (game_id, game.target_score, game.seed, now, now))
+
+    def append(self, game_id, seq, seat, action, game):
+        # Action number seq (from 1) of a game, called right after game accepted it
+        self._put("INSERT INTO actions (game_id, seq, seat, action) VALUES (?, ?, ?, ?)",
+                  (game_id, seq, seat, action))
+        self._put("UPDATE games SET updated = ? WHERE id = ?", (time.time(), game_id))
+        if seq % self.snapshot_every == 0:
+            state = json.dumps({"state": game.snapshot(), "rng": game.rng.getstate(),
+                                "flavor": game.flavor_rng.getstate(), "events": game.events.dump(),
+                                "version": game.version})
+            self._put("INSERT OR REPLACE INTO snapshots (game_id, seq, state) VALUES (?, ?, ?)",
+                      (game_id, seq, state))
+
+    def delete(self, game_id):
+        self._put("DELETE FROM games WHERE id = ?", (game_id,))
+        self._put("DELETE FROM actions WHERE game_id = ?", (game_id,))
+        self._put("DELETE FROM snapshots WHERE game_id = ?", (game_id,))
+
+    def purge(self, max_age):
+        # Deletes the games without an action for max_age seconds, and whatever an action
+        # accepted while its game was being deleted left behind
+        self._put("DELETE FROM games WHERE updated < ?", (time.time() - max_age,))
+        for sql in DELETE_ORPHANS:
+            self._put(sql, ())
+
+    def _run(self):
+        conn = _connect(self.path)
+        while True:
+            with self.cond:
+                while not self.queue and not self.stopped:
+                    self.cond.wait()
+                if not self.queue:
+                    break
+                # Let concurrent requests join this commit
+                if not self.stopped:
+                    self.cond.wait(self.commit_interval)
+                batch, self.queue = self.queue, []
+            lost = self._commit(conn, batch)
+            with self.cond:
+                self.creating.difference_update(params[0] for sql, params in batch if sql is INSERT_GAME)
+                self.committed += len(batch) - lost
+                self.lost += lost
+                self.batches += 1
+                self.cond.notify_all()
+        conn.close()
+
+    def _commit(self, conn, batch):
+        # Commits the batch, returns how many of its writes were lost
+        for attempt in range(RETRIES):
+            try:
+                with conn:
+                    for sql, params in batch:
+                        conn.execute(sql, params)
+                return 0
+            except sqlite3.OperationalError as e:
+                logger.warning("Game store commit failed (%s), retrying", e)
+                time.sleep(self.commit_interval * 2 ** attempt)
+            except sqlite3.Error:
+                break
+        lost = 0
+        for sql, params in batch:
+            try:
+                with conn:
+                    conn.execute(sql, params)
+            except sqlite3.Error:
+                logger.exception("Lost a game store write: %s %r", sql, params[:4])
+                lost += 1
+        return lost
+
+    def flush(self, timeout=None):
+        # Waits until every write queued before the call is committed. False on timeout,
+        # or if the store has lost writes since it started.
+        with self.cond:
+            target = self.queued
+            return self.cond.wait_for(lambda: self.committed + self.lost >= target, timeout) and not self.lost
+
+    def close(self):
+        self.flush()
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+
+    def load(self, game_id):
+        # (game, number of actions) rebuilt from the store, or None for an unknown id
+        with self.cond:
+            creating = game_id in self.creating
+        conn = _connect(self.path)
+        try:
+            # Ids never stored are answered without waiting for the writer. A game is
+            # either still being created or committed, so checking in this order misses none.
+            if not creating and conn.execute("SELECT 1 FROM games WHERE id = ?", (game_id,)).fetchone() is None:
+                return None
+            # Its latest actions may still be queued
+            self.flush()
+            row = conn.execute("SELECT target_score, seed FROM games WHERE id = ?", (game_id,)).fetchone()
+            if row is None:
+                return None
+            target_score, seed = row
+            p1, p2 = self.make_players()
+            game = TrucoGame(p1, p2, target_score=target_score, seed=seed)
+            seq = 0
+            snapshot = conn.execute("SELECT seq, state FROM snapshots WHERE game_id = ?", (game_id,)).fetchone()
+            if snapshot is not None:
+                seq, state = snapshot[0], json.loads(snapshot[1])
+                game.restore(tuple(state["state"]))
+                game.rng.setstate(_rng_state(state["rng"]))
+                game.flavor_rng.setstate(_rng_state(state["flavor"]))
+                game.events.load(state["events"])
+                game.version = state["version"]
+            actions = conn.execute("SELECT seq, seat, action FROM actions WHERE game_id = ? AND seq > ? ORDER BY seq",
+                                   (game_id, seq)).fetchall()
+        finally:
+            conn.close()
+        for expected, (seq, seat, action) in enumerate(actions, seq + 1):
+            if seq != expected:
+                raise ValueError(f"Stored game {game_id} is missing action {expected}")
+            player = game.p1 if seat == 1 else game.p2
+            success, msg = game.handle_action_id(player, action)
+            if not success:
+                raise ValueError(f"Stored game {game_id} does not replay at action {seq}: {msg}")
+        return game, seq
+
+def new_seed():
+    # Games are seeded so their deals can be replayed
+    return random.SystemRandom().getrandbits(63)
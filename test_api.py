@@ -1,59 +1,290 @@
-import urllib.request
 import json
-import time
-
-def get_state():
-    req = urllib.request.Request("http://127.0.0.1:5000/api/state")
-    with urllib.request.urlopen(req) as response:
-        return json.loads(response.read().decode())
-
-def post_action(action):
-    data = json.dumps({"action": action}).encode('utf-8')
-    req = urllib.request.Request("http://127.0.0.1:5000/api/action", data=data, headers={"Content-Type": "application/json"})
-    try:
-        urllib.request.urlopen(req)
-        return True
-    except urllib.error.HTTPError as e:
-        print(f"Failed action {action}: {e.read().decode('utf-8')}")
-        return False
-
-# Start
-urllib.request.urlopen(urllib.request.Request("http://127.0.0.1:5000/api/start", data=b'{"target_score": 15}', headers={"Content-Type": "application/json"}))
-print("Game started")
-time.sleep(0.5)
-
-state = get_state()
-if "call_truco" in state["valid_actions"]:
-    print("Can call Truco. Calling it...")
-    post_action("call_truco")
-
-    # Bot responds
-    time.sleep(1)
-    # The API might be waiting for the bot to poll and respond
-    # in this simple framework, the bot is triggered on /api/state poll.
-    state = get_state()
-    time.sleep(1)
-    state = get_state() # Poll twice to ensure bot has played
-    print("State after bot response:", state["truco_state"])
-    print("Truco turn is player:", state["truco_turn"])
-    print("Valid actions:", state["valid_actions"])
-    
-    if "call_retruco" in state["valid_actions"]:
-        print("Success! Player can call Retruco.")
-        post_action("call_retruco")
-        time.sleep(1)
-        state = get_state()
-        time.sleep(1)
-        state = get_state()
-        print("State after retruco bot response:", state["truco_state"])
-    elif state["waiting_for_response"] == "truco":
-        print("Bot called Retruco! We must accept.")
-        post_action("truco_quiero")
-        time.sleep(1)
-        state = get_state()
-        time.sleep(1)
-        state = get_state()
-        if "call_vale_4" in state["valid_actions"]:
-            print("Success! Player can call Vale 4 after accepting Retruco.")
-else:
-    print("Could not call Truco.")
+import os
+import re
+import tempfile
+import threading
+import unittest
+
+# Games of the test run are stored in a throwaway database
+_db = tempfile.TemporaryDirectory()
+os.environ['TRUCO_DB'] = os.path.join(_db.name, 'games.db')
+os.environ['TRUCO_METRICS'] = '1'
+os.environ['TRUCO_PROFILE'] = '1'
+
+import app as server
+from game import EVENT_CODES, GamePhase
+from scheduler import BotScheduler
+from sessions import GameRegistry
+from shard import HashRing, Router
+from store import GameStore
+from werkzeug.serving import make_server
+from werkzeug.test import Client
+
+class TestAPI(unittest.TestCase):
+    def setUp(self):
+        server.scheduler.delay = 0
+        self.client = server.app.test_client()
+
+    def start(self, client=None, target_score=15):
+        client = client or self.client
+        response = client.post('/api/start', json={"target_score": target_score})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(server.scheduler.wait_idle(10))
+        return response.json["game_id"]
+
+    def state(self, client=None):
+        return (client or self.client).get('/api/state').json
+
+    def act(self, action):
+        response = self.client.post('/api/action', json={"action": action})
+        self.assertTrue(server.scheduler.wait_idle(10))
+        return response
+
+    def test_player_can_raise_after_bot_accepts_truco(self):
+        # Deals are random: play games until the bot answers our truco without folding
+        for _ in range(20):
+            self.start()
+            state = self.state()
+            if "call_truco" not in state["valid_actions"]:
+                continue
+            hand_number = state["hand_number"]
+            self.assertEqual(self.act("call_truco").status_code, 200)
+            state = self.state()
+            if state["hand_number"] != hand_number:
+                # Bot folded, and may already have called truco in the next hand
+                continue
+            if state["truco_state"] == "truco" and state["waiting_for_response"] is None:
+                # Bot accepted: the right to raise is ours
+                self.assertEqual(state["truco_turn"], 1)
+                self.assertIn("call_retruco", state["valid_actions"])
+                return
+            if state["waiting_for_response"] == "truco":
+                # Bot raised to retruco: accepting it goes back to the cards
+                self.assertEqual(state["truco_state"], "retruco")
+                self.assertEqual(self.act("truco_quiero").status_code, 200)
+                self.assertIsNone(self.state()["waiting_for_response"])
+                return
+        self.fail("the bot never answered a truco")
+
+    def test_get_state_has_no_side_effects(self):
+        # A scheduler whose moves are never due: polling must not play the bot's turn
+        scheduler, server.scheduler = server.scheduler, BotScheduler(delay=3600)
+        try:
+            self.client.post('/api/start', json={"target_score": 15})
+            # We are mano in the first hand; after our card the bot has to answer
+            self.client.post('/api/action', json={"action": "play_card_0"})
+            first = self.state()
+            self.assertFalse(first["is_turn"])
+            # What the bots search with stays on the server
+            self.assertNotIn("info_set", first)
+            self.assertEqual(self.state()["version"], first["version"])
+        finally:
+            server.scheduler.shutdown()
+            server.scheduler = scheduler
+
+    def test_malformed_actions_are_rejected(self):
+        game_id = self.start()
+        before = self.state()
+        for action in ([1], {"a": 1}, "fly", 99):
+            response = self.client.post(f'/api/games/{game_id}/action', json={"action": action})
+            self.assertEqual(response.status_code, 400)
+            self.assertIn("Invalid action", response.json["error"])
+        self.assertEqual(self.state(), before)
+        # A since that is no version number gets the full state
+        response = self.client.post(f'/api/games/{game_id}/action',
+                                    json={"action": before["valid_actions"][0], "since": []})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("since", response.json["state"])
+
+    def test_actions_can_be_sent_by_id(self):
+        game_id = self.start()
+        state = self.state()
+        self.assertIn('play_card_0', state["valid_actions"])
+        response = self.client.post(f'/api/games/{game_id}/action', json={"action": 0})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["state"]["my_played"][-1], state["my_cards"][0]["str"])
+        self.assertEqual(self.client.post(f'/api/games/{game_id}/action', json={}).status_code, 400)
+
+    def test_games_are_isolated(self):
+        other = server.app.test_client()
+        first, second = self.start(), self.start(other)
+        self.assertNotEqual(first, second)
+        self.assertEqual(self.client.get(f'/api/games/{second}/state').json["version"], self.state(other)["version"])
+        self.assertEqual(self.client.get('/api/games/unknown/state').status_code, 400)
+
+    def test_unchanged_state_is_not_modified(self):
+        self.start()
+        response = self.client.get('/api/state')
+        version = response.json["version"]
+        self.assertEqual(self.client.get(f'/api/state?since={version}').status_code, 304)
+        self.assertEqual(self.client.get('/api/state', headers={"If-None-Match": response.headers["ETag"]}).status_code, 304)
+
+    def test_stream_pushes_bot_moves(self):
+        game_id = self.start()
+        session = server.registry.get(game_id)
+        response = self.client.get(f'/api/games/{game_id}/stream', buffered=False)
+        events = response.response
+        state = json.loads(next(events)[len(b"data: "):])
+        self.assertEqual(state["event_start"], 0)
+        # Narration only for clients that ask for it
+        self.assertNotIn("text", state)
+        while state["phase"] == GamePhase.PLAYING and not state["is_turn"]:
+            state = dict(state, **json.loads(next(events)[len(b"data: "):]))
+        # Our move is pushed, then the bot's answer as soon as it plays
+        self.client.post(f'/api/games/{game_id}/action', json={"action": state["valid_actions"][0]})
+        mine = json.loads(next(events)[len(b"data: "):])
+        self.assertEqual(mine["since"], state["version"])
+        with session.lock:
+            bot_turn = session.bot_to_move()
+        if bot_turn:
+            reply = json.loads(next(events)[len(b"data: "):])
+            self.assertGreater(reply["version"], mine["version"])
+        response.close()
+        server.scheduler.wait_idle(10)
+
+    def test_spectators_share_one_encoded_view(self):
+        game_id = self.start()
+        session = server.registry.get(game_id)
+        watched = self.client.get(f'/api/games/{game_id}/spectate')
+        view = watched.json
+        self.assertEqual(view["cards_left"], [3, 3])
+        self.assertNotIn("my_cards", view)
+        with session.lock:
+            hidden = {str(c) for c in session.game.p1.hand + session.game.p2.hand}
+        self.assertFalse(hidden & set(view["cards_on_table"] + view["played"][0] + view["played"][1]))
+        # Every viewer of this version gets the same bytes, encoded once
+        with session.lock:
+            self.assertIs(session.encoded(spectator=True), session.encoded(spectator=True))
+        self.assertEqual(self.client.get(f'/api/games/{game_id}/spectate').data, watched.data)
+        self.assertNotEqual(watched.headers["ETag"], self.client.get('/api/state').headers["ETag"])
+        # A move makes a new version; viewers following along get only what changed
+        self.act(self.state()["valid_actions"][0])
+        delta = self.client.get(f'/api/games/{game_id}/spectate?since={view["version"]}').json
+        self.assertEqual(delta["since"], view["version"])
+        self.assertGreater(delta["version"], view["version"])
+
+    def test_client_knows_the_event_codes(self):
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'app.js')) as f:
+            table = re.search(r"const EVENT = \{(.*?)\};", f.read(), re.S).group(1)
+        codes = {name.lower(): int(code) for name, code in re.findall(r"(\w+): (\d+)", table)}
+        self.assertEqual(codes, EVENT_CODES)
+
+    def test_games_survive_a_restart(self):
+        game_id = self.start()
+        self.act(self.state()["valid_actions"][0])
+        before = self.client.get(f'/api/games/{game_id}/state').json
+        # A restarted server: nothing in memory, the same database
+        registry = server.registry
+        registry.store.flush()
+        server.registry = GameRegistry(store=GameStore(server.DB_PATH, server.make_players),
+                                       on_load=server.resume_bot)
+        try:
+            self.assertEqual(self.client.get(f'/api/games/{game_id}/state').json, before)
+            self.assertEqual(self.state(), before)
+        finally:
+            server.registry.store.close()
+            server.registry = registry
+
+    def test_metrics_count_actions_and_requests(self):
+        self.start()
+        action = self.state()["valid_actions"][0]
+        self.assertEqual(self.act(action).status_code, 200)
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        samples = {}
+        for line in response.get_data(as_text=True).splitlines():
+            if not line.startswith('#'):
+                name, value = line.rsplit(' ', 1)
+                samples[name] = float(value)
+        self.assertGreaterEqual(samples[f'truco_actions_total{{action="{action}",seat="1"}}'], 1)
+        self.assertGreaterEqual(samples['truco_request_seconds_count{route="handle_action"}'], 1)
+        self.assertGreaterEqual(samples['truco_responses_total{route="start_game",status="200"}'], 1)
+        self.assertGreaterEqual(samples['truco_bot_decision_seconds_count{bot="ISMCTSBot"}'], 1)
+        self.assertEqual(samples['truco_handle_action_seconds_bucket{le="+Inf"}'],
+                         samples['truco_handle_action_seconds_count'])
+        self.assertEqual(samples['truco_live_games'], len(server.registry))
+        self.assertGreater(samples['truco_game_memory_bytes'], 0)
+
+    def test_profile_returns_folded_stacks(self):
+        response = self.client.get('/debug/profile?seconds=0.05')
+        self.assertEqual(response.status_code, 200)
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertTrue(lines)
+        for line in lines:
+            stack, count = line.rsplit(' ', 1)
+            self.assertGreater(int(count), 0)
+        # The bot scheduler's idle workers are sampled too
+        self.assertTrue(any('scheduler.py' in line for line in lines))
+
+class TestRouter(unittest.TestCase):
+    # The router in front of two stand-in workers, each answering with its name and
+    # what it was sent
+    def setUp(self):
+        self.servers = {}
+        self.moved = set() # game ids the worker answers 421 for, once
+        for name in ('w0', 'w1'):
+            server = make_server('127.0.0.1', 0, self.worker(name), threaded=True)
+            threading.Thread(target=server.serve_forever, args=(0.01,), daemon=True).start()
+            self.servers[name] = server
+        self.router = Router({name: ('127.0.0.1', server.server_port) for name, server in self.servers.items()})
+        self.client = Client(self.router)
+
+    def tearDown(self):
+        for server in self.servers.values():
+            server.shutdown()
+            server.server_close()
+
+    def worker(self, name):
+        def app(environ, start_response):
+            path = environ['PATH_INFO']
+            parts = path.split('/')
+            game_id = environ.get('HTTP_X_TRUCO_GAME_ID') or (parts[3] if len(parts) > 4 else None)
+            if game_id in self.moved:
+                # A rebalance the router is finishing: it has the new ring once the lock is free
+                self.moved.discard(game_id)
+                start_response('421 Misdirected Request', [('Content-Type', 'application/json')])
+                return [b'{}']
+            if path.endswith('/stream'):
+                start_response('200 OK', [('Content-Type', 'text/event-stream')])
+                return (f"data: {i}\n\n".encode() for i in range(3))
+            body = json.dumps({"worker": name, "game_id": game_id, "path": path,
+                               "query": environ.get('QUERY_STRING'), "cookie": environ.get('HTTP_COOKIE'),
+                               "body": environ['wsgi.input'].read(int(environ.get('CONTENT_LENGTH') or 0)).decode()})
+            start_response('200 OK', [('Content-Type', 'application/json'), ('Keep-Alive', 'timeout=5')])
+            return [body.encode()]
+        return app
+
+    def test_requests_reach_the_owner_of_their_game(self):
+        ring = HashRing(['w0', 'w1'])
+        response = self.client.post('/api/start', json={"target_score": 15}, headers={'X-Truco-Game-Id': 'chosen'})
+        started = response.json
+        # The router names the game, whatever the client sent
+        self.assertNotEqual(started["game_id"], 'chosen')
+        self.assertEqual(started["worker"], ring.owner(started["game_id"]))
+        self.assertEqual(json.loads(started["body"]), {"target_score": 15})
+        self.assertNotIn('Keep-Alive', response.headers)
+        games = [f"game{i}" for i in range(20)]
+        for game_id in games:
+            state = self.client.get(f'/api/games/{game_id}/state?since=3').json
+            self.assertEqual((state["worker"], state["query"]), (ring.owner(game_id), 'since=3'))
+        self.assertEqual({ring.owner(game_id) for game_id in games}, {'w0', 'w1'})
+        self.client.set_cookie('game_id', games[0])
+        state = self.client.get('/api/state').json
+        self.assertEqual((state["worker"], state["cookie"]), (ring.owner(games[0]), f"game_id={games[0]}"))
+        self.assertEqual(self.client.post('/api/shard/ring', json={"shards": []}).status_code, 404)
+
+    def test_misdirected_requests_are_sent_again(self):
+        self.moved.add('game1')
+        state = self.client.get('/api/games/game1/state').json
+        self.assertEqual(state["game_id"], 'game1')
+        self.assertEqual(self.router.retried, 1)
+
+    def test_streams_are_relayed(self):
+        response = self.client.get('/api/games/game1/stream')
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        self.assertEqual(response.get_data(), b"data: 0\n\ndata: 1\n\ndata: 2\n\n")
+        # The connection goes back to the pool for the next request
+        self.assertEqual(self.client.get('/api/games/game1/state').json["game_id"], 'game1')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,34 @@
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
 import unittest
-from card import Card
-from envido import calculate_envido_points
+import numpy as np
+from itertools import combinations
+import actions
+from deck import Deck
+from card import Card, CARDS, TRUCO_VALUE, card_from_id, hand_index, hand_from_index
+import envido
+from envido import calculate_envido_points, calculate_envido_points_batch
+from game import (TrucoGame, GamePhase, GameEvent, EVENT_CODES, DEAL_CODE, HAND1, HAND2, PLAYED1, PLAYED2, P1_SCORE, P2_SCORE,
+                  ENVIDO_POINTS1, ENVIDO_POINTS2)
+from player import CFRBot, HeuristicBot, ISMCTSBot, NeuralBot, RandomBot, Player
+import tournament
+from endgame import EndgameSolver, TranspositionTable
+from scheduler import BotScheduler
+from sessions import GameMoved, GameRegistry
+from shard import HashRing
+from store import GameStore
+import equity
+import envido_cfr
+from batch_env import BatchTrucoEnv, observation_from_info_set
+import neural
+import selfplay
+import records
+import analytics
+import bench
 
 class TestTruco(unittest.TestCase):
     def test_card_values(self):
@@ -12,6 +40,16 @@ class TestTruco(unittest.TestCase):
         c4 = Card(7, Card.ORO)
         self.assertTrue(c3.get_truco_value() > c4.get_truco_value())
 
+    def test_cards_are_interned(self):
+        self.assertIs(Card(7, Card.ORO), Card(7, Card.ORO))
+        self.assertEqual(len(CARDS), 40)
+        for i, c in enumerate(CARDS):
+            self.assertEqual(c.id, i)
+            self.assertIs(card_from_id(i), c)
+            self.assertEqual(c.get_truco_value(), TRUCO_VALUE[i])
+        self.assertRaises(ValueError, Card, 8, Card.ORO)
+        self.assertRaises(ValueError, Card, 1, 'Corazon')
+
     def test_envido_calculation(self):
         # 7 and 6 of same suit = 33
         hand1 = [Card(7, Card.ESPADA), Card(6, Card.ESPADA), Card(1, Card.BASTO)]
@@ -25,5 +63,932 @@ class TestTruco(unittest.TestCase):
         hand3 = [Card(7, Card.ESPADA), Card(1, Card.BASTO), Card(1, Card.ORO)]
         self.assertEqual(calculate_envido_points(hand3), 7)
 
+    def test_envido_table_matches_the_rules(self):
+        # Every hand against the rules written out plainly: figures count 0, two cards of a
+        # suit count 20 plus both, otherwise the best single card
+        def points(cards):
+            values = [card.rank if card.rank < 10 else 0 for card in cards]
+            best = max(values)
+            for (a, va), (b, vb) in combinations(zip(cards, values), 2):
+                if a.suit == b.suit:
+                    best = max(best, 20 + va + vb)
+            return best
+        hands = 0
+        for cards in combinations(CARDS, 3):
+            i = hand_index(*(card.id for card in cards))
+            self.assertEqual(sorted(hand_from_index(i)), sorted(card.id for card in cards))
+            self.assertEqual(envido.ENVIDO_TABLE[i], points(cards), cards)
+            hands += 1
+        self.assertEqual(hands, len(envido.ENVIDO_TABLE))
+
+    @unittest.skipIf(envido.np is None, "numpy not installed")
+    def test_envido_batch(self):
+        hands = [[c.id for c in h] for h in (
+            [Card(7, Card.ESPADA), Card(6, Card.ESPADA), Card(1, Card.BASTO)],
+            [Card(7, Card.ORO), Card(5, Card.ORO), Card(4, Card.ORO)],
+            [Card(7, Card.ESPADA), Card(1, Card.BASTO), Card(1, Card.ORO)],
+        )]
+        self.assertEqual(list(calculate_envido_points_batch(hands)), [33, 32, 7])
+
+
+def play_bots(seed, quiet, target_score=15):
+    random.seed(seed)
+    game = TrucoGame(HeuristicBot("Bot 1"), HeuristicBot("Bot 2"), target_score=target_score, quiet=quiet)
+    while game.phase != GamePhase.GAME_OVER:
+        player = game.current_turn
+        success, msg = game.handle_action(player, player.get_action(game.get_state_for_player(player)))
+        assert success, msg
+    return game
+
+class TestActions(unittest.TestCase):
+    def test_mask_matches_names(self):
+        for seed in range(10):
+            game = play_bots(seed, quiet=True)
+            self.assertEqual(game.get_valid_mask(game.current_turn), 0)
+        game = TrucoGame(RandomBot("A", rng=random.Random(3)), RandomBot("B", rng=random.Random(4)), quiet=True, seed=3)
+        while game.phase != GamePhase.GAME_OVER:
+            player = game.current_turn
+            state = game.get_state_for_player(player)
+            self.assertEqual(actions.mask_to_names(state['valid_mask']), state['valid_actions'])
+            self.assertEqual(actions.names_to_mask(state['valid_actions']), state['valid_mask'])
+            game.handle_action(player, player.get_action(state))
+
+    def test_ids_and_names_play_the_same(self):
+        by_name = TrucoGame(Player("A"), Player("B"), quiet=True, seed=8)
+        by_id = TrucoGame(Player("A"), Player("B"), quiet=True, seed=8)
+        for name in ['call_envido', 'call_envido', 'envido_quiero', 'play_card_1', 'call_truco', 'truco_quiero']:
+            self.assertEqual(by_name.handle_action(by_name.current_turn, name),
+                             by_id.handle_action_id(by_id.current_turn, actions.ACTION_IDS[name]))
+            self.assertEqual(by_name.snapshot(), by_id.snapshot())
+        player = by_id.current_turn
+        self.assertFalse(by_id.handle_action_id(player, actions.CALL_VALE_4)[0])
+        self.assertFalse(by_id.handle_action_id(player, actions.NUM_ACTIONS)[0])
+        self.assertFalse(by_id.handle_action(player, 'call_flor')[0])
+
+    def test_deal_draws_distinct_cards(self):
+        deck = Deck(random.Random(1))
+        dealt = deck.deal(6) + deck.deal(34)
+        self.assertEqual(sorted(c.id for c in dealt), list(range(40)))
+        with self.assertRaises(ValueError):
+            deck.deal(1)
+        # Every card lands in the first hand about equally often
+        counts = [0] * 40
+        for _ in range(4000):
+            deck.reset()
+            for card in deck.deal(3):
+                counts[card.id] += 1
+        self.assertLess(max(counts) - min(counts), 150)
+
+class TestQuietMode(unittest.TestCase):
+    def test_quiet_mode_matches_ui_mode(self):
+        for seed in range(20):
+            ui = play_bots(seed, quiet=False)
+            quiet = play_bots(seed, quiet=True)
+            self.assertEqual((ui.p1_score, ui.p2_score, ui.hand_number), (quiet.p1_score, quiet.p2_score, quiet.hand_number))
+            self.assertTrue(ui.log)
+            self.assertEqual(quiet.log, [])
+
+    def test_event_log_keeps_the_last_events(self):
+        games = []
+        for size in (16, None):
+            game = TrucoGame(HeuristicBot("A", rng=random.Random(1)), HeuristicBot("B", rng=random.Random(2)),
+                             target_score=15, seed=4, log_size=size)
+            game.play()
+            games.append(game)
+        small, full = games
+        self.assertEqual(len(small.events.entries), 16)
+        self.assertEqual(small.events.total, full.events.total)
+        self.assertEqual(small.events.since(0), full.events.since(small.events.start))
+        self.assertEqual(small.events.since(small.events.total - 3), list(full.events.entries)[-3:])
+        self.assertEqual(small.log, full.events.lines(small.events.start))
+        self.assertEqual(len(small.events.texts()), 16)
+        winner = 1 if small.p1_score >= small.target_score else 2
+        self.assertEqual(small.events.public()[-1], [EVENT_CODES[GameEvent.GAME_OVER], winner])
+        # Deals reach clients without the cards
+        deals = [entry for entry in full.events.public() if entry[0] == DEAL_CODE]
+        self.assertTrue(deals)
+        self.assertTrue(all(entry == [DEAL_CODE] for entry in deals))
+
+    def test_subscribers_receive_events(self):
+        game = TrucoGame(HeuristicBot("Bot 1"), HeuristicBot("Bot 2"), quiet=True)
+        events = []
+        game.subscribe(lambda kind, payload: events.append((kind, payload)))
+        player = game.current_turn
+        card = player.hand[0]
+        game.handle_action(player, 'play_card_0')
+        self.assertEqual(events, [(GameEvent.PLAY_CARD, (game.seat_of(player), card.id))])
+
+class TestSeededGames(unittest.TestCase):
+    def test_seeded_games_reproduce(self):
+        results = [tournament.play_match(('heuristic', 'random', 15, 4, i)) for i in range(6)]
+        self.assertEqual(results, [tournament.play_match(('heuristic', 'random', 15, 4, i)) for i in range(6)])
+        game, _ = tournament.make_game('heuristic', 'random', 15, 4, 3, quiet=False)
+        game.play()
+        self.assertEqual((game.p2_score, game.p1_score, game.hand_number), results[3][2:])
+
+    def test_pool_matches_serial_run(self):
+        serial = tournament.run_tournament('heuristic', 'random', 8, 15, base_seed=1, processes=1)
+        pooled = tournament.run_tournament('heuristic', 'random', 8, 15, base_seed=1, processes=2)
+        self.assertEqual(serial, pooled)
+        summary = tournament.summarize(serial, 'heuristic', 'random', 15)
+        low, high = summary['a_win_rate_ci95']
+        self.assertTrue(0 <= low <= summary['a_win_rate'] <= high <= 1)
+
+    def test_turn_returns_to_player_who_had_to_play(self):
+        game = TrucoGame(Player("A"), Player("B"), quiet=True, seed=2)
+        mano, pie = game.p1, game.p2
+        game.handle_action(mano, 'play_card_0')
+        game.handle_action(pie, 'call_truco')
+        game.handle_action(mano, 'call_retruco')
+        game.handle_action(pie, 'truco_quiero')
+        # pie still has to answer the first card
+        self.assertIs(game.current_turn, pie)
+
+class TestSnapshots(unittest.TestCase):
+    def test_apply_undo_and_clone(self):
+        rng = random.Random(5)
+        for seed in range(30):
+            game = TrucoGame(Player("A"), Player("B"), target_score=15, quiet=seed % 2 == 0, seed=seed)
+            while game.phase != GamePhase.GAME_OVER:
+                before = game.snapshot()
+                copy = game.clone(rng=random.Random(seed))
+                self.assertEqual(copy.snapshot(), before)
+                copy.rng.setstate(game.rng.getstate())
+                log, version = game.log, game.version
+
+                action = rng.choice(game.get_valid_actions(game.current_turn))
+                self.assertTrue(game.apply(action))
+                after = game.snapshot()
+                game.undo()
+                self.assertEqual(game.snapshot(), before)
+                self.assertEqual((game.log, game.version), (log, version))
+
+                # Undone, the action deals the same cards again
+                game.apply(action)
+                self.assertEqual(game.snapshot(), after)
+                copy.apply(action)
+                self.assertEqual(copy.snapshot(), game.snapshot())
+
+    def test_snapshot_is_independent_of_players(self):
+        game = TrucoGame(Player("A"), Player("B"), quiet=True, seed=3)
+        other = TrucoGame(Player("C"), Player("D"), quiet=True, seed=4)
+        other.restore(game.snapshot())
+        self.assertEqual(other.snapshot(), game.snapshot())
+        self.assertEqual(other.get_valid_actions(other.current_turn), game.get_valid_actions(game.current_turn))
+        self.assertEqual(hash(other.snapshot()), hash(game.snapshot()))
+
+class TestISMCTSBot(unittest.TestCase):
+    def test_returns_valid_action_within_deadline(self):
+        # A clock that moves 1 ms every time it is read: the search reads it once per iteration
+        ticks = iter(range(10 ** 6))
+        bot = ISMCTSBot("Bot", rng=random.Random(1), time_budget_ms=40, clock=lambda: next(ticks) / 1000)
+        game = TrucoGame(HeuristicBot("Other"), bot, quiet=True, seed=1)
+        game.handle_action(game.p1, 'play_card_0')
+        state = game.get_state_for_player(bot)
+        action = bot.get_action(state)
+        self.assertIn(action, state['valid_actions'])
+        self.assertEqual(bot.last_search['iterations'], 40)
+        self.assertAlmostEqual(bot.last_search['elapsed_ms'], 41)
+
+    def test_determinizations_are_consistent_with_info_set(self):
+        bot = ISMCTSBot("Bot", rng=random.Random(2))
+        game = TrucoGame(bot, Player("Other"), quiet=True, seed=5)
+        game.handle_action(bot, 'call_envido')
+        game.handle_action(game.p2, 'envido_quiero')
+        game.handle_action(bot, 'play_card_0')
+        info = game.info_set(bot)
+        self.assertEqual(info[HAND2], (-1, -1, -1))
+        determinize = bot.determinizer(info, 1)
+        for _ in range(50):
+            full = determinize()
+            seen = set(full[HAND1]) | set(full[PLAYED1]) | set(full[PLAYED2])
+            self.assertFalse(seen & set(full[HAND2]))
+            # The accepted envido revealed the opponent's points
+            self.assertEqual(envido.envido_points_for_ids(*full[HAND2]), game.envido_points_p2)
+
+    def test_plays_full_match(self):
+        bot = ISMCTSBot("Bot", rng=random.Random(3), max_iterations=30)
+        game = TrucoGame(bot, HeuristicBot("Other", rng=random.Random(4)), target_score=5, quiet=True, seed=3)
+        game.play()
+        self.assertEqual(game.phase, GamePhase.GAME_OVER)
+
+class TestEndgameSolver(unittest.TestCase):
+    def after_first_trick(self, seed):
+        game = TrucoGame(Player("A"), Player("B"), quiet=True, seed=seed)
+        rng = random.Random(seed)
+        while not game.round_winners and game.hand_number == 0:
+            plays = [a for a in game.get_valid_actions(game.current_turn) if a.startswith('play_card_')]
+            game.handle_action(game.current_turn, rng.choice(plays))
+        return game
+
+    def test_cached_values_match_uncached_search(self):
+        shared = EndgameSolver(TranspositionTable())
+        for seed in range(8):
+            game = self.after_first_trick(seed)
+            before = game.snapshot()
+            # With max_entries=0 every put starts a new generation, so the table only ever
+            # holds the last two positions stored and the search is all but uncached
+            fresh = EndgameSolver(TranspositionTable(max_entries=0))
+            self.assertEqual(shared.action_values(game), fresh.action_values(game))
+            self.assertEqual(shared.action_values(game), fresh.action_values(game))
+            self.assertLessEqual(len(fresh.table), 2)
+            self.assertEqual(game.snapshot(), before)
+
+    def test_table_is_bounded(self):
+        table = TranspositionTable(max_entries=50)
+        solver = EndgameSolver(table)
+        for seed in range(8):
+            solver.action_values(self.after_first_trick(seed))
+            self.assertLessEqual(len(table), 100)
+        self.assertGreater(solver.nodes, 100)
+
+    def test_table_is_thread_safe(self):
+        table = TranspositionTable(max_entries=10)
+        def lookups(offset):
+            for i in range(20000):
+                key = (offset + i) % 37
+                if table.get(key) is None:
+                    table.put(key, key)
+        threads = [threading.Thread(target=lookups, args=(n,)) for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(table.hits + table.misses, 80000)
+        self.assertLessEqual(len(table), 20)
+
+    def test_bot_solves_late_tricks(self):
+        bot = ISMCTSBot("Bot", rng=random.Random(1), time_budget_ms=100)
+        game = TrucoGame(bot, Player("Other"), quiet=True, seed=3)
+        game.handle_action(bot, 'play_card_0')
+        game.handle_action(game.p2, 'play_card_0')
+        player = game.current_turn
+        if player is not bot:
+            game.handle_action(player, 'play_card_0')
+        state = game.get_state_for_player(bot)
+        self.assertIn(bot.get_action(state), state['valid_actions'])
+        self.assertTrue(bot.last_search['endgame'])
+
+class TestEquity(unittest.TestCase):
+    def ids(self, *cards):
+        return [Card(rank, suit).id for rank, suit in cards]
+
+    def test_equity_bounds(self):
+        best = self.ids((1, Card.ESPADA), (1, Card.BASTO), (7, Card.ESPADA))
+        worst = self.ids((4, Card.COPA), (4, Card.ORO), (4, Card.BASTO))
+        self.assertEqual(equity.hand_equity(best, True), 1.0)
+        self.assertLess(equity.hand_equity(worst, False), 0.01)
+        # Knowing the opponent holds the ancho de espada only makes a good hand worse
+        good = self.ids((3, Card.COPA), (3, Card.ORO), (7, Card.ORO))
+        self.assertLess(equity.hand_equity(good, True, Card(1, Card.ESPADA).id), equity.hand_equity(good, True))
+        # We hold the only card of that value
+        self.assertIsNone(equity.hand_equity(best, True, Card(1, Card.ESPADA).id))
+
+    def test_equity_matches_brute_force(self):
+        mine = self.ids((3, Card.COPA), (2, Card.ORO), (5, Card.BASTO))
+        values = tuple(sorted(TRUCO_VALUE[i] for i in mine))
+        rest = [c.id for c in CARDS if c.id not in mine]
+        for mano in (True, False):
+            seat = 1 if mano else 2
+            wins = total = 0
+            for theirs in combinations(rest, 3):
+                theirs = tuple(sorted(TRUCO_VALUE[i] for i in theirs))
+                wins += equity._trick_play(values, theirs, (), seat, seat)
+                total += 1
+            self.assertEqual(total, 7770)
+            self.assertAlmostEqual(equity.hand_equity(mine, mano), wins / total, places=4)
+
+    def test_lost_first_trick_lowers_truco_equity(self):
+        answers = {}
+        for lost in (False, True):
+            bot = HeuristicBot("Bot", rng=random.Random(0))
+            bot.rng.random = lambda: 1.0 # no bluffs
+            game = TrucoGame(Player("P1"), bot, quiet=True, seed=1)
+            game.p1.hand = [Card(12, Card.COPA), Card(4, Card.ORO), Card(1, Card.ESPADA)]
+            bot.hand = [Card(2, Card.ORO), Card(11, Card.COPA), Card(5, Card.BASTO)]
+            dealt = [c.id for c in bot.hand]
+            if lost:
+                self.assertTrue(game.handle_action(game.p1, 'play_card_0')[0])
+                self.assertTrue(game.handle_action(bot, 'play_card_2')[0])
+                self.assertEqual(game.round_winners, [1])
+            self.assertTrue(game.handle_action(game.p1, 'call_truco')[0])
+            state = game.get_state_for_player(bot)
+            answers[lost] = (bot.truco_equity(state), bot.get_action(state))
+        # Before any trick the dealt hand is worth accepting
+        self.assertEqual(answers[False], (equity.hand_equity(dealt, False), 'truco_quiero'))
+        # but not once the first trick is lost with the 5 of basto
+        self.assertEqual(answers[True][1], 'truco_no_quiero')
+        self.assertLess(answers[True][0], equity.hand_equity(dealt, False, Card(12, Card.COPA).id))
+        self.assertAlmostEqual(answers[True][0], equity.trick_equity(
+            [Card(2, Card.ORO).id, Card(11, Card.COPA).id], dealt + [Card(12, Card.COPA).id], 2, [2], False))
+
+    def test_table_round_trip(self):
+        num_classes, class_of, table = equity.get_table()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'equity.bin')
+            equity.save_table(path, num_classes, class_of, table)
+            self.assertEqual(equity.load_table(path), (num_classes, class_of, table))
+            with open(path, 'r+b') as f:
+                f.write(b'XXXX')
+            with self.assertRaises(ValueError):
+                equity.load_table(path)
+
+class TestEnvidoCFR(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # A quickly trained table instead of the full one built on first use
+        cls.tmp = tempfile.TemporaryDirectory()
+        path = os.path.join(cls.tmp.name, 'envido_cfr.bin')
+        envido_cfr.save_table(path, envido_cfr.train_all(iterations=20, processes=1)[0])
+        cls.previous = envido_cfr._loaded
+        envido_cfr._loaded = envido_cfr.load_table(path)
+
+    @classmethod
+    def tearDownClass(cls):
+        envido_cfr._loaded = cls.previous
+        cls.tmp.cleanup()
+
+    def test_envido_ladder(self):
+        game = TrucoGame(Player("A"), Player("B"), quiet=True, seed=1)
+        mano, pie = game.p1, game.p2
+        game.handle_action(mano, 'call_envido')
+        self.assertIn('call_envido', game.get_valid_actions(pie))
+        game.handle_action(pie, 'call_envido')
+        self.assertEqual(game.envido_state, 'envido_envido')
+        self.assertEqual(game.get_valid_actions(mano), ['envido_quiero', 'envido_no_quiero', 'call_real_envido', 'call_falta_envido'])
+        game.handle_action(mano, 'call_real_envido')
+        self.assertEqual(game.envido_state, 'envido_envido_real_envido')
+        game.handle_action(pie, 'envido_no_quiero')
+        # Rejecting pays what was accepted before the last call
+        self.assertEqual((game.p1_score, game.p2_score), (4, 0))
+
+    def test_solver_converges(self):
+        solver = envido_cfr.EnvidoCFR(falta=15)
+        solver.iterate(20)
+        early = solver.exploitability()
+        solver.iterate(280)
+        self.assertLess(solver.exploitability(), early)
+        self.assertLess(solver.exploitability(), 0.02)
+
+    def test_checkpoint_resume(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            envido_cfr.train((5, 10, tmp, 5))
+            _, resumed, _ = envido_cfr.train((5, 20, tmp, 5))
+        _, straight, _ = envido_cfr.train((5, 20, None, 5))
+        self.assertTrue((resumed == straight).all())
+
+    def test_bot_plays_full_match(self):
+        game = TrucoGame(CFRBot("CFR", rng=random.Random(1)), HeuristicBot("Bot", rng=random.Random(2)),
+                         target_score=15, quiet=True, seed=4)
+        self.assertIn(game.play(), (game.p1, game.p2))
+        policy = envido_cfr.envido_policy(True, (), 33, 15)
+        self.assertEqual([a for a, _ in policy], ['pass', 'call_envido', 'call_real_envido', 'call_falta_envido'])
+        self.assertIsNone(envido_cfr.envido_policy(True, ('envido', 'envido'), 33, 15))
+
+class TestGameRegistry(unittest.TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.registry = GameRegistry(max_games=3, ttl=60, clock=lambda: self.now)
+
+    def new_game(self):
+        return self.registry.create(TrucoGame(Player("A"), Player("B"), quiet=True))
+
+    def test_games_are_independent(self):
+        first, second = self.new_game(), self.new_game()
+        self.assertNotEqual(first.id, second.id)
+        first.game.handle_action(first.game.current_turn, 'play_card_0')
+        self.assertIs(self.registry.get(first.id), first)
+        self.assertEqual(len(second.game.played_cards_p1) + len(second.game.played_cards_p2), 0)
+        self.assertIsNone(self.registry.get('unknown'))
+
+    def test_rejected_bot_moves_do_not_stall_the_game(self):
+        class Confused(Player):
+            def get_action(self, game_state):
+                return 'call_flor'
+        session = self.registry.create(TrucoGame(Player("A"), Confused("B"), quiet=True, seed=2))
+        game = session.game
+        scheduler = BotScheduler(delay=0)
+        try:
+            for _ in range(3):
+                with session.lock:
+                    if game.current_turn is game.p1:
+                        self.assertTrue(session.act(game.p1, game.get_valid_actions(game.p1)[0])[0])
+                    scheduler.schedule(session)
+                self.assertTrue(scheduler.wait_idle(5))
+                self.assertIs(game.current_turn, game.p1)
+        finally:
+            scheduler.shutdown()
+        self.assertGreater(session.actions, 3)
+
+    def test_bot_thinks_without_the_session_lock(self):
+        thinking, go = threading.Event(), threading.Event()
+        calls = []
+        class Slow(Player):
+            def get_action(self, game_state):
+                calls.append(game_state['version'])
+                thinking.set()
+                go.wait(5)
+                return game_state['valid_actions'][0]
+        session = self.registry.create(TrucoGame(Player("A"), Slow("B"), quiet=True, seed=2))
+        game = session.game
+        scheduler = BotScheduler(delay=0)
+        try:
+            with session.lock:
+                if game.current_turn is game.p1:
+                    self.assertTrue(session.act(game.p1, 'play_card_0')[0])
+                scheduler.schedule(session)
+            self.assertTrue(thinking.wait(5))
+            # The game answers while the bot thinks. If it changes meanwhile, the move the
+            # bot thought about is dropped and the bot is asked again.
+            self.assertTrue(session.lock.acquire(timeout=1))
+            session.view()
+            game.version += 1
+            version = game.version
+            session.lock.release()
+            go.set()
+            self.assertTrue(scheduler.wait_idle(5))
+        finally:
+            go.set()
+            scheduler.shutdown()
+        # Asked again at the new version (and then on, if it kept the turn)
+        self.assertEqual(calls[1], version)
+        self.assertIs(game.current_turn, game.p1)
+
+    def test_least_recently_used_game_is_evicted(self):
+        a, b, c = self.new_game(), self.new_game(), self.new_game()
+        self.registry.get(a.id)
+        self.new_game()
+        self.assertEqual(len(self.registry), 3)
+        self.assertIsNone(self.registry.get(b.id))
+        self.assertIs(self.registry.get(a.id), a)
+        self.assertIs(self.registry.get(c.id), c)
+
+    def test_view_deltas_rebuild_the_full_state(self):
+        session = self.registry.create(TrucoGame(HeuristicBot("A", rng=random.Random(1)),
+                                                 HeuristicBot("B", rng=random.Random(2)), seed=5))
+        game = session.game
+        client = session.view(text=True)
+        self.assertEqual(client['event_start'], 0)
+        while game.phase != GamePhase.GAME_OVER and game.hand_number < 3:
+            player = game.current_turn
+            game.handle_action(player, player.get_action(game.get_state_for_player(player)))
+            delta = session.view(client['version'], text=True)
+            self.assertEqual(delta['since'], client['version'])
+            self.assertLess(len(delta), len(client))
+            # New events are appended to the ones the client has
+            kept = delta.pop('event_start') - client['event_start']
+            events = client['events'][:kept] + delta.pop('events')
+            text = client['text'][:kept] + delta.pop('text')
+            client = dict(client, **delta, events=events, text=text)
+            full = session.view(text=True)
+            self.assertEqual({k: v for k, v in client.items() if k != 'since'}, full)
+        self.assertEqual([line for entry in client['text'] for line in entry.split("\n") if line], game.log)
+
+    def test_idle_games_expire(self):
+        a, b = self.new_game(), self.new_game()
+        self.now = 50
+        self.registry.get(b.id)
+        self.now = 100
+        self.assertIsNone(self.registry.get(a.id))
+        self.assertIs(self.registry.get(b.id), b)
+        self.now = 200
+        self.new_game()
+        self.assertEqual(len(self.registry), 1)
+
+class TestBatchEnv(unittest.TestCase):
+    def test_matches_truco_game(self):
+        # Step the env from every state of random games and compare with TrucoGame.
+        # When a hand ends the two deal different cards, so the new deal is not compared.
+        rng = random.Random(3)
+        env = BatchTrucoEnv(1, target_score=15, auto_reset=False)
+        deal = {HAND1, HAND2, ENVIDO_POINTS1, ENVIDO_POINTS2}
+        for seed in range(40):
+            game = TrucoGame(Player("A"), Player("B"), target_score=15, quiet=True, seed=seed)
+            while game.phase == GamePhase.PLAYING:
+                snapshot = game.snapshot()
+                env.restore(0, snapshot)
+                self.assertEqual(env.snapshot(0), snapshot)
+                player = game.current_turn
+                seat = 1 if player is game.p1 else 2
+                mask = game.get_valid_mask(player)
+                self.assertEqual(int(env.legal_bits()[0]), mask)
+                self.assertEqual(list(env.observe()[0]),
+                                 observation_from_info_set(game.info_set(player), seat, 15))
+                action = rng.choice(actions.MASK_ACTIONS[mask])
+                hand_number = game.hand_number
+                game.handle_action_id(player, action)
+                _, _, rewards, dones = env.step([action])
+                expected, got = game.snapshot(), env.snapshot(0)
+                if game.hand_number != hand_number and game.phase == GamePhase.PLAYING:
+                    expected = [v for i, v in enumerate(expected) if i not in deal]
+                    got = [v for i, v in enumerate(got) if i not in deal]
+                self.assertEqual(got, expected)
+                self.assertEqual(list(rewards[0]), [game.p1_score - snapshot[P1_SCORE],
+                                                    game.p2_score - snapshot[P2_SCORE]])
+                self.assertEqual(bool(dones[0]), game.phase == GamePhase.GAME_OVER)
+
+    def test_finished_games_reset(self):
+        env = BatchTrucoEnv(64, target_score=5, seed=1)
+        obs, mask = env.reset()
+        rng = np.random.default_rng(1)
+        finished = 0
+        for _ in range(500):
+            obs, mask, rewards, dones = env.step((rng.random(mask.shape) * mask).argmax(axis=1))
+            self.assertTrue(mask.any(axis=1).all())
+            finished += dones.sum()
+            self.assertTrue((env.scores[dones] == 0).all())
+        self.assertGreater(finished, 64)
+        self.assertTrue((env.scores < 5).all())
+
+class TestNeuralBot(unittest.TestCase):
+    def test_state_encoding_matches_batch_env(self):
+        env = BatchTrucoEnv(1, target_score=30, auto_reset=False)
+        game = TrucoGame(Player("A"), Player("B"), quiet=True, seed=4)
+        game.handle_action(game.p1, "play_card_1")
+        env.restore(0, game.snapshot())
+        state = game.get_state_for_player(game.p2)
+        x = neural.encode_state(state)
+        self.assertEqual(x.shape, (neural.FEATURE_SIZE,))
+        np.testing.assert_array_equal(x, neural.features(env.observe())[0])
+        np.testing.assert_array_equal(neural.mask_array(state['valid_mask']), env.legal_mask()[0])
+
+    def test_weights_round_trip(self):
+        net = neural.PolicyNet.initialize(seed=1)
+        net.generation = 7
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'policy.npz')
+            net.save(path)
+            loaded = neural.PolicyNet.load(path)
+            self.assertEqual(loaded.generation, 7)
+            x = neural.features(BatchTrucoEnv(4, seed=0).reset()[0])
+            np.testing.assert_array_equal(loaded.forward(x), net.forward(x))
+            np.savez(path, format=neural.FORMAT_VERSION + 1, generation=0)
+            with self.assertRaises(ValueError):
+                neural.PolicyNet.load(path)
+
+    def test_plays_only_valid_actions(self):
+        net = neural.PolicyNet.initialize(seed=2)
+        for seed in range(5):
+            game = TrucoGame(NeuralBot("N", rng=random.Random(seed), net=net), RandomBot("R", rng=random.Random(seed)),
+                             target_score=15, quiet=True, seed=seed)
+            while game.phase != GamePhase.GAME_OVER:
+                player = game.current_turn
+                success, msg = game.handle_action(player, player.get_action(game.get_state_for_player(player)))
+                self.assertTrue(success, msg)
+
+    def test_gradients_match_finite_differences(self):
+        net = neural.PolicyNet.initialize(seed=4, hidden_sizes=(8,))
+        net.weights = [w.astype(np.float64) for w in net.weights]
+        net.biases = [b.astype(np.float64) + 0.1 for b in net.biases]
+        obs, masks = BatchTrucoEnv(6, seed=4).reset()
+        x = neural.features(obs).astype(np.float64)
+        actions = np.array([np.flatnonzero(m)[0] for m in masks])
+        advantages = np.linspace(-1, 1, 6)
+
+        def loss():
+            p = net.policy(x, masks)[np.arange(6), actions]
+            return -(advantages * np.log(p)).mean()
+
+        grad_w, grad_b = net.gradients(x, masks, actions, advantages)
+        for params, grads in ((net.weights, grad_w), (net.biases, grad_b)):
+            for p, g in zip(params, grads):
+                index = np.unravel_index(np.abs(g).argmax(), g.shape)
+                p[index] += 1e-6
+                up = loss()
+                p[index] -= 2e-6
+                down = loss()
+                p[index] += 1e-6
+                self.assertAlmostEqual((up - down) / 2e-6, g[index], places=5)
+
+    def test_concurrent_requests_share_batches(self):
+        net = neural.PolicyNet.initialize(seed=3)
+        inference = neural.BatchedInference(net, window=0.05)
+        env = BatchTrucoEnv(8, seed=3)
+        obs, masks = env.reset()
+        x = neural.features(obs)
+        results = [None] * 8
+        barrier = threading.Barrier(8)
+
+        def ask(i):
+            barrier.wait()
+            results[i] = inference.predict(x[i], masks[i])
+
+        threads = [threading.Thread(target=ask, args=(i,)) for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        inference.shutdown()
+        self.assertEqual(inference.requests, 8)
+        self.assertLess(inference.batches, 8)
+        np.testing.assert_allclose(np.stack(results), net.policy(x, masks), rtol=1e-5)
+        self.assertTrue((np.stack(results)[~masks] == 0).all())
+
+    def test_failed_batches_reach_their_callers(self):
+        net = neural.PolicyNet.initialize(seed=4)
+        obs, masks = BatchTrucoEnv(1, seed=4).reset()
+        x = neural.features(obs)
+        inference = neural.BatchedInference(net, window=0)
+        policy, net.policy = net.policy, lambda features, mask: 1 / 0
+        with self.assertRaises(ZeroDivisionError):
+            inference.predict(x[0], masks[0])
+        # The inference thread is still serving
+        net.policy = policy
+        np.testing.assert_allclose(inference.predict(x[0], masks[0]), policy(x, masks)[0], rtol=1e-5)
+        inference.shutdown()
+
+class TestSelfPlay(unittest.TestCase):
+    def test_replay_buffer_wraps_around(self):
+        buffer = selfplay.ReplayBuffer(8)
+        try:
+            records = np.zeros(5, dtype=selfplay.RECORD)
+            records['action'] = np.arange(5)
+            buffer.write(records, games=1)
+            self.assertEqual(len(buffer), 5)
+            records['action'] += 5
+            buffer.write(records, games=1)
+            self.assertEqual(len(buffer), 8)
+            self.assertEqual(buffer.header[selfplay.GAMES], 2)
+            # The oldest two were overwritten
+            self.assertEqual(sorted(buffer.records['action']), list(range(2, 10)))
+            sample = buffer.sample(100, np.random.default_rng(0))
+            self.assertTrue(set(sample['action']) <= set(range(2, 10)))
+        finally:
+            buffer.close(unlink=True)
+
+    def test_actors_feed_the_learner(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'policy.npz')
+            totals = selfplay.train(seconds=3, actors=1, envs=32, capacity=20000, batch_size=128,
+                                    publish_every=5, target_score=15, output=path, report=lambda line: None)
+            self.assertGreater(totals['games'], 0)
+            self.assertGreater(totals['updates'], 0)
+            self.assertEqual(neural.PolicyNet.load(path).generation, totals['generation'])
+
+class TestRecords(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'games.rec')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_games_replay_exactly(self):
+        games = []
+        with records.RecordWriter(self.path) as writer:
+            for seed in range(6):
+                game = TrucoGame(HeuristicBot("A", rng=random.Random(seed)), RandomBot("B", rng=random.Random(seed)),
+                                 target_score=15, quiet=True, seed=seed if seed % 2 else None)
+                recorder = records.GameRecorder(game)
+                game.play()
+                writer.write(recorder.record())
+                games.append(game)
+        # Read back in chunks smaller than a record
+        read_size, records.READ_SIZE = records.READ_SIZE, 7
+        try:
+            replayed = [records.replay(r) for r in records.read_records(self.path)]
+        finally:
+            records.READ_SIZE = read_size
+        self.assertEqual([g.snapshot() for g in replayed], [g.snapshot() for g in games])
+
+    def test_tournament_appends_records(self):
+        tournament.run_tournament('heuristic', 'random', 3, 15, base_seed=2, processes=1, record=self.path)
+        results = tournament.run_tournament('heuristic', 'random', 3, 15, base_seed=3, processes=1, record=self.path)
+        stored = list(records.read_records(self.path))
+        self.assertEqual(len(stored), 6)
+        self.assertEqual([r.seed for r in stored[3:]], [tournament.game_seed(3, i) for i in range(3)])
+        for (_, a_is_p1, a_score, b_score, _), record in zip(results, stored[3:]):
+            self.assertEqual(record.scores, (a_score, b_score) if a_is_p1 else (b_score, a_score))
+
+    def test_corrupt_records_are_rejected(self):
+        record = records.GameRecord(1 << 40, 15, ((0, 1, 2, 3, 4, 5),), bytes([0, 0]), (15, 0))
+        self.assertEqual(records.decode(records.encode(record)[1:]), record)
+        with records.RecordWriter(self.path) as writer:
+            writer.write(record)
+        with self.assertRaises(ValueError):
+            records.replay(record)
+        with open(self.path, 'ab') as f:
+            f.write(records.encode(record)[:-3])
+        with self.assertRaises(ValueError):
+            list(records.read_records(self.path))
+
+class TestAnalytics(unittest.TestCase):
+    def test_counts_match_the_records(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path, out = os.path.join(tmp, 'games.rec'), os.path.join(tmp, 'stats')
+            tournament.run_tournament('heuristic', 'random', 12, 15, base_seed=5, processes=1, record=path)
+            tournament.run_tournament('heuristic', 'heuristic', 4, 20, base_seed=5, processes=1, record=path)
+            with records.RecordWriter(path) as writer:
+                # Scores that the actions do not lead to
+                good = next(records.read_records(path))
+                writer.write(good._replace(scores=(good.scores[0] + 1, good.scores[1])))
+            stored = list(records.read_records(path))[:-1]
+            summary = analytics.build([path], out, processes=1)
+            self.assertEqual((summary['games'], summary['errors']), (17, 1))
+            counts, _ = analytics.load(out)
+            self.assertEqual(list(counts['games'][[15, 20]]), [12, 4])
+            self.assertEqual(counts['first_mano_wins'].sum(), sum(r.scores[0] >= r.target_score for r in stored))
+            # Nothing of the broken game counts: the same as without it
+            without = os.path.join(tmp, 'without.rec')
+            with records.RecordWriter(without) as writer:
+                for record in stored:
+                    writer.write(record)
+            analytics.build([without], os.path.join(tmp, 'clean'), processes=1)
+            clean, _ = analytics.load(os.path.join(tmp, 'clean'))
+            for name, column in counts.items():
+                np.testing.assert_array_equal(column, clean[name])
+            # Every dealt hand ends once
+            self.assertEqual(counts['hands'].sum(), sum(len(r.hands) for r in stored))
+            self.assertEqual(counts['mano_points'].sum() + counts['pie_points'].sum(),
+                             sum(sum(r.scores) for r in stored))
+            self.assertIn("Mano advantage", analytics.report(out))
+
+            before = {name: np.array(column) for name, column in counts.items()}
+            analytics.build([path], out, processes=1, append=True)
+            counts, summary = analytics.load(out)
+            self.assertEqual(summary['games'], 34)
+            for name, column in before.items():
+                np.testing.assert_array_equal(counts[name], 2 * column)
+
+class TestGameStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'games.db')
+        self.stores = []
+
+    def tearDown(self):
+        for store in self.stores:
+            store.close()
+        self.tmp.cleanup()
+
+    def new_store(self):
+        store = GameStore(self.path, lambda: (Player("A"), Player("B")), snapshot_every=5)
+        self.stores.append(store)
+        return store
+
+    def test_games_are_rebuilt_after_a_restart(self):
+        registry = GameRegistry(store=self.new_store())
+        bots = (HeuristicBot("A", rng=random.Random(1)), HeuristicBot("B", rng=random.Random(2)))
+        session = registry.create(TrucoGame(*bots, target_score=15, seed=11))
+        game = session.game
+        for checkpoint in (3, 5, 12, 40):
+            while session.actions < checkpoint and game.phase == GamePhase.PLAYING:
+                player = game.current_turn
+                self.assertTrue(session.act(player, player.get_action(game.get_state_for_player(player)))[0])
+            # A new server over the same file, loading the game on first use
+            registry.store.flush()
+            loaded = GameRegistry(store=self.new_store()).get(session.id)
+            self.assertEqual(loaded.actions, session.actions)
+            self.assertEqual(loaded.game.snapshot(), game.snapshot())
+            self.assertEqual((loaded.game.log, loaded.game.version), (game.log, game.version))
+        # The rebuilt game deals the same cards from here on
+        copy = loaded.game
+        while game.phase == GamePhase.PLAYING:
+            player = game.current_turn
+            action = player.get_action(game.get_state_for_player(player))
+            game.handle_action(player, action)
+            copy.handle_action(copy.p1 if player is game.p1 else copy.p2, action)
+            self.assertEqual(copy.snapshot(), game.snapshot())
+        self.assertIsNone(registry.get('unknown'))
+
+    def test_games_are_loaded_once_outside_the_registry_lock(self):
+        store = self.new_store()
+        session = GameRegistry(store=store).create(TrucoGame(Player("A"), Player("B"), seed=3))
+        self.assertTrue(session.act(session.game.p1, 'play_card_0')[0])
+        store.flush()
+        registry = GameRegistry(store=self.new_store())
+        flushes = []
+        flush = registry.store.flush
+        def slow_flush(timeout=None):
+            # Other games stay reachable while this one is read
+            flushes.append(registry.get('unknown'))
+            time.sleep(0.05)
+            return flush(timeout)
+        registry.store.flush = slow_flush
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(registry.get(session.id))) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        # Unknown ids are answered without a flush
+        self.assertEqual(flushes, [None])
+        self.assertEqual(registry.loaded, 1)
+        self.assertEqual({id(s) for s in results}, {id(results[0])})
+        self.assertEqual(results[0].game.snapshot(), session.game.snapshot())
+
+    def stored_games(self, store):
+        store.flush()
+        conn = sqlite3.connect(self.path)
+        try:
+            return {table: {row[0] for row in conn.execute(f"SELECT {column} FROM {table}")}
+                    for table, column in (("games", "id"), ("actions", "game_id"), ("snapshots", "game_id"))}
+        finally:
+            conn.close()
+
+    def test_finished_and_expired_games_are_deleted(self):
+        self.now = 0
+        registry = GameRegistry(max_games=2, ttl=100, clock=lambda: self.now, store=self.new_store())
+        def new_game(seed):
+            session = registry.create(TrucoGame(Player("A"), Player("B"), seed=seed))
+            for _ in range(6): # past a snapshot
+                game = session.game
+                self.assertTrue(session.act(game.current_turn, game.get_valid_actions(game.current_turn)[0])[0])
+            return session
+        over, live = new_game(1), new_game(2)
+        over.game.phase = GamePhase.GAME_OVER
+        evicted = new_game(3) # makes room by dropping `over`
+        self.assertEqual(self.stored_games(registry.store)["games"], {live.id, evicted.id})
+        # Evicted games that can still be played are kept, removed ones are not
+        registry.get(live.id)
+        fourth = new_game(4)
+        registry.remove(live.id)
+        stored = self.stored_games(registry.store)
+        self.assertIn(evicted.id, stored["games"])
+        self.assertNotIn(live.id, stored["games"])
+        self.assertEqual(stored["actions"], stored["games"])
+        self.assertEqual(stored["snapshots"], stored["games"])
+        # Past the ttl games expire from memory and from the store
+        self.now = 150
+        self.assertIsNone(registry.get(fourth.id))
+        self.assertEqual(self.stored_games(registry.store)["games"], {evicted.id})
+        # and the sweep finds the ones only the store has
+        registry.store.purge(0)
+        self.assertEqual(self.stored_games(registry.store), {"games": set(), "actions": set(), "snapshots": set()})
+
+    def test_writes_are_committed_in_groups(self):
+        store = self.new_store()
+        store.commit_interval = 0.05
+        game = TrucoGame(Player("A"), Player("B"), seed=1)
+        store.create('g', game)
+        for seq in range(1, 101):
+            store.append('g', seq, 1, 0, game)
+        self.assertTrue(store.flush(5))
+        self.assertEqual(store.committed, store.queued)
+        self.assertLess(store.batches, 10)
+
+    def test_failed_writes_are_reported(self):
+        store = self.new_store()
+        session = GameRegistry(store=store).create(TrucoGame(Player("A"), Player("B"), seed=1))
+        for _ in range(3):
+            game = session.game
+            self.assertTrue(session.act(game.current_turn, game.get_valid_actions(game.current_turn)[0])[0])
+        self.assertTrue(store.flush(5))
+        # The same action number twice: only the second write is lost
+        store.append(session.id, 3, 1, 0, session.game)
+        self.assertFalse(store.flush(5))
+        self.assertEqual((store.lost, store.committed), (1, store.queued - 1))
+        self.assertEqual(store.load(session.id)[0].snapshot(), session.game.snapshot())
+        # A game missing an action is not replayed past it
+        conn = sqlite3.connect(self.path)
+        with conn:
+            conn.execute("DELETE FROM actions WHERE seq = 2")
+        conn.close()
+        self.assertRaises(ValueError, store.load, session.id)
+
+    def test_games_move_to_their_new_shard(self):
+        ring = HashRing(['w0', 'w1', 'w2'])
+        old = GameRegistry(store=self.new_store())
+        old.reassign(lambda game_id: ring.owner(game_id) == 'w0')
+        sessions = [old.create(TrucoGame(Player("A"), Player("B"), seed=i), f"game{i}")
+                    for i in range(60) if ring.owner(f"game{i}") == 'w0']
+        for session in sessions:
+            self.assertTrue(session.act(session.game.p1, 'play_card_0')[0])
+        # A fourth shard takes some of w0's games and nothing moves between the others
+        bigger = HashRing(['w0', 'w1', 'w2', 'w3'])
+        moved = [s for s in sessions if bigger.owner(s.id) != 'w0']
+        self.assertTrue(moved)
+        self.assertEqual({bigger.owner(s.id) for s in moved}, {'w3'})
+        self.assertEqual(old.reassign(lambda game_id: bigger.owner(game_id) == 'w0'), len(moved))
+        new = GameRegistry(store=self.new_store())
+        new.reassign(lambda game_id: bigger.owner(game_id) == 'w3')
+        for session in moved:
+            self.assertTrue(session.released)
+            self.assertRaises(GameMoved, old.get, session.id)
+            self.assertRaises(GameMoved, old.create, TrucoGame(Player("A"), Player("B"), seed=1), session.id)
+            self.assertEqual(new.get(session.id).game.snapshot(), session.game.snapshot())
+        self.assertEqual(len(old), len(sessions) - len(moved))
+
+class TestBench(unittest.TestCase):
+    def test_regressions_respect_each_metric_direction(self):
+        baseline = {"hands_per_s": 1000.0, "handle_action_us": 10.0, "matches_per_s": 50.0}
+        metrics = {"hands_per_s": 790.0, "handle_action_us": 11.9, "matches_per_s": 60.0, "new_per_s": 1.0}
+        self.assertEqual(bench.regressions(baseline, metrics, 0.2), [("hands_per_s", 1000.0, 790.0)])
+        metrics["handle_action_us"] = 12.1
+        self.assertEqual([m for m, _, _ in bench.regressions(baseline, metrics, 0.2)], ["hands_per_s", "handle_action_us"])
+
+    def test_runs_are_recorded(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'history.json')
+            self.assertEqual(bench.load_history(path), [])
+            metrics = bench.run(['cards', 'engine'], seconds=0.01, repeat=1)
+            self.assertEqual(set(metrics), {"truco_value_per_s", "envido_points_per_s", "hands_per_s", "matches_per_s"})
+            self.assertTrue(all(value > 0 for value in metrics.values()))
+            bench.record(metrics, path)
+            bench.record(metrics, path)
+            history = bench.load_history(path)
+            self.assertEqual(len(history), 2)
+            self.assertEqual(history[-1]["metrics"], metrics)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,175 @@
+import argparse
+import json
+import math
+import os
+import random
+import time
+from multiprocessing import Pool
+
+from envido_cfr import get_table as get_envido_table
+from equity import get_table
+from game import TrucoGame
+from player import CFRBot, HeuristicBot, ISMCTSBot, NeuralBot, RandomBot
+from records import GameRecorder, RecordWriter, encode
+
+# Policies that can take part in a tournament, by command line name
+BOTS = {
+    'heuristic': HeuristicBot,
+    'random': RandomBot,
+    'ismcts': ISMCTSBot,
+    'cfr': CFRBot,
+    'neural': NeuralBot,
+}
+
+def game_seed(base_seed, index):
+    # Every game of a run gets its own seed, so any game can be replayed on its own
+    return (base_seed << 32) + index
+
+def make_game(bot_a, bot_b, target_score, base_seed, index, quiet=True):
+    # Seats alternate so neither policy always starts as mano
+    seed = game_seed(base_seed, index)
+    a = BOTS[bot_a](bot_a, rng=random.Random(f"{seed}:a"))
+    b = BOTS[bot_b](bot_b, rng=random.Random(f"{seed}:b"))
+    a_is_p1 = index % 2 == 0
+    p1, p2 = (a, b) if a_is_p1 else (b, a)
+    # Narrated games are printed whole
+    return TrucoGame(p1, p2, target_score=target_score, quiet=quiet, seed=seed, log_size=None), a_is_p1
+
+def play_match(task, record=False):
+    bot_a, bot_b, target_score, base_seed, index = task
+    game, a_is_p1 = make_game(bot_a, bot_b, target_score, base_seed, index)
+    recorder = GameRecorder(game) if record else None
+    game.play()
+    a_score, b_score = (game.p1_score, game.p2_score) if a_is_p1 else (game.p2_score, game.p1_score)
+    result = index, a_is_p1, a_score, b_score, game.hand_number
+    if record:
+        return result, encode(recorder.record())
+    return result
+
+def record_match(task):
+    # play_match, plus the game's encoded record
+    return play_match(task, record=True)
+
+def wilson_interval(wins, n, z=1.96):
+    if n == 0:
+        return 0.0, 0.0
+    p = wins / n
+    center = (p + z * z / (2 * n)) / (1 + z * z / n)
+    half = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / (1 + z * z / n)
+    return center - half, center + half
+
+def ratio_interval(numerators, denominators, z=1.96):
+    # Ratio estimator sum(x) / sum(y) with a delta-method confidence interval
+    n = len(numerators)
+    total = sum(denominators)
+    if n < 2 or total == 0:
+        ratio = sum(numerators) / total if total else 0.0
+        return ratio, ratio, ratio
+    ratio = sum(numerators) / total
+    mean_y = total / n
+    var = sum((x - ratio * y) ** 2 for x, y in zip(numerators, denominators)) / (n - 1)
+    half = z * math.sqrt(var / n) / mean_y
+    return ratio, ratio - half, ratio + half
+
+def summarize(results, bot_a, bot_b, target_score):
+    n = len(results)
+    wins = sum(1 for _, _, a, b, _ in results if a > b)
+    hands = sum(r[4] for r in results)
+    a_points = sum(r[2] for r in results)
+    b_points = sum(r[3] for r in results)
+    low, high = wilson_interval(wins, n)
+    # Point margin per hand, the lower-variance strength measure
+    margin, margin_low, margin_high = ratio_interval([r[2] - r[3] for r in results], [r[4] for r in results])
+    as_p1 = [r for r in results if r[1]]
+    return {
+        "bot_a": bot_a,
+        "bot_b": bot_b,
+        "target_score": target_score,
+        "games": n,
+        "hands": hands,
+        "a_wins": wins,
+        "a_win_rate": wins / n if n else 0.0,
+        "a_win_rate_ci95": [low, high],
+        "a_win_rate_as_mano": sum(1 for r in as_p1 if r[2] > r[3]) / len(as_p1) if as_p1 else 0.0,
+        "a_points_per_hand": a_points / hands if hands else 0.0,
+        "b_points_per_hand": b_points / hands if hands else 0.0,
+        "margin_per_hand": margin,
+        "margin_per_hand_ci95": [margin_low, margin_high],
+    }
+
+def collect(outcomes, writer):
+    # Results of play_match, or of record_match with each record appended to writer
+    if writer is None:
+        return list(outcomes)
+    results = []
+    for result, data in outcomes:
+        writer.write(data)
+        results.append(result)
+    return results
+
+def run_tournament(bot_a, bot_b, games, target_score=30, base_seed=0, processes=None, chunksize=None, record=None):
+    # record: path of a game record file (records.py) every game is appended to
+    tasks = [(bot_a, bot_b, target_score, base_seed, i) for i in range(games)]
+    play = record_match if record else play_match
+    writer = RecordWriter(record) if record else None
+    try:
+        if processes == 1:
+            results = collect(map(play, tasks), writer)
+        else:
+            # Load (or build) the lookup tables once so forked workers share them
+            get_table()
+            if 'cfr' in (bot_a, bot_b):
+                get_envido_table()
+            if 'neural' in (bot_a, bot_b):
+                from neural import get_net # numpy is only needed for this bot
+                get_net()
+            processes = processes or os.cpu_count()
+            chunksize = chunksize or max(1, games // (processes * 8))
+            with Pool(processes) as pool:
+                results = collect(pool.imap_unordered(play, tasks, chunksize), writer)
+    finally:
+        if writer is not None:
+            writer.close()
+    results.sort()
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Play bot-vs-bot truco matches across all cores")
+    parser.add_argument('bot_a', choices=sorted(BOTS))
+    parser.add_argument('bot_b', choices=sorted(BOTS))
+    parser.add_argument('-n', '--games', type=int, default=1000)
+    parser.add_argument('--target-score', type=int, default=30)
+    parser.add_argument('--seed', type=int, default=0, help="base seed of the run")
+    parser.add_argument('--processes', type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument('--json', help="write the summary to this file")
+    parser.add_argument('--record', metavar='PATH', help="append every game to this game record file")
+    parser.add_argument('--show-game', type=int, metavar='INDEX', help="replay one game of the run and print its log")
+    args = parser.parse_args(argv)
+
+    if args.show_game is not None:
+        game, _ = make_game(args.bot_a, args.bot_b, args.target_score, args.seed, args.show_game, quiet=False)
+        game.play()
+        print("\n".join(game.log))
+        return
+
+    start = time.perf_counter()
+    results = run_tournament(args.bot_a, args.bot_b, args.games, args.target_score, args.seed, args.processes,
+                             record=args.record)
+    elapsed = time.perf_counter() - start
+    summary = summarize(results, args.bot_a, args.bot_b, args.target_score)
+    summary["seconds"] = elapsed
+
+    low, high = summary["a_win_rate_ci95"]
+    print(f"{args.bot_a} vs {args.bot_b}: {summary['games']} games, {summary['hands']} hands in {elapsed:.1f}s "
+          f"({summary['hands'] / elapsed:.0f} hands/s)")
+    print(f"  {args.bot_a} win rate {summary['a_win_rate']:.3f} (95% CI {low:.3f}-{high:.3f})")
+    print(f"  points per hand: {args.bot_a} {summary['a_points_per_hand']:.3f}, {args.bot_b} {summary['b_points_per_hand']:.3f}")
+    low, high = summary["margin_per_hand_ci95"]
+    print(f"  margin per hand {summary['margin_per_hand']:+.3f} (95% CI {low:+.3f} to {high:+.3f})")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+if __name__ == '__main__':
+    main()